@@ -2,21 +2,62 @@
 # Cada uno tiene una función específica para que todo ande bien.
 from sqlalchemy import event # Para escuchar eventos de SQLAlchemy, en este caso, al conectar a la base de datos.
 from sqlalchemy.engine import Engine # El motor de la base de datos para los eventos.
+from sqlalchemy.orm import Session as SessionORM # Para escuchar los commits (y avisar al feed de pedidos).
+from sqlalchemy.engine import make_url # Para armar la URL de solo lectura a partir de la de la base.
+from sqlalchemy.exc import TimeoutError as TimeoutErrorPool # Cuando la conexión de escritura no se libera a tiempo.
 from sqlite3 import Connection as SQLite3Connection # Para verificar si la conexión es de SQLite.
 
 # Módulos principales de Flask y otras extensiones que utilizo.
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, Response, stream_with_context, g, has_request_context, send_file, abort
+from flask.json.provider import DefaultJSONProvider # El serializador JSON de Flask, que extiendo para medir cuánto tarda.
+from flask.signals import before_render_template, template_rendered # Señales para medir el tiempo de renderizado de templates.
 from flask_sqlalchemy import SQLAlchemy # La extensión para interactuar con bases de datos usando SQLAlchemy.
+from flask_sqlalchemy.session import Session as SesionFlaskSQLAlchemy # La sesión de la extensión, que extiendo para elegir el motor.
 from werkzeug.security import generate_password_hash, check_password_hash # Para manejar contraseñas de forma segura (hasheo).
-from werkzeug.utils import secure_filename # Para limpiar nombres de archivos y evitar problemas de seguridad al subir.
+from werkzeug.utils import secure_filename, safe_join # Para limpiar nombres de archivos y armar rutas seguras dentro de una carpeta.
+from werkzeug.middleware.proxy_fix import ProxyFix # Para tomar la IP real del cliente cuando hay un proxy adelante.
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user # Extensión para gestionar sesiones de usuario.
 import os # Para interactuar con el sistema operativo (rutas de archivos, variables de entorno).
-from datetime import datetime, UTC # Para manejar fechas y horas, incluyendo la zona horaria UTC.
-from sqlalchemy.orm import selectinload # Para cargar relaciones de forma eficiente y evitar el problema N+1.
+from datetime import datetime, date, timedelta, UTC # Para manejar fechas y horas, incluyendo la zona horaria UTC.
+from sqlalchemy import or_, and_, case, select, update, insert, delete, func, literal, tuple_, exists, union_all # Para armar consultas y sentencias a nivel conjunto (cursor de paginación, reserva de stock, agregados).
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert # Para los upserts (INSERT ... ON CONFLICT) de los agregados de ventas.
 import logging # Para registrar eventos y depurar la aplicación.
+import logging.handlers # Para el QueueHandler/QueueListener que escribe los logs en segundo plano.
+import queue # La cola que conecta los handlers de logging con el hilo escritor.
+import random # Para muestrear los mensajes de DEBUG.
+import atexit # Para frenar el hilo de logging al cerrar la aplicación.
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor # Pools para el hasheo de contraseñas y el procesamiento de imágenes.
+from concurrent.futures.process import BrokenProcessPool
+import io # Para re-codificar las imágenes en memoria antes de calcularles el hash.
+import uuid # Para darle un nombre único a cada imagen subida.
+import time # Para los vencimientos de las cachés en memoria.
+from collections import OrderedDict # Para las cachés LRU (identidades de usuario, catálogo y cotizaciones del carrito).
+import csv # Para importar y exportar el catálogo de productos en CSV.
+import sys # Para escribir las exportaciones por la salida estándar desde la CLI.
+import click # Para los argumentos y opciones de los comandos CLI (viene con Flask).
+import re # Para separar en palabras lo que se escribe en el buscador.
+import bisect # Para ubicar cada latencia en su bucket del histograma.
+import math # Para redondear hacia arriba los segundos de Retry-After.
+from PIL import Image, ImageOps # Pillow, para redimensionar y re-codificar las imágenes de productos.
+import gzip # Para precomprimir los archivos estáticos en el build.
+import mimetypes # Para saber el Content-Type de un estático cuando mando su versión comprimida.
+import posixpath # Para resolver las rutas relativas (url(...)) dentro del CSS.
+from urllib.parse import quote # Para escapar la ruta de la base en la URL de solo lectura.
+try:
+    import brotli # Opcional: si está instalado, el build también genera variantes .br de los estáticos.
+except ImportError:
+    brotli = None
+import json # Para serializar pedidos línea por línea cuando los mando en streaming.
+import base64 # Para codificar los cursores de paginación de forma opaca.
+import hashlib # Para calcular los ETag del catálogo a partir del contenido.
+import threading # Para proteger con un lock las estructuras compartidas entre hilos (como la caché del catálogo).
+import multiprocessing # Para los contadores en memoria compartida entre los workers del servidor de producción.
 from dotenv import load_dotenv # Para cargar variables de entorno desde un archivo .env.
 
 # --- Configuración Específica para SQLite y Foreign Keys ---
+class ConexionSQLiteSoloLectura(SQLite3Connection):
+    """Las conexiones del pool de lectura (mode=ro) usan esta clase, así las reconozco al configurarlas."""
+
 # Escucho el evento 'connect' en el motor de SQLAlchemy.
 @event.listens_for(Engine, "connect")
 def _set_sqlite_pragma(dbapi_connection, connection_record):
@@ -25,21 +66,26 @@ def _set_sqlite_pragma(dbapi_connection, connection_record):
     funcionen correctamente en SQLite. Sin esto, las relaciones como 'ondelete=CASCADE'
     (que borra automáticamente los detalles de un pedido si borro el pedido, por ejemplo)
     no andarían. Lo activo cada vez que se establece una conexión a la base de datos.
+
+    Además aplico el perfil de rendimiento de SQLite (ver SQLITE_PRAGMAS en la configuración):
+    con WAL los lectores no se bloquean detrás de cada compra, y busy_timeout hace que una
+    escritura espere un rato el lock en vez de fallar al toque con "database is locked".
     """
     if isinstance(dbapi_connection, SQLite3Connection): # Si la conexión es de SQLite...
         cursor = dbapi_connection.cursor()
         cursor.execute("PRAGMA foreign_keys=ON;") # Ejecuto el comando PRAGMA.
+        for pragma, valor in app.config.get('SQLITE_PRAGMAS', {}).items():
+            # El journal_mode queda guardado en el archivo y lo fija el escritor; una conexión
+            # de solo lectura no puede cambiarlo (y si lo intenta, falla).
+            if pragma == 'journal_mode' and isinstance(dbapi_connection, ConexionSQLiteSoloLectura):
+                continue
+            cursor.execute(f"PRAGMA {pragma}={valor};")
         cursor.close()
 
 # Cargo las variables de entorno desde el archivo .env (por ejemplo, la URL de la base de datos, la clave secreta).
 # Esto me permite mantener información sensible fuera del código fuente.
 load_dotenv()
 
-# --- Configuración del Logger ---
-# Configuro el sistema de logging para que me ayude a depurar la aplicación.
-# Quiero ver mensajes de depuración (DEBUG) y con un formato que incluya la fecha, nivel y el mensaje.
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
-
 # --- 2. Inicialización de la Aplicación Flask ---
 # Creo la instancia de mi aplicación Flask.
 app = Flask(__name__)
@@ -54,12 +100,251 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///' +
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 # Defino una clave secreta para la seguridad de las sesiones. La tomo de una variable de entorno 'SECRET_KEY'.
 # Si no está definida, uso una de respaldo.
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'una_clave_secreta_de_respaldo_por_si_falla_el_env')
+CLAVE_SECRETA_RESPALDO = 'una_clave_secreta_de_respaldo_por_si_falla_el_env'
+app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', CLAVE_SECRETA_RESPALDO)
 # Configuro Flask para que guarde las sesiones en el sistema de archivos del servidor.
 app.config['SESSION_TYPE'] = 'filesystem'
+# Cuántos segundos puede un navegador o proxy reusar el catálogo sin revalidarlo.
+# Con 0 siempre revalida, pero si no cambió nada le respondo 304 sin tocar la base.
+app.config['CATALOGO_CACHE_MAX_AGE'] = int(os.getenv('CATALOGO_CACHE_MAX_AGE', '0'))
+# Cuántas respuestas guardo como máximo por versión del catálogo: el JSON y las variantes del HTML.
+app.config['CATALOGO_CACHE_MAX_ENTRADAS'] = int(os.getenv('CATALOGO_CACHE_MAX_ENTRADAS', '100'))
+# Las cotizaciones del carrito van en una caché aparte (una entrada por combinación de productos y
+# cantidades), así un montón de carritos distintos no sacan de la caché al catálogo.
+app.config['COTIZACION_CACHE_MAX_ENTRADAS'] = int(os.getenv('COTIZACION_CACHE_MAX_ENTRADAS', '1000'))
+# Perfil de rendimiento de SQLite, se aplica en cada conexión nueva (ver _set_sqlite_pragma).
+# cache_size negativo está en KiB; mmap_size en bytes.
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', '-20000')),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(128 * 1024 * 1024))),
+    'temp_store': 'MEMORY',
+}
+# Conexiones separadas para leer y escribir (solo con SQLite en un archivo). Las requests leen con un
+# pool de conexiones de solo lectura (mode=ro) de LECTURA_POOL conexiones (más LECTURA_POOL_EXTRA si hace
+# falta). Las escrituras usan una única conexión por proceso: quien la necesita espera su turno en la
+# cola del pool hasta ESCRITURA_TIMEOUT segundos y, si no llega, se responde 503.
+app.config['LECTURA_ESCRITURA_SEPARADAS'] = os.getenv('LECTURA_ESCRITURA_SEPARADAS', '1').lower() in ('1', 'true', 'si', 'sí')
+app.config['LECTURA_POOL'] = int(os.getenv('LECTURA_POOL', '8'))
+app.config['LECTURA_POOL_EXTRA'] = int(os.getenv('LECTURA_POOL_EXTRA', '16'))
+app.config['ESCRITURA_TIMEOUT'] = float(os.getenv('ESCRITURA_TIMEOUT', '10'))
+# Hasheo de contraseñas: algoritmo ('scrypt', el que usa Werkzeug por defecto, o 'pbkdf2:sha256'),
+# sus parámetros y cuántos procesos hashean en paralelo. Los valores por defecto son los de Werkzeug:
+# scrypt con N=32768, r=8, p=1 y, si se elige PBKDF2, 1.000.000 de iteraciones.
+# Con PASSWORD_HASH_WORKERS=0 se hashea en el mismo hilo de la request (útil para desarrollo).
+app.config['PASSWORD_HASH_ALGORITHM'] = os.getenv('PASSWORD_HASH_ALGORITHM', 'scrypt')
+app.config['PASSWORD_HASH_SCRYPT_N'] = int(os.getenv('PASSWORD_HASH_SCRYPT_N', '32768'))
+app.config['PASSWORD_HASH_SCRYPT_R'] = int(os.getenv('PASSWORD_HASH_SCRYPT_R', '8'))
+app.config['PASSWORD_HASH_SCRYPT_P'] = int(os.getenv('PASSWORD_HASH_SCRYPT_P', '1'))
+app.config['PASSWORD_HASH_ITERATIONS'] = int(os.getenv('PASSWORD_HASH_ITERATIONS', '1000000'))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+# Máximo de hasheos esperando o en curso. Si se supera, /api/login y /api/registros responden 503.
+app.config['PASSWORD_HASH_MAX_PENDIENTES'] = int(os.getenv('PASSWORD_HASH_MAX_PENDIENTES', '32'))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+# Procesamiento de imágenes de productos: en qué carpeta (dentro de static) van las variantes,
+# cuántos hilos las generan y con qué formato/calidad se re-codifican.
+app.config['IMAGENES_PRODUCTOS_DIR'] = 'img/productos'
+app.config['IMAGENES_WORKERS'] = int(os.getenv('IMAGENES_WORKERS', '2'))
+app.config['IMAGENES_FORMATO'] = os.getenv('IMAGENES_FORMATO', 'WEBP')
+app.config['IMAGENES_CALIDAD'] = int(os.getenv('IMAGENES_CALIDAD', '80'))
+# Ancho máximo (en píxeles) de cada variante. Nunca agrando una imagen más chica que eso.
+app.config['IMAGENES_VARIANTES'] = {'thumb': 160, 'card': 400, 'full': 1200}
+# Estáticos versionados: 'flask build-assets' copia css/js/imágenes a static/dist con un hash del
+# contenido en el nombre (más sus versiones .gz y .br), y los templates los referencian con asset_url().
+# Como el nombre cambia cuando cambia el contenido, se pueden cachear para siempre.
+app.config['ESTATICOS_DIST'] = 'dist'
+app.config['ESTATICOS_EXCLUIR'] = ('dist', 'img/productos') # Las imágenes subidas ya tienen su propio hash.
+app.config['ESTATICOS_COMPRIMIBLES'] = ('.css', '.js', '.svg', '.ico', '.json', '.txt')
+app.config['ESTATICOS_MAX_AGE'] = 31536000 # Un año.
+# Caché de identidades para Flask-Login: cuánto vive cada entrada y cuántas guardo como máximo.
+app.config['IDENTIDAD_CACHE_TTL'] = float(os.getenv('IDENTIDAD_CACHE_TTL', '60'))
+app.config['IDENTIDAD_CACHE_MAX'] = int(os.getenv('IDENTIDAD_CACHE_MAX', '1024'))
+# Si falta el índice de búsqueda, cada cuántos segundos vuelvo a fijarme si alguien ya lo creó.
+app.config['BUSQUEDA_RECHEQUEO'] = float(os.getenv('BUSQUEDA_RECHEQUEO', '30'))
+# Borrados en cascada: hasta cuántas líneas de pedido se borran en la misma request; por
+# encima de eso el borrado va a un trabajo en segundo plano, de a lotes, con una pausa entre lotes.
+app.config['BORRADO_UMBRAL_SINCRONO'] = int(os.getenv('BORRADO_UMBRAL_SINCRONO', '2000'))
+app.config['BORRADO_LOTE'] = int(os.getenv('BORRADO_LOTE', '500'))
+app.config['BORRADO_PAUSA'] = float(os.getenv('BORRADO_PAUSA', '0.01'))
+# Cuántos días guardo los trabajos de borrado ya terminados (para consultar cómo terminaron).
+app.config['BORRADO_TRABAJOS_RETENCION'] = timedelta(days=float(os.getenv('BORRADO_TRABAJOS_RETENCION_DIAS', '7')))
+# Archivo de pedidos ('flask archive-orders'): los pedidos 'Enviado' con más de ARCHIVO_PEDIDOS_DIAS
+# días pasan a las tablas del archivo, de a ARCHIVO_PEDIDOS_LOTE por transacción y con una pausa entre lotes.
+app.config['ARCHIVO_PEDIDOS_DIAS'] = int(os.getenv('ARCHIVO_PEDIDOS_DIAS', '180'))
+app.config['ARCHIVO_PEDIDOS_LOTE'] = int(os.getenv('ARCHIVO_PEDIDOS_LOTE', '500'))
+app.config['ARCHIVO_PEDIDOS_PAUSA'] = float(os.getenv('ARCHIVO_PEDIDOS_PAUSA', '0.01'))
+# Modo con buffer para el formulario de contacto (opcional): los mensajes se confirman al
+# toque y se guardan de a lotes cuando se juntan CONTACTO_BUFFER_LOTE o pasan CONTACTO_BUFFER_INTERVALO segundos.
+app.config['CONTACTO_BUFFER'] = os.getenv('CONTACTO_BUFFER', '0').lower() in ('1', 'true', 'si', 'sí')
+app.config['CONTACTO_BUFFER_LOTE'] = int(os.getenv('CONTACTO_BUFFER_LOTE', '100'))
+app.config['CONTACTO_BUFFER_INTERVALO'] = float(os.getenv('CONTACTO_BUFFER_INTERVALO', '0.5'))
+app.config['CONTACTO_BUFFER_MAX_COLA'] = int(os.getenv('CONTACTO_BUFFER_MAX_COLA', '10000'))
+# Instrumentación de requests: si está activa, cada respuesta lleva un header Server-Timing
+# y se juntan métricas por ruta. Una request se marca como posible N+1 si repite la misma
+# consulta SQL al menos METRICAS_N_MAS_1_REPETICIONES veces.
+app.config['METRICAS_HABILITADAS'] = os.getenv('METRICAS_HABILITADAS', '1').lower() in ('1', 'true', 'si', 'sí')
+app.config['METRICAS_N_MAS_1_REPETICIONES'] = int(os.getenv('METRICAS_N_MAS_1_REPETICIONES', '10'))
+
+# Control de admisión para las rutas caras (login y registro hashean contraseñas; pedidos toma
+# el lock de escritura). Cada clase tiene baldes de tokens por IP y por usuario ('capacidad' es la
+# ráfaga permitida y 'por_minuto' la recarga) y un máximo de requests en curso a la vez ('en_curso').
+# Pasado el límite se responde al toque con 429 (balde vacío) o 503 (demasiadas en curso) y Retry-After.
+app.config['ADMISION_HABILITADA'] = os.getenv('ADMISION_HABILITADA', '1').lower() in ('1', 'true', 'si', 'sí')
+app.config['ADMISION_LIMITES'] = {
+    'login': {'por_ip': {'capacidad': 20, 'por_minuto': 20}, 'por_usuario': {'capacidad': 10, 'por_minuto': 5}, 'en_curso': 16},
+    'registro': {'por_ip': {'capacidad': 5, 'por_minuto': 5}, 'por_usuario': None, 'en_curso': 8},
+    'pedidos': {'por_ip': {'capacidad': 60, 'por_minuto': 60}, 'por_usuario': {'capacidad': 30, 'por_minuto': 30}, 'en_curso': 4}
+}
+# Cuántos baldes (IPs/usuarios distintos) guardo como máximo; los menos usados se descartan.
+app.config['ADMISION_MAX_CLAVES'] = int(os.getenv('ADMISION_MAX_CLAVES', '10000'))
+# Cuántos proxies confiables hay delante de la app (nginx, un balanceador). Detrás de un proxy,
+# request.remote_addr es la IP del proxy y todos los clientes caerían en el mismo balde; con N > 0
+# tomo la IP (y el esquema y el host) de los últimos N saltos de X-Forwarded-*. Con 0 (el default)
+# ignoro esos headers: si la app está expuesta directamente, cualquiera podría inventarlos.
+app.config['PROXIES_CONFIABLES'] = int(os.getenv('PROXIES_CONFIABLES', '0'))
+if app.config['PROXIES_CONFIABLES'] > 0:
+    proxies = app.config['PROXIES_CONFIABLES']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies, x_host=proxies)
+
+# Feed de novedades de pedidos para el panel de admin (Server-Sent Events): cada cuánto reviso si
+# hay eventos nuevos, cada cuánto mando un latido, cuánto dura como máximo una conexión (el navegador
+# se reconecta solo, retomando desde el último evento) y cuántos eventos guardo para poder retomar.
+app.config['EVENTOS_PEDIDOS_INTERVALO'] = float(os.getenv('EVENTOS_PEDIDOS_INTERVALO', '2'))
+app.config['EVENTOS_PEDIDOS_LATIDO'] = float(os.getenv('EVENTOS_PEDIDOS_LATIDO', '15'))
+app.config['EVENTOS_PEDIDOS_DURACION_MAXIMA'] = float(os.getenv('EVENTOS_PEDIDOS_DURACION_MAXIMA', '300'))
+app.config['EVENTOS_PEDIDOS_RETENCION'] = int(os.getenv('EVENTOS_PEDIDOS_RETENCION', '10000'))
+
+# Claves de idempotencia de los pedidos: cuánto tiempo guardo el resultado de cada compra para
+# devolverlo si el cliente reintenta con la misma clave, y cuántas claves guardo como máximo.
+app.config['IDEMPOTENCIA_TTL'] = timedelta(hours=float(os.getenv('IDEMPOTENCIA_TTL_HORAS', '24')))
+app.config['IDEMPOTENCIA_MAX_CLAVES'] = int(os.getenv('IDEMPOTENCIA_MAX_CLAVES', '100000'))
+
+# Perfiles de configuración. Cada perfil pisa los valores de arriba, salvo los que vengan explícitos
+# en una variable de entorno con el mismo nombre (el entorno siempre gana). Si la variable APP_PERFIL
+# está definida (gunicorn.conf.py la pone en 'produccion'), el perfil se aplica al importar el módulo,
+# antes de armar el logger y los motores de la base, así también puede cambiar SQLALCHEMY_DATABASE_URI
+# o los pools. Si no, 'flask run' y los comandos usan la app tal cual, y preparar_app() aplica el
+# perfil que le pidan (por defecto 'desarrollo') siempre que no toque la configuración de la base.
+PERFILES_CONFIGURACION = {
+    'desarrollo': {
+        'DEBUG': True,
+    },
+    'produccion': {
+        'DEBUG': False,
+        'TEMPLATES_AUTO_RELOAD': False,
+        'LOG_LEVEL': 'INFO',
+    },
+    'pruebas': {
+        'TESTING': True,
+        'ADMISION_HABILITADA': False,
+        'PASSWORD_HASH_WORKERS': 0, # Hasheo en el mismo proceso: las pruebas no necesitan el pool.
+    },
+}
+
+# Nivel de log y formato. En desarrollo conviene LOG_LEVEL=DEBUG; en producción, INFO o WARNING.
+app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO').upper()
+app.config['LOG_FORMAT'] = os.getenv('LOG_FORMAT', '%(asctime)s - %(levelname)s - %(message)s')
+# Qué fracción de los mensajes DEBUG se registra (1.0 = todos, 0.1 = uno de cada diez, aprox.).
+app.config['LOG_DEBUG_SAMPLE_RATE'] = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1.0'))
+
+# --- Configuración del Logger ---
+# Antes usaba logging.basicConfig(level=DEBUG), que escribe cada línea en el momento,
+# desde el mismo hilo que atiende la request. Ahora los handlers del logger raíz solo
+# meten el registro en una cola, y un hilo aparte (el QueueListener) es el que escribe.
+class MuestreoDebugFilter(logging.Filter):
+    """Deja pasar solo una fracción de los registros DEBUG. Los demás niveles pasan siempre."""
+    def __init__(self, tasa):
+        super().__init__()
+        self.tasa = tasa
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.tasa >= 1.0:
+            return True
+        return random.random() < self.tasa
+
+_log_listener = None
+
+def configurar_logging(config):
+    """Armo la cadena logger -> cola -> hilo escritor según la configuración. Se ejecuta una sola vez."""
+    global _log_listener
+    if _log_listener is not None:
+        return
+
+    salida = logging.StreamHandler()
+    salida.setFormatter(logging.Formatter(config['LOG_FORMAT']))
+
+    cola = queue.SimpleQueue()
+    handler_cola = logging.handlers.QueueHandler(cola)
+    handler_cola.addFilter(MuestreoDebugFilter(config['LOG_DEBUG_SAMPLE_RATE']))
+
+    raiz = logging.getLogger()
+    raiz.handlers[:] = [handler_cola]
+    raiz.setLevel(config['LOG_LEVEL'])
+
+    _log_listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=True)
+    _log_listener.start()
+    # Al cerrar el proceso vacío la cola para no perder los últimos mensajes.
+    atexit.register(_log_listener.stop)
+
+def aplicar_perfil(config, perfil):
+    """Piso la configuración con la del perfil, salvo lo que venga del entorno. Devuelvo el nombre del perfil."""
+    if perfil not in PERFILES_CONFIGURACION:
+        raise ValueError(f"Perfil desconocido: '{perfil}'. Opciones: {', '.join(PERFILES_CONFIGURACION)}")
+    for clave, valor in PERFILES_CONFIGURACION[perfil].items():
+        if clave not in os.environ:
+            config[clave] = valor
+    return perfil
+
+# Lo aplico acá y no en preparar_app: la extensión de la base y los motores se arman unas líneas más
+# abajo, al importar, y después ya no se pueden cambiar.
+PERFIL_ACTIVO = aplicar_perfil(app.config, os.environ['APP_PERFIL']) if os.getenv('APP_PERFIL') else None
+
+configurar_logging(app.config)
+
+# --- Conexiones de Lectura y Escritura ---
+# Antes todas las requests usaban el mismo pool de conexiones, así que una página de solo lectura
+# competía con las compras y, con carga, aparecían errores "database is locked". Ahora hay dos motores:
+# el principal, con una sola conexión, para escribir; y 'lectura', con un pool de conexiones de solo
+# lectura. Con WAL los lectores no se bloquean entre sí ni con el escritor, así que la lectura escala
+# con los hilos y las escrituras de cada proceso pasan de a una, en orden de llegada.
+# Cada request arranca leyendo; las rutas que escriben lo piden con @escritura (o usar_escritor()).
+# Sin request (CLI, hilos de fondo) se usa siempre el motor de escritura.
+def _configurar_motores(config):
+    """Si la base es un archivo SQLite, armo las opciones de los dos motores antes de inicializar la extensión."""
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if not config['LECTURA_ESCRITURA_SEPARADAS'] or url.get_backend_name() != 'sqlite' \
+            or url.database in (None, '', ':memory:') or url.query.get('uri'):
+        return
+    ruta = url.database if os.path.isabs(url.database) else os.path.join(app.instance_path, url.database)
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': 1, 'max_overflow': 0, 'pool_timeout': config['ESCRITURA_TIMEOUT']}
+    config['SQLALCHEMY_BINDS'] = {'lectura': {
+        'url': url.set(database='file:' + quote(ruta), query={'mode': 'ro', 'uri': 'true'}),
+        'connect_args': {'factory': ConexionSQLiteSoloLectura},
+        'pool_size': config['LECTURA_POOL'],
+        'max_overflow': config['LECTURA_POOL_EXTRA'],
+    }}
+
+class SesionLecturaEscritura(SesionFlaskSQLAlchemy):
+    """Mientras la sesión está marcada como de solo lectura, todo va al motor 'lectura' (si existe)."""
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('solo_lectura') and 'lectura' in self._db.engines:
+            return self._db.engines['lectura']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+_configurar_motores(app.config)
 
 # Inicializo la extensión SQLAlchemy con mi aplicación Flask.
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': SesionLecturaEscritura})
+
+@app.before_request
+def _empezar_leyendo():
+    db.session.info['solo_lectura'] = True
+
+@app.teardown_request
+def _olvidar_modo_sesion(error=None):
+    db.session.info.pop('solo_lectura', None)
 
 # Inicializo Flask-Login con mi aplicación Flask.
 login_manager = LoginManager()
@@ -67,6 +352,131 @@ login_manager.init_app(app)
 # Le digo a Flask-Login cuál es la vista de login si un usuario no autenticado intenta acceder a una página protegida.
 login_manager.login_view = 'login'
 
+# --- Servicio de Hasheo de Contraseñas ---
+# scrypt y PBKDF2 están hechos para ser lentos a propósito, y si los corro en el hilo de la request,
+# una ráfaga de logins deja a todos los workers hasheando mientras el catálogo espera.
+# Por eso lo mando a un pool de procesos acotado: hay un máximo de trabajos pendientes y,
+# si se llena, rechazo rápido en lugar de encolar sin límite.
+class ColaHashLlenaError(RuntimeError):
+    """Hay demasiados hasheos pendientes; conviene reintentar en un rato."""
+
+class ServicioHash:
+    def __init__(self, config):
+        self.config = config
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pendientes = 0
+
+    @property
+    def metodo(self):
+        """El método en el formato de Werkzeug: 'scrypt:32768:8:1' o 'pbkdf2:sha256:1000000'."""
+        algoritmo = self.config['PASSWORD_HASH_ALGORITHM']
+        if algoritmo == 'scrypt':
+            return (f"scrypt:{self.config['PASSWORD_HASH_SCRYPT_N']}:{self.config['PASSWORD_HASH_SCRYPT_R']}"
+                    f":{self.config['PASSWORD_HASH_SCRYPT_P']}")
+        if algoritmo.split(':')[0] == 'pbkdf2':
+            nombre_hash = algoritmo.partition(':')[2] or 'sha256'
+            return f"pbkdf2:{nombre_hash}:{self.config['PASSWORD_HASH_ITERATIONS']}"
+        raise ValueError(f"Algoritmo de hasheo no soportado: '{algoritmo}'. Opciones: scrypt, pbkdf2:sha256.")
+
+    @staticmethod
+    def _parametros(metodo):
+        """Separo un método de Werkzeug en (algoritmo, parámetros): 'scrypt:32768:8:1' -> ('scrypt', (32768, 8, 1))."""
+        partes = metodo.split(':')
+        if partes[0] == 'scrypt':
+            return 'scrypt', tuple(int(parte) for parte in partes[1:4])
+        if partes[0] == 'pbkdf2':
+            return f'pbkdf2:{partes[1]}', (int(partes[2]),)
+        return partes[0], ()
+
+    def profundidad_cola(self):
+        """Cuántos hasheos están esperando o corriendo en este momento."""
+        return self._pendientes
+
+    def _obtener_pool(self):
+        # Creo el pool recién en el primer uso, así no se hereda a medias si el servidor hace fork.
+        # Los procesos del pool no salen de un fork del worker: el worker tiene varios hilos (gthread)
+        # y un fork copiaría locks tomados por otros hilos. Con forkserver (o spawn) arrancan limpios.
+        # Eso sí: los procesos nuevos importan el script principal, así que un script que use la app
+        # tiene que tener su `if __name__ == '__main__':` (gunicorn y benchmark.py ya lo tienen).
+        if self._pool is None:
+            metodo_inicio = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._pool = ProcessPoolExecutor(max_workers=self.config['PASSWORD_HASH_WORKERS'],
+                                             mp_context=multiprocessing.get_context(metodo_inicio))
+            atexit.register(self._pool.shutdown, wait=False, cancel_futures=True)
+        return self._pool
+
+    def _ejecutar(self, funcion, *args):
+        if self.config['PASSWORD_HASH_WORKERS'] <= 0:
+            return funcion(*args)
+        with self._lock:
+            if self._pendientes >= self.config['PASSWORD_HASH_MAX_PENDIENTES']:
+                raise ColaHashLlenaError('Demasiadas solicitudes de autenticación en curso.')
+            self._pendientes += 1
+            pool = self._obtener_pool()
+        try:
+            futuro = pool.submit(funcion, *args)
+        except Exception as e:
+            self._liberar()
+            if isinstance(e, BrokenProcessPool):
+                self._descartar_pool(pool)
+            raise
+        # El lugar se libera cuando el hasheo termina de verdad, no cuando la request deja de esperarlo:
+        # un hasheo que ya arrancó no se puede cancelar y sigue ocupando un proceso del pool.
+        futuro.add_done_callback(self._liberar)
+        try:
+            return futuro.result(timeout=self.config['PASSWORD_HASH_TIMEOUT'])
+        except BrokenProcessPool:
+            # Se murió un proceso del pool (por ejemplo, el OOM killer): el próximo hasheo arma uno nuevo.
+            self._descartar_pool(pool)
+            raise
+        except TimeoutError:
+            # Si tarda tanto es que el pool está saturado: lo trato igual que la cola llena (503).
+            futuro.cancel() # Si todavía no arrancó, no arranca (y el callback libera el lugar).
+            raise ColaHashLlenaError('El hasheo de la contraseña tardó demasiado.')
+
+    def _liberar(self, futuro=None):
+        with self._lock:
+            self._pendientes -= 1
+
+    def _descartar_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def hashear(self, password):
+        return self._ejecutar(generate_password_hash, password, self.metodo)
+
+    def verificar(self, hash_guardado, password):
+        return self._ejecutar(check_password_hash, hash_guardado, password)
+
+    def reiniciar_tras_fork(self):
+        """En un worker recién creado no sirve el pool (ni el lock) del proceso padre: empiezo de cero."""
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pendientes = 0
+
+    def necesita_rehash(self, hash_guardado):
+        """
+        True si el hash guardado es más débil que la configuración actual: mismo algoritmo con
+        parámetros menores (y ninguno mayor), PBKDF2 con SHA-1, o PBKDF2 cuando el configurado es
+        scrypt. Nunca paso un hash a algo más débil (por ejemplo, de scrypt a PBKDF2).
+        """
+        try:
+            guardado, parametros_guardados = self._parametros(hash_guardado.split('$', 1)[0])
+        except (IndexError, ValueError):
+            return True # Un formato que no reconozco lo regenero con el actual.
+        actual, parametros_actuales = self._parametros(self.metodo)
+        if guardado == actual:
+            pares = list(zip(parametros_guardados, parametros_actuales))
+            return all(g <= a for g, a in pares) and any(g < a for g, a in pares)
+        if guardado == 'pbkdf2:sha1':
+            return True
+        return actual == 'scrypt' and guardado.startswith('pbkdf2')
+
+servicio_hash = ServicioHash(app.config)
+
 # --- 4. Definición de Modelos de la Base de Datos ---
 # Estos son mis modelos de datos, que representan las tablas en la base de datos.
 
@@ -94,17 +504,96 @@ class Usuario(UserMixin, db.Model):
     pedidos = db.relationship('Pedido', backref='comprador', lazy=True)
 
     def set_password(self, password):
-        self.password = generate_password_hash(password)
+        self.password = servicio_hash.hashear(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        return servicio_hash.verificar(self.password, password)
+
+    def rehash_si_hace_falta(self, password):
+        """Si el hash guardado usa parámetros viejos, lo regenero con los actuales. Devuelvo True si cambió."""
+        if servicio_hash.necesita_rehash(self.password):
+            self.set_password(password)
+            return True
+        return False
 
     def __repr__(self):
         return f'<Usuario {self.email}>'
 
+# --- Caché de Identidades para Flask-Login ---
+# load_user se ejecuta en cada request autenticada, pero casi todas solo necesitan saber
+# quién es el usuario y qué rol tiene. Guardo esos datos (id, nombre, email, rol) en una
+# caché LRU con vencimiento, y así la mayoría de las requests no van a la base para esto.
+# Cuando un admin cambia el rol o borra un usuario, invalido su entrada.
+class IdentidadUsuario(UserMixin):
+    """Versión liviana del usuario logueado, sin sesión de SQLAlchemy atrás."""
+    def __init__(self, id, nombre, email, rol):
+        self.id = id
+        self.nombre = nombre
+        self.email = email
+        self.rol = rol
+
+    def __repr__(self):
+        return f'<IdentidadUsuario {self.email}>'
+
+class CacheIdentidades:
+    def __init__(self, config):
+        self.config = config
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        # Contador compartido entre los workers (ver _version_catalogo): cada invalidación lo sube y
+        # los demás procesos, al ver que cambió, vacían su caché en vez de esperar el TTL.
+        self._generacion_compartida = multiprocessing.Value('q', 0)
+        self._generacion = 0
+
+    def _sincronizar(self):
+        """Si otro proceso invalidó alguna identidad, descarto todo lo que tengo. Se llama con el lock tomado."""
+        generacion = self._generacion_compartida.value
+        if generacion != self._generacion:
+            self._entradas.clear()
+            self._generacion = generacion
+
+    def obtener(self, user_id):
+        with self._lock:
+            self._sincronizar()
+            entrada = self._entradas.get(user_id)
+            if entrada is None:
+                return None
+            identidad, vence = entrada
+            if vence < time.monotonic():
+                del self._entradas[user_id]
+                return None
+            self._entradas.move_to_end(user_id)
+            return identidad
+
+    def guardar(self, identidad):
+        with self._lock:
+            self._sincronizar()
+            self._entradas[identidad.id] = (identidad, time.monotonic() + self.config['IDENTIDAD_CACHE_TTL'])
+            self._entradas.move_to_end(identidad.id)
+            while len(self._entradas) > self.config['IDENTIDAD_CACHE_MAX']:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self, user_id):
+        with self._generacion_compartida.get_lock():
+            self._generacion_compartida.value += 1
+        with self._lock:
+            self._entradas.pop(user_id, None)
+
+cache_identidades = CacheIdentidades(app.config)
+
 @login_manager.user_loader
 def load_user(user_id):
-    return Usuario.query.get(int(user_id))
+    user_id = int(user_id)
+    identidad = cache_identidades.obtener(user_id)
+    if identidad is None:
+        fila = db.session.execute(
+            select(Usuario.id, Usuario.nombre, Usuario.email, Usuario.rol).where(Usuario.id == user_id)
+        ).first()
+        if fila is None:
+            return None
+        identidad = IdentidadUsuario(fila.id, fila.nombre, fila.email, fila.rol)
+        cache_identidades.guardar(identidad)
+    return identidad
 
 # Modelo para los Productos.
 class Producto(db.Model):
@@ -112,6 +601,8 @@ class Producto(db.Model):
     nombre = db.Column(db.String(100), nullable=False)
     precio = db.Column(db.Float, nullable=False)
     imagen = db.Column(db.String(100))
+    # JSON con las variantes redimensionadas de la imagen: {"thumb": {"ruta": ..., "ancho": ...}, ...}
+    imagen_variantes = db.Column(db.Text)
     stock = db.Column(db.Integer, default=0, nullable=False)
 
     detalle_pedidos_asociados = db.relationship('DetallePedido', backref='producto_del_detalle', lazy=True)
@@ -119,23 +610,32 @@ class Producto(db.Model):
     def __repr__(self):
         return f'<Producto {self.nombre}>'
 
+    def variantes(self):
+        """Devuelvo las variantes de la imagen como dict (vacío si todavía no se procesó)."""
+        return json.loads(self.imagen_variantes) if self.imagen_variantes else {}
+
     def to_dict(self):
         return {
             'id': self.id,
             'nombre': self.nombre,
             'precio': self.precio,
             'imagen': self.imagen,
+            'imagen_variantes': self.variantes(),
             'stock': self.stock
         }
 
 # Modelo para los Pedidos.
 class Pedido(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    fecha_pedido = db.Column(db.DateTime, nullable=False, default=datetime.now(UTC))
+    fecha_pedido = db.Column(db.DateTime, nullable=False, default=datetime.now(UTC), index=True)
     total = db.Column(db.Float, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
     estado = db.Column(db.String(50), nullable=False, default='Pendiente')
 
+    # Índice compuesto para "los pedidos de un usuario ordenados por fecha" (mis_pedidos).
+    # También sirve para cualquier filtro solo por user_id (delete_user, filtros del admin).
+    __table_args__ = (db.Index('ix_pedido_user_id_fecha_pedido', 'user_id', 'fecha_pedido'),)
+
     items = db.relationship('DetallePedido', backref='pedido_asociado', lazy=True, cascade="all, delete-orphan")
 
     def __repr__(self):
@@ -156,8 +656,8 @@ class DetallePedido(db.Model):
     id = db.Column(db.Integer, primary_key=True) 
     cantidad = db.Column(db.Integer, nullable=False)
     precio_unitario = db.Column(db.Float, nullable=False)
-    pedido_id = db.Column(db.Integer, db.ForeignKey('pedido.id', ondelete='CASCADE'), nullable=False)
-    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False)
+    pedido_id = db.Column(db.Integer, db.ForeignKey('pedido.id', ondelete='CASCADE'), nullable=False, index=True)
+    producto_id = db.Column(db.Integer, db.ForeignKey('producto.id'), nullable=False, index=True)
 
     def __repr__(self):
         return f'<DetallePedido {self.id} (Pedido: {self.pedido_id}, Producto: {self.producto_id})>'
@@ -165,18 +665,12 @@ class DetallePedido(db.Model):
     def to_dict(self):
         producto_nombre = 'Producto Desconocido'
 
+        # Si la relación vino vacía es porque el producto ya no existe (la relación ya lo buscó),
+        # así que no vuelvo a consultarlo: sería una consulta extra por ítem que siempre da None.
         if self.producto_del_detalle:
             producto_nombre = self.producto_del_detalle.nombre
-            logging.debug(f"DetallePedido.to_dict: Producto encontrado por backref: {producto_nombre}")
         else:
-            temp_producto = Producto.query.get(self.producto_id)
-            if temp_producto:
-                producto_nombre = temp_producto.nombre
-                logging.warning(f"DetallePedido.to_dict: Producto (ID: {self.producto_id}) cargado por fallback: {producto_nombre}")
-            else:
-                logging.error(f"DetallePedido.to_dict: Producto con ID {self.producto_id} NO ENCONTRADO en la base de datos.")
-
-        logging.debug(f"DetallePedido.to_dict: Devolviendo nombre_producto: {producto_nombre}")
+            logging.error("DetallePedido.to_dict: Producto con ID %s NO ENCONTRADO en la base de datos.", self.producto_id)
 
         return {
             'id': self.id,
@@ -186,6 +680,248 @@ class DetallePedido(db.Model):
             'nombre_producto': producto_nombre 
         }
 
+# Modelos del archivo de pedidos: los pedidos 'Enviado' viejos se mueven acá (ver 'flask archive-orders')
+# para que las tablas de todos los días (pedido, detalle_pedido) y sus índices queden chicos.
+# Guardan los mismos ids que tenían. No tienen FK a usuario ni a producto: los borrados en
+# cascada de usuarios y productos limpian también el archivo (ver _borrar_usuario y _borrar_producto).
+class PedidoArchivado(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    fecha_pedido = db.Column(db.DateTime, nullable=False)
+    total = db.Column(db.Float, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    estado = db.Column(db.String(50), nullable=False)
+    archivado = db.Column(db.DateTime, nullable=False, server_default=func.current_timestamp())
+
+    __table_args__ = (db.Index('ix_pedido_archivado_user_id_fecha_pedido', 'user_id', 'fecha_pedido'),)
+
+    def __repr__(self):
+        return f'<PedidoArchivado {self.id} de usuario {self.user_id}>'
+
+class DetallePedidoArchivado(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cantidad = db.Column(db.Integer, nullable=False)
+    precio_unitario = db.Column(db.Float, nullable=False)
+    pedido_id = db.Column(db.Integer, db.ForeignKey('pedido_archivado.id', ondelete='CASCADE'), nullable=False, index=True)
+    producto_id = db.Column(db.Integer, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<DetallePedidoArchivado {self.id} (Pedido: {self.pedido_id}, Producto: {self.producto_id})>'
+
+# Modelos de agregados de ventas. No son la fuente de verdad (esa es Pedido/DetallePedido),
+# sino resúmenes por día que se actualizan en la misma transacción que cada pedido, así el
+# panel de estadísticas no tiene que recorrer todo el historial. Se pueden reconstruir con 'flask rebuild-sales'.
+class VentaDiariaProducto(db.Model):
+    fecha = db.Column(db.Date, primary_key=True)
+    producto_id = db.Column(db.Integer, primary_key=True)
+    estado = db.Column(db.String(50), primary_key=True)
+    unidades = db.Column(db.Integer, nullable=False, default=0)
+    ingresos = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f'<VentaDiariaProducto {self.fecha} producto {self.producto_id} ({self.estado})>'
+
+class VentaDiariaEstado(db.Model):
+    fecha = db.Column(db.Date, primary_key=True)
+    estado = db.Column(db.String(50), primary_key=True)
+    pedidos = db.Column(db.Integer, nullable=False, default=0)
+    ingresos = db.Column(db.Float, nullable=False, default=0.0)
+
+    def __repr__(self):
+        return f'<VentaDiariaEstado {self.fecha} ({self.estado})>'
+
+# Modelo para el registro de novedades de pedidos (alta, cambio de estado, baja) que consume el
+# feed SSE del admin. El id autoincremental es el id de evento con el que el navegador retoma.
+# No tiene FK a pedido a propósito: los eventos de baja tienen que sobrevivir al pedido.
+class EventoPedido(db.Model):
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    tipo = db.Column(db.String(30), nullable=False)
+    pedido_id = db.Column(db.Integer, nullable=False)
+    estado = db.Column(db.String(50), nullable=True)
+    fecha = db.Column(db.DateTime, nullable=False, server_default=func.current_timestamp())
+
+    def __repr__(self):
+        return f'<EventoPedido {self.id} {self.tipo} #{self.pedido_id}>'
+
+# Modelo para los trabajos de borrado en segundo plano (ver lanzar_trabajo_borrado). Van en la base
+# y no en memoria porque con varios workers la consulta del progreso puede caer en cualquiera, y
+# porque así el estado sobrevive a que el worker que hacía el trabajo se reinicie.
+class TrabajoBorrado(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    tipo = db.Column(db.String(20), nullable=False)
+    objeto_id = db.Column(db.Integer, nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')
+    total = db.Column(db.Integer, nullable=False)
+    procesados = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    creado = db.Column(db.DateTime, nullable=False)
+    finalizado = db.Column(db.DateTime, nullable=True, index=True)
+
+    def __repr__(self):
+        return f'<TrabajoBorrado {self.id} ({self.tipo} {self.objeto_id}, {self.estado})>'
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'tipo': self.tipo, 'objeto_id': self.objeto_id, 'estado': self.estado,
+            'total': self.total, 'procesados': self.procesados, 'error': self.error,
+            'creado': self.creado.isoformat(),
+            'finalizado': self.finalizado.isoformat() if self.finalizado else None
+        }
+
+# Modelo para las claves de idempotencia de POST /api/pedidos. Guardo, por usuario y clave, la
+# huella del carrito y la respuesta que se le dio, para repetirla si el cliente reintenta.
+class ClaveIdempotencia(db.Model):
+    user_id = db.Column(db.Integer, primary_key=True)
+    clave = db.Column(db.String(100), primary_key=True)
+    huella = db.Column(db.String(64), nullable=False)
+    codigo = db.Column(db.Integer, nullable=True)
+    respuesta = db.Column(db.Text, nullable=True)
+    creada = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<ClaveIdempotencia {self.user_id}:{self.clave}>'
+
+# --- Buffer de Escritura para los Mensajes de Contacto ---
+# Cada mensaje de contacto era una transacción con su propio commit (y en SQLite cada commit
+# toma el lock de escritura global y hace fsync). Con el buffer activo, la request solo valida
+# y encola; un hilo aparte junta los mensajes y los inserta en lote con un único commit.
+class BufferContactos:
+    def __init__(self, config):
+        self.config = config
+        self._cola = queue.Queue(maxsize=config['CONTACTO_BUFFER_MAX_COLA'])
+        self._detener = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+        # Filas que no se pudieron guardar porque la conexión de escritura siguió ocupada: van primero
+        # en el próximo volcado. Ya se les respondió 202, así que no las descarto.
+        self._pendientes = []
+        self._metricas = {'lotes': 0, 'filas': 0, 'errores': 0, 'reintentos': 0,
+                          'ultimo_volcado_ms': None, 'max_volcado_ms': 0.0}
+
+    def _iniciar(self):
+        # Arranco el hilo recién con el primer mensaje, así cada proceso del servidor tiene el suyo.
+        with self._lock:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._bucle, name='buffer-contactos', daemon=True)
+                self._hilo.start()
+                atexit.register(self.detener)
+
+    def encolar(self, fila):
+        """
+        Devuelvo False si no lo puedo aceptar, para que la request lo guarde por el camino normal: la
+        cola está llena (contando las filas pendientes de reintento) o el buffer ya se detuvo.
+        """
+        if self._detener.is_set():
+            return False
+        self._iniciar()
+        with self._lock:
+            if len(self._pendientes) + self._cola.qsize() >= self.config['CONTACTO_BUFFER_MAX_COLA']:
+                return False
+        try:
+            self._cola.put_nowait(fila)
+            return True
+        except queue.Full:
+            return False
+
+    def _juntar_lote(self):
+        lote = []
+        limite = time.monotonic() + self.config['CONTACTO_BUFFER_INTERVALO']
+        while len(lote) < self.config['CONTACTO_BUFFER_LOTE']:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                lote.append(self._cola.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _volcar(self, lote):
+        """Guardo el lote (más lo que quedó pendiente). Devuelvo cuántas filas siguen pendientes."""
+        with self._lock:
+            lote, self._pendientes = self._pendientes + lote, []
+        inicio = time.perf_counter()
+        guardadas, descartadas, pendientes = 0, 0, []
+        with app.app_context():
+            try:
+                db.session.execute(insert(Contacto), lote)
+                db.session.commit()
+                guardadas = len(lote)
+            except TimeoutErrorPool:
+                # La conexión de escritura siguió ocupada: reintentar fila por fila sería esperar el
+                # mismo timeout por cada una. Guardo el lote entero para el próximo volcado.
+                db.session.rollback()
+                pendientes = lote
+                logging.warning("Conexión de escritura ocupada: %s contactos quedan para el próximo volcado.", len(lote))
+            except Exception as e:
+                db.session.rollback()
+                logging.error("Error al guardar un lote de %s contactos, reintento uno por uno: %s", len(lote), e)
+                # Así una fila mala no se lleva puesto todo el lote.
+                for numero, fila in enumerate(lote):
+                    try:
+                        db.session.execute(insert(Contacto), [fila])
+                        db.session.commit()
+                        guardadas += 1
+                    except TimeoutErrorPool:
+                        db.session.rollback()
+                        pendientes = lote[numero:]
+                        break
+                    except Exception as e_fila:
+                        db.session.rollback()
+                        descartadas += 1
+                        logging.error("Contacto descartado (%s): %s", fila.get('email'), e_fila)
+        duracion_ms = (time.perf_counter() - inicio) * 1000
+        with self._lock:
+            self._pendientes = pendientes + self._pendientes
+            self._metricas['lotes'] += 1
+            self._metricas['filas'] += guardadas
+            self._metricas['errores'] += descartadas
+            self._metricas['reintentos'] += len(pendientes)
+            self._metricas['ultimo_volcado_ms'] = round(duracion_ms, 3)
+            self._metricas['max_volcado_ms'] = round(max(self._metricas['max_volcado_ms'], duracion_ms), 3)
+        return len(pendientes)
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            lote = self._juntar_lote()
+            if lote or self._pendientes:
+                self._volcar(lote)
+
+    def detener(self):
+        """
+        Freno el hilo y guardo todo lo que quedó en la cola (se llama al cerrar el proceso). Desde
+        acá encolar devuelve False, así las requests que todavía lleguen guardan por el camino normal.
+        """
+        self._detener.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=self.config['ESCRITURA_TIMEOUT'] + self.config['CONTACTO_BUFFER_INTERVALO'] * 2 + 5)
+        restantes = []
+        while True:
+            try:
+                restantes.append(self._cola.get_nowait())
+            except queue.Empty:
+                break
+        for inicio in range(0, len(restantes), self.config['CONTACTO_BUFFER_LOTE']):
+            self._volcar(restantes[inicio:inicio + self.config['CONTACTO_BUFFER_LOTE']])
+        # Una última vuelta por si el escritor estuvo ocupado en la anterior.
+        if self._pendientes and self._volcar([]):
+            logging.error("Se perdieron %s contactos: la conexión de escritura siguió ocupada al cerrar.",
+                          len(self._pendientes))
+
+    def reiniciar_tras_fork(self):
+        """El hilo escritor no sobrevive al fork: dejo todo listo para que el worker arranque el suyo."""
+        self._cola = queue.Queue(maxsize=self.config['CONTACTO_BUFFER_MAX_COLA'])
+        self._detener = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._pendientes = []
+
+    def estado(self):
+        with self._lock:
+            return {'habilitado': self.config['CONTACTO_BUFFER'], 'en_cola': self._cola.qsize(),
+                    'pendientes': len(self._pendientes), **self._metricas}
+
+buffer_contactos = BufferContactos(app.config)
+
 # --- 5. Decorador para Rol de Administrador ---
 from functools import wraps
 
@@ -199,6 +935,789 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# --- Control de Admisión ---
+# Decorador para las rutas caras: antes de ejecutar la vista saco un token de los baldes de la IP
+# y del usuario, y ocupo un lugar entre las requests en curso de su clase. Así una ráfaga de logins
+# o un cliente que reintenta sin parar no se lleva todos los workers mientras el catálogo espera.
+class BackendAdmisionMemoria:
+    """
+    Estado del control de admisión en la memoria del proceso. Para compartirlo entre procesos
+    o servidores alcanza con otra clase con los mismos métodos (consumir, entrar, salir, estado).
+    """
+    def __init__(self, max_claves):
+        self.max_claves = max_claves
+        self._baldes = OrderedDict() # clave -> (tokens, momento de la última recarga)
+        self._en_curso = {}
+        self._rechazos = {}
+        self._lock = threading.Lock()
+
+    def consumir(self, clave, capacidad, por_segundo):
+        """Saco un token del balde de 'clave'. Devuelvo 0 si había, o cuántos segundos faltan para el próximo."""
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, ultimo = self._baldes.get(clave, (capacidad, ahora))
+            tokens = min(capacidad, tokens + (ahora - ultimo) * por_segundo)
+            espera = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                espera = (1 - tokens) / por_segundo
+            self._baldes[clave] = (tokens, ahora)
+            self._baldes.move_to_end(clave)
+            # Un balde descartado vuelve lleno, pero los menos usados son justamente los que ya se recargaron.
+            while len(self._baldes) > self.max_claves:
+                self._baldes.popitem(last=False)
+            return espera
+
+    def entrar(self, clase, maximo):
+        """Ocupo un lugar entre las requests en curso de 'clase'. Devuelvo False si ya está lleno."""
+        with self._lock:
+            if self._en_curso.get(clase, 0) >= maximo:
+                return False
+            self._en_curso[clase] = self._en_curso.get(clase, 0) + 1
+            return True
+
+    def salir(self, clase):
+        with self._lock:
+            self._en_curso[clase] -= 1
+
+    def registrar_rechazo(self, clase, motivo):
+        with self._lock:
+            clave = f'{clase}:{motivo}'
+            self._rechazos[clave] = self._rechazos.get(clave, 0) + 1
+
+    def estado(self):
+        with self._lock:
+            return {'baldes': len(self._baldes), 'en_curso': dict(self._en_curso), 'rechazos': dict(self._rechazos)}
+
+backend_admision = BackendAdmisionMemoria(app.config['ADMISION_MAX_CLAVES'])
+
+def _usuario_actual_admision():
+    """Clave de usuario para los baldes: el id del usuario logueado (o None si es anónimo)."""
+    return current_user.id if current_user.is_authenticated else None
+
+def _email_login_admision():
+    """En el login todavía no hay usuario, así que uso el email que se intenta: frena la fuerza bruta contra una cuenta."""
+    data = request.get_json(silent=True) or {}
+    email = data.get('email')
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+def _respuesta_admision_rechazada(clase, motivo, codigo, espera):
+    """Respuesta rápida cuando una request no pasa el control de admisión: 429 o 503 con Retry-After."""
+    backend_admision.registrar_rechazo(clase, motivo)
+    logging.warning("Admisión rechazada (%s, %s) para %s.", clase, motivo, request.remote_addr)
+    mensaje = ('Demasiados intentos, esperá unos segundos antes de reintentar.' if codigo == 429
+               else 'El servidor está ocupado, intentá de nuevo en unos segundos.')
+    respuesta = jsonify({'message': mensaje})
+    respuesta.headers['Retry-After'] = str(max(1, math.ceil(espera)))
+    return respuesta, codigo
+
+def admision(clase, clave_usuario=_usuario_actual_admision):
+    def decorador(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not app.config['ADMISION_HABILITADA']:
+                return f(*args, **kwargs)
+            limites = app.config['ADMISION_LIMITES'][clase]
+
+            claves = [('ip', request.remote_addr or 'desconocida'), ('usuario', clave_usuario())]
+            for tipo, valor in claves:
+                balde = limites.get(f'por_{tipo}')
+                if balde and valor is not None:
+                    espera = backend_admision.consumir(f'{clase}:{tipo}:{valor}', balde['capacidad'], balde['por_minuto'] / 60)
+                    if espera:
+                        return _respuesta_admision_rechazada(clase, f'por_{tipo}', 429, espera)
+
+            if not backend_admision.entrar(clase, limites['en_curso']):
+                return _respuesta_admision_rechazada(clase, 'en_curso', 503, 1)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                backend_admision.salir(clase)
+        return decorated_function
+    return decorador
+
+# --- Turno con el Escritor ---
+# Ver 'Conexiones de Lectura y Escritura': las rutas que escriben piden la conexión de escritura al empezar.
+def usar_escritor():
+    """
+    Paso la sesión de la request al motor de escritura y tomo ya su conexión: si otra request la tiene,
+    espero en la cola (hasta ESCRITURA_TIMEOUT) y si no se libera lanzo sqlalchemy.exc.TimeoutError
+    (que se responde con 503, ver _respuesta_escritor_ocupado).
+    Lo leído antes de llamarla queda leído (con la conexión de lectura); lo que sigue va al escritor.
+    """
+    db.session.info['solo_lectura'] = False
+    db.session.connection()
+
+def escritura(f):
+    """Decorador para las rutas que escriben: esperan su turno con el escritor antes de empezar."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        usar_escritor()
+        return f(*args, **kwargs)
+    return decorated_function
+
+@app.errorhandler(TimeoutErrorPool)
+def _respuesta_escritor_ocupado(error):
+    logging.warning("Escritura rechazada en %s: la conexión de escritura siguió ocupada.", request.path)
+    respuesta = jsonify({'message': 'El servidor está procesando otras operaciones, intentá de nuevo en unos segundos.'})
+    respuesta.headers['Retry-After'] = str(math.ceil(app.config['ESCRITURA_TIMEOUT']))
+    return respuesta, 503
+
+# --- Instrumentación de Rendimiento ---
+# Mido, por request: cuántas sentencias SQL se ejecutan y cuánto tardan, cuánto tarda el
+# renderizado de templates y cuánto la serialización a JSON. Lo devuelvo en el header
+# Server-Timing (lo muestran las herramientas de desarrollo del navegador) y lo acumulo por
+# ruta en histogramas de latencia que se consultan en /api/admin/metrics.
+BUCKETS_LATENCIA_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+def _medicion_actual():
+    """Devuelvo el dict de mediciones de la request actual, o None si no estoy en una request (hilos de fondo)."""
+    if has_request_context() and app.config['METRICAS_HABILITADAS']:
+        return g.get('medicion')
+    return None
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('inicio_consulta', []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    inicio = conn.info['inicio_consulta'].pop()
+    medicion = _medicion_actual()
+    if medicion is not None:
+        medicion['consultas'] += 1
+        medicion['db'] += time.perf_counter() - inicio
+        medicion['sentencias'][statement] = medicion['sentencias'].get(statement, 0) + 1
+
+@event.listens_for(Engine, "handle_error")
+def _consulta_fallida(contexto):
+    # Si la sentencia falla, after_cursor_execute no llega: saco igual su inicio de la pila, que si no
+    # queda en la conexión (vuelve al pool) y la próxima consulta mediría desde ese inicio viejo.
+    pila = contexto.connection.info.get('inicio_consulta') if contexto.connection is not None else None
+    if pila and contexto.execution_context is not None:
+        pila.pop()
+
+@before_render_template.connect_via(app)
+def _antes_de_renderizar(sender, template, context, **extra):
+    medicion = _medicion_actual()
+    if medicion is not None:
+        medicion['inicio_template'] = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _despues_de_renderizar(sender, template, context, **extra):
+    medicion = _medicion_actual()
+    if medicion is not None and medicion.get('inicio_template') is not None:
+        medicion['template'] += time.perf_counter() - medicion.pop('inicio_template')
+
+class ProveedorJSONMedido(DefaultJSONProvider):
+    """El mismo serializador JSON de Flask, pero midiendo cuánto tarda."""
+    def dumps(self, obj, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            medicion = _medicion_actual()
+            if medicion is not None:
+                medicion['serializacion'] += time.perf_counter() - inicio
+
+app.json = ProveedorJSONMedido(app)
+
+class MetricasRutas:
+    """
+    Acumulo, por ruta y método, cantidad de requests, histograma de latencia y consultas SQL.
+    Ojo: viven en la memoria de cada proceso. Con gunicorn cada worker tiene las suyas y
+    /api/admin/metrics muestra solo las del worker que atendió esa request (por eso va el pid):
+    para ver todo hay que consultar varias veces y sumar por pid.
+    """
+    def __init__(self):
+        self._rutas = {}
+        self._lock = threading.Lock()
+        self._desde = datetime.now(UTC)
+
+    def registrar(self, ruta, duracion_ms, medicion, posible_n_mas_1):
+        with self._lock:
+            datos = self._rutas.get(ruta)
+            if datos is None:
+                datos = self._rutas[ruta] = {
+                    'requests': 0, 'latencia_total_ms': 0.0, 'latencia_max_ms': 0.0,
+                    'buckets': [0] * (len(BUCKETS_LATENCIA_MS) + 1),
+                    'consultas_total': 0, 'consultas_max': 0, 'db_total_ms': 0.0, 'posibles_n_mas_1': 0
+                }
+            datos['requests'] += 1
+            datos['latencia_total_ms'] += duracion_ms
+            datos['latencia_max_ms'] = max(datos['latencia_max_ms'], duracion_ms)
+            datos['buckets'][bisect.bisect_left(BUCKETS_LATENCIA_MS, duracion_ms)] += 1
+            datos['consultas_total'] += medicion['consultas']
+            datos['consultas_max'] = max(datos['consultas_max'], medicion['consultas'])
+            datos['db_total_ms'] += medicion['db'] * 1000
+            datos['posibles_n_mas_1'] += 1 if posible_n_mas_1 else 0
+
+    def resumen(self):
+        with self._lock:
+            rutas = {}
+            for ruta, datos in sorted(self._rutas.items()):
+                rutas[ruta] = {
+                    'requests': datos['requests'],
+                    'latencia_media_ms': round(datos['latencia_total_ms'] / datos['requests'], 3),
+                    'latencia_max_ms': round(datos['latencia_max_ms'], 3),
+                    # Cada bucket cuenta las requests que tardaron hasta 'hasta_ms' (None = el resto).
+                    'histograma_ms': [{'hasta_ms': limite, 'requests': cantidad}
+                                      for limite, cantidad in zip(BUCKETS_LATENCIA_MS + [None], datos['buckets'])],
+                    'consultas_media': round(datos['consultas_total'] / datos['requests'], 2),
+                    'consultas_max': datos['consultas_max'],
+                    'db_media_ms': round(datos['db_total_ms'] / datos['requests'], 3),
+                    'posibles_n_mas_1': datos['posibles_n_mas_1']
+                }
+            return rutas
+
+    def desde(self):
+        """Desde cuándo acumulo (arranque del worker o último reinicio)."""
+        return self._desde
+
+    def reiniciar(self):
+        with self._lock:
+            self._rutas.clear()
+            self._desde = datetime.now(UTC)
+
+metricas_rutas = MetricasRutas()
+
+@app.before_request
+def _iniciar_medicion():
+    if app.config['METRICAS_HABILITADAS']:
+        g.medicion = {'inicio': time.perf_counter(), 'consultas': 0, 'db': 0.0, 'template': 0.0,
+                      'serializacion': 0.0, 'sentencias': {}}
+
+@app.after_request
+def _cerrar_medicion(response):
+    medicion = _medicion_actual()
+    if medicion is None:
+        return response
+    duracion_ms = (time.perf_counter() - medicion['inicio']) * 1000
+    repeticiones = max(medicion['sentencias'].values(), default=0)
+    posible_n_mas_1 = repeticiones >= app.config['METRICAS_N_MAS_1_REPETICIONES']
+    ruta = f"{request.method} {request.url_rule.rule if request.url_rule else '<sin ruta>'}"
+    if posible_n_mas_1:
+        logging.warning("Posible N+1 en %s: la misma consulta se ejecutó %s veces (%s consultas en total).",
+                        ruta, repeticiones, medicion['consultas'])
+    metricas_rutas.registrar(ruta, duracion_ms, medicion, posible_n_mas_1)
+    response.headers['Server-Timing'] = ', '.join([
+        f'db;dur={medicion["db"] * 1000:.2f};desc="{medicion["consultas"]} consultas"',
+        f'tpl;dur={medicion["template"] * 1000:.2f}',
+        f'ser;dur={medicion["serializacion"] * 1000:.2f}',
+        f'total;dur={duracion_ms:.2f}'
+    ])
+    return response
+
+# --- Capa de Lectura (Proyecciones) ---
+# Para las APIs de solo lectura no necesito objetos del ORM: armarlos (identity map, relaciones,
+# estado de la sesión) cuesta más CPU y memoria que la consulta en sí. Acá leo con select() solo
+# las columnas que van al JSON y convierto cada fila a dict con serializadores armados una sola vez.
+# El formato de salida es el mismo que el de los to_dict() de los modelos.
+
+def _compilar_serializador(claves, conversiones=None):
+    """
+    Armo una función fila -> dict para una lista fija de columnas (en el orden del select).
+    'conversiones' mapea una clave a la función que transforma su valor (por ejemplo, fechas a ISO).
+    """
+    conversiones = conversiones or {}
+    pasos = tuple((indice, clave, conversiones.get(clave)) for indice, clave in enumerate(claves))
+
+    def serializar(fila):
+        return {clave: (convertir(fila[indice]) if convertir else fila[indice]) for indice, clave, convertir in pasos}
+    return serializar
+
+COLUMNAS_PRODUCTO_API = (Producto.id, Producto.nombre, Producto.precio, Producto.imagen,
+                         Producto.imagen_variantes, Producto.stock)
+_serializar_producto = _compilar_serializador(
+    ('id', 'nombre', 'precio', 'imagen', 'imagen_variantes', 'stock'),
+    {'imagen_variantes': lambda valor: json.loads(valor) if valor else {}}
+)
+
+def _columnas_linea(detalle):
+    """Columnas de una línea de pedido, de la tabla caliente (DetallePedido) o del archivo (DetallePedidoArchivado)."""
+    return (detalle.id, detalle.cantidad, detalle.precio_unitario, detalle.producto_id, Producto.nombre, detalle.pedido_id)
+
+COLUMNAS_LINEA_PEDIDO = _columnas_linea(DetallePedido)
+_serializar_linea = _compilar_serializador(
+    ('id', 'cantidad', 'precio_unitario', 'producto_id', 'nombre_producto'),
+    {'nombre_producto': lambda nombre: nombre if nombre is not None else 'Producto Desconocido'}
+)
+
+def _columnas_pedido(modelo):
+    """
+    Columnas de un pedido, de la tabla caliente (Pedido) o del archivo (PedidoArchivado).
+    La última, 'archivado', dice de cuál vino cada fila cuando mezclo las dos (ver leer_pedidos_con_archivo).
+    """
+    return (modelo.id, modelo.fecha_pedido, modelo.total, modelo.user_id, modelo.estado,
+            literal(modelo is PedidoArchivado, db.Boolean).label('archivado'))
+
+COLUMNAS_PEDIDO_ADMIN = (*_columnas_pedido(Pedido), Usuario.nombre, Usuario.email)
+_serializar_pedido = _compilar_serializador(
+    ('id', 'fecha_pedido', 'total', 'user_id', 'estado', 'archivado'),
+    {'fecha_pedido': lambda fecha: fecha.isoformat()}
+)
+
+def leer_productos():
+    """Todos los productos como dicts (mismo formato que Producto.to_dict), sin hidratar objetos."""
+    return [_serializar_producto(fila) for fila in db.session.execute(select(*COLUMNAS_PRODUCTO_API)).all()]
+
+def _lineas_de_pedidos(pedido_ids, detalle=DetallePedido):
+    """Devuelvo {pedido_id: [líneas]} con el mismo formato que DetallePedido.to_dict, en una sola consulta."""
+    lineas = {pedido_id: [] for pedido_id in pedido_ids}
+    if not pedido_ids:
+        return lineas
+    consulta = (
+        select(*_columnas_linea(detalle))
+        .outerjoin(Producto, Producto.id == detalle.producto_id)
+        .where(detalle.pedido_id.in_(pedido_ids))
+        .order_by(detalle.pedido_id, detalle.id)
+    )
+    for fila in db.session.execute(consulta):
+        lineas[fila.pedido_id].append(_serializar_linea(fila))
+    return lineas
+
+def _lineas_de_filas(filas):
+    """Las líneas de filas de pedidos de _columnas_pedido, calientes y archivadas mezcladas (una consulta por tabla)."""
+    lineas = _lineas_de_pedidos([fila.id for fila in filas if not fila.archivado])
+    archivados = [fila.id for fila in filas if fila.archivado]
+    if archivados:
+        lineas.update(_lineas_de_pedidos(archivados, DetallePedidoArchivado))
+    return lineas
+
+def leer_pedidos_con_archivo(construir_consulta, limite, incluir_archivo=False):
+    """
+    'construir_consulta(modelo)' arma la consulta de pedidos (ordenada por fecha_pedido e id, descendente)
+    sobre Pedido o PedidoArchivado. Si incluir_archivo, consulto las dos tablas y mezclo los resultados:
+    como cada una ya viene ordenada y cortada en 'limite', alcanza con ordenar y volver a cortar.
+    """
+    filas = db.session.execute(construir_consulta(Pedido).limit(limite)).all()
+    if incluir_archivo:
+        filas += db.session.execute(construir_consulta(PedidoArchivado).limit(limite)).all()
+        filas.sort(key=lambda fila: (fila.fecha_pedido, fila.id), reverse=True)
+        del filas[limite:]
+    return filas
+
+def incluir_archivo_pedidos(args):
+    """Los listados de pedidos suman los archivados solo si se piden con ?archivo=1."""
+    return args.get('archivo', '').lower() in ('1', 'true', 'si', 'sí')
+
+def _condicion_cursor(modelo, cursor_clave):
+    """La condición keyset 'viene después del cursor (fecha_pedido, id)' en orden descendente."""
+    fecha_cursor, id_cursor = cursor_clave
+    return or_(
+        modelo.fecha_pedido < fecha_cursor,
+        and_(modelo.fecha_pedido == fecha_cursor, modelo.id < id_cursor)
+    )
+
+def pedidos_admin_a_dicts(filas):
+    """Armo el JSON de los pedidos del admin (pedido + comprador + ítems) a partir de filas de COLUMNAS_PEDIDO_ADMIN."""
+    lineas = _lineas_de_filas(filas)
+    pedidos = []
+    for fila in filas:
+        pedido = _serializar_pedido(fila)
+        pedido['items'] = lineas[fila.id]
+        pedido['comprador_nombre'] = fila.nombre if fila.nombre is not None else 'Usuario Desconocido'
+        pedido['comprador_email'] = fila.email if fila.email is not None else 'Email Desconocido'
+        pedidos.append(pedido)
+    return pedidos
+
+# --- Caché del Catálogo de Productos ---
+# El catálogo solo cambia cuando un admin agrega, edita o borra un producto, pero
+# /productos y /api/productos son las rutas más visitadas. Por eso guardo en memoria
+# el JSON y el HTML ya armados, atados a una "versión" del catálogo que esos tres
+# handlers incrementan. Mientras la versión no cambie, no vuelvo a consultar la base.
+# La versión vive en memoria compartida (multiprocessing.Value): si el servidor de producción
+# precarga la app y después hace fork, todos los workers ven el mismo contador, así que cuando
+# uno invalida, los demás descartan sus entradas en la próxima consulta. Las entradas en sí
+# son de cada proceso; 'version' en cada caché es la versión a la que pertenecen.
+# Las cotizaciones del carrito dependen de la misma versión pero tienen su propia caché, con su
+# propio límite: si compartieran una, muchos carritos distintos sacarían al JSON y al HTML del catálogo.
+# Las dos son LRU: al llenarse descarto la entrada que hace más tiempo que nadie usa.
+_version_catalogo = multiprocessing.Value('q', 1)
+_catalogo_cache = {'version': 1, 'entradas': OrderedDict(), 'max_entradas': 'CATALOGO_CACHE_MAX_ENTRADAS'}
+_cotizaciones_cache = {'version': 1, 'entradas': OrderedDict(), 'max_entradas': 'COTIZACION_CACHE_MAX_ENTRADAS'}
+_catalogo_lock = threading.Lock()
+
+def invalidar_catalogo():
+    """Incremento la versión del catálogo y descarto todo lo cacheado."""
+    with _version_catalogo.get_lock():
+        _version_catalogo.value += 1
+        version = _version_catalogo.value
+    with _catalogo_lock:
+        for cache in (_catalogo_cache, _cotizaciones_cache):
+            cache['version'] = version
+            cache['entradas'].clear()
+    logging.debug("Catálogo invalidado, nueva versión %s.", version)
+
+def obtener_version_catalogo():
+    return _version_catalogo.value
+
+def _catalogo_cacheado(clave, construir, cache=_catalogo_cache):
+    """
+    Devuelvo (cuerpo, etag) para la clave pedida. Si no está en la caché, llamo a
+    'construir' (que es la que consulta la base) y guardo el resultado, salvo que el
+    catálogo haya cambiado mientras lo armaba (en ese caso lo uso pero no lo guardo).
+    """
+    with _catalogo_lock:
+        version = _version_catalogo.value
+        if cache['version'] != version:
+            # Otro proceso invalidó el catálogo: lo que tengo guardado es de una versión vieja.
+            cache['version'] = version
+            cache['entradas'].clear()
+        entrada = cache['entradas'].get(clave)
+        if entrada is not None:
+            cache['entradas'].move_to_end(clave)
+    if entrada is not None:
+        return entrada
+
+    cuerpo = construir()
+    if isinstance(cuerpo, str):
+        cuerpo = cuerpo.encode('utf-8')
+    etag = hashlib.sha256(cuerpo).hexdigest()
+    entrada = (cuerpo, etag)
+    with _catalogo_lock:
+        if cache['version'] == version == _version_catalogo.value:
+            entradas = cache['entradas']
+            # Si se llenó, descarto las que hace más tiempo que no se usan.
+            while entradas and len(entradas) >= app.config[cache['max_entradas']]:
+                entradas.popitem(last=False)
+            entradas[clave] = entrada
+    return entrada
+
+def _respuesta_catalogo(cuerpo, etag, mimetype, publica=True):
+    """Armo la respuesta con ETag fuerte y Cache-Control, y contesto 304 si el cliente ya la tiene."""
+    respuesta = Response(cuerpo, mimetype=mimetype)
+    respuesta.set_etag(etag)
+    alcance = 'public' if publica else 'private'
+    respuesta.headers['Cache-Control'] = f"{alcance}, max-age={app.config['CATALOGO_CACHE_MAX_AGE']}, must-revalidate"
+    if not publica:
+        # El HTML cambia según quién esté logueado (menú, botones de compra).
+        respuesta.vary.add('Cookie')
+    return respuesta.make_conditional(request)
+
+def _variante_catalogo_html():
+    """La página de productos se ve distinta para anónimos, clientes y admins."""
+    if not current_user.is_authenticated:
+        return 'anonimo'
+    return 'admin' if current_user.rol == 'admin' else 'cliente'
+
+# --- Procesamiento de Imágenes de Productos ---
+# Cuando un admin sube una imagen, la guardo tal cual para que el producto se vea al toque,
+# y en segundo plano genero versiones redimensionadas y re-codificadas (thumb, card, full).
+# Cada variante se nombra con el hash de su contenido, así la URL cambia si cambia la imagen
+# y el navegador la puede cachear "para siempre".
+_executor_imagenes = ThreadPoolExecutor(max_workers=app.config['IMAGENES_WORKERS'], thread_name_prefix='imagenes')
+atexit.register(_executor_imagenes.shutdown, wait=True)
+
+def _ruta_static(ruta_relativa):
+    return os.path.join(app.static_folder, ruta_relativa)
+
+def archivos_imagen_producto(imagen, imagen_variantes):
+    """Los archivos de la carpeta de subidas que usa un producto (original y variantes). Las imágenes de ejemplo del repo no cuentan."""
+    rutas = {imagen} if imagen else set()
+    if imagen_variantes:
+        rutas.update(variante['ruta'] for variante in json.loads(imagen_variantes).values())
+    carpeta = app.config['IMAGENES_PRODUCTOS_DIR'] + '/'
+    return {ruta for ruta in rutas if ruta.startswith(carpeta)}
+
+def borrar_imagenes_sin_uso(rutas):
+    """
+    Borro del disco las imágenes que ya no usa ningún producto. Se llama después del commit (si la
+    transacción falla, el producto sigue apuntando a las viejas). Las variantes se nombran por su
+    contenido y dos productos con la misma foto comparten archivos: por eso chequeo antes de borrar.
+    Si algo falla solo lo registro; a lo sumo queda un archivo huérfano.
+    """
+    for ruta in rutas:
+        try:
+            en_uso = db.session.execute(
+                select(Producto.id)
+                .where(or_(Producto.imagen == ruta, Producto.imagen_variantes.contains(ruta, autoescape=True)))
+                .limit(1)
+            ).first()
+            if not en_uso:
+                os.remove(_ruta_static(ruta))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning("No pude borrar la imagen sin uso '%s': %s", ruta, e)
+
+def guardar_imagen_subida(file):
+    """Guardo el archivo subido con un nombre único (no piso imágenes existentes) y devuelvo su ruta relativa a static."""
+    nombre = secure_filename(file.filename)
+    carpeta = app.config['IMAGENES_PRODUCTOS_DIR']
+    os.makedirs(_ruta_static(carpeta), exist_ok=True)
+    ruta_relativa = f"{carpeta}/original-{uuid.uuid4().hex}-{nombre}"
+    file.save(_ruta_static(ruta_relativa))
+    return ruta_relativa
+
+def generar_variantes_imagen(ruta_original):
+    """
+    Genero las variantes de una imagen y devuelvo el dict que se guarda en Producto.imagen_variantes.
+    Los archivos se escriben con nombre '<hash>-<variante>.<ext>' y, si ya existen, no se reescriben.
+    """
+    formato = app.config['IMAGENES_FORMATO']
+    extension = 'jpg' if formato == 'JPEG' else formato.lower()
+    carpeta = app.config['IMAGENES_PRODUCTOS_DIR']
+    os.makedirs(_ruta_static(carpeta), exist_ok=True)
+
+    variantes = {}
+    with Image.open(_ruta_static(ruta_original)) as original:
+        original = ImageOps.exif_transpose(original).convert('RGB')
+        for nombre_variante, ancho_maximo in app.config['IMAGENES_VARIANTES'].items():
+            imagen = original.copy()
+            imagen.thumbnail((ancho_maximo, ancho_maximo * 4))
+            buffer = io.BytesIO()
+            imagen.save(buffer, format=formato, quality=app.config['IMAGENES_CALIDAD'], optimize=True)
+            contenido = buffer.getvalue()
+            digest = hashlib.sha256(contenido).hexdigest()[:16]
+            ruta_variante = f"{carpeta}/{digest}-{nombre_variante}.{extension}"
+            if not os.path.exists(_ruta_static(ruta_variante)):
+                with open(_ruta_static(ruta_variante), 'wb') as destino:
+                    destino.write(contenido)
+            variantes[nombre_variante] = {'ruta': ruta_variante, 'ancho': imagen.width}
+    return variantes
+
+def _procesar_imagen_producto(producto_id, ruta_original):
+    """Trabajo en segundo plano: genero las variantes y las registro en el producto."""
+    with app.app_context():
+        try:
+            variantes = generar_variantes_imagen(ruta_original)
+            # Solo actualizo si el producto sigue teniendo esta imagen (pudo cambiar mientras procesaba).
+            resultado = db.session.execute(
+                update(Producto)
+                .where(Producto.id == producto_id, Producto.imagen == ruta_original)
+                .values(imagen=variantes['card']['ruta'], imagen_variantes=json.dumps(variantes))
+            )
+            db.session.commit()
+            if resultado.rowcount:
+                invalidar_catalogo()
+                logging.info("Variantes de imagen generadas para el producto ID %s.", producto_id)
+                # El original subido ya no hace falta; las imágenes de ejemplo del repo no las toco.
+                borrar_imagenes_sin_uso(archivos_imagen_producto(ruta_original, None))
+            else:
+                # Entretanto le cambiaron la imagen o borraron el producto: lo que generé no lo usa nadie.
+                borrar_imagenes_sin_uso(archivos_imagen_producto(ruta_original, json.dumps(variantes)))
+        except Exception as e:
+            db.session.rollback()
+            logging.error("Error al procesar la imagen del producto ID %s: %s", producto_id, e)
+
+def encolar_procesamiento_imagen(producto_id, ruta_original):
+    _executor_imagenes.submit(_procesar_imagen_producto, producto_id, ruta_original)
+
+@app.after_request
+def _cache_variantes_imagen(response):
+    """Las variantes tienen el hash en el nombre, así que nunca cambian: las cacheo por un año."""
+    if request.endpoint == 'static' and response.status_code == 200:
+        filename = (request.view_args or {}).get('filename', '')
+        carpeta = app.config['IMAGENES_PRODUCTOS_DIR'] + '/'
+        if filename.startswith(carpeta) and not os.path.basename(filename).startswith('original-'):
+            response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+# --- Estáticos Versionados y Precomprimidos ---
+# 'flask build-assets' recorre static/ y, por cada archivo, escribe en static/dist una copia con
+# el hash del contenido en el nombre (css/style.css -> css/style.3f2a9c1b7d4e.css), más las
+# variantes .gz y .br (si está instalado brotli) de los que son texto. El manifest.json mapea el
+# nombre original al versionado. En los templates, asset_url('css/style.css') devuelve la URL
+# versionada si hay manifest, o la de siempre si no se corrió el build (por ejemplo, en desarrollo).
+_manifiesto_estaticos = None
+
+def _dir_estaticos_dist():
+    return os.path.join(app.static_folder, app.config['ESTATICOS_DIST'])
+
+def obtener_manifiesto_estaticos():
+    """Leo el manifest una vez por proceso (después de un build hay que reiniciar la app)."""
+    global _manifiesto_estaticos
+    if _manifiesto_estaticos is None:
+        try:
+            with open(os.path.join(_dir_estaticos_dist(), 'manifest.json'), encoding='utf-8') as archivo:
+                _manifiesto_estaticos = json.load(archivo)
+        except FileNotFoundError:
+            _manifiesto_estaticos = {}
+    return _manifiesto_estaticos
+
+@app.template_global()
+def asset_url(filename):
+    """Como url_for('static', filename=...), pero apuntando a la versión con hash si existe."""
+    versionado = obtener_manifiesto_estaticos().get(filename)
+    if versionado:
+        return url_for('estaticos_versionados', filename=versionado)
+    return url_for('static', filename=filename)
+
+def _reescribir_urls_css(contenido, ruta_css, manifiesto):
+    """Cambio los url(...) relativos del CSS por las rutas versionadas (relativas a la nueva ubicación del CSS)."""
+    carpeta = posixpath.dirname(ruta_css)
+
+    def reemplazar(coincidencia):
+        comilla, destino = coincidencia.group(1), coincidencia.group(2).strip()
+        if destino.startswith(('data:', 'http:', 'https:', '/', '#')):
+            return coincidencia.group(0)
+        versionado = manifiesto.get(posixpath.normpath(posixpath.join(carpeta, destino)))
+        if not versionado:
+            return coincidencia.group(0)
+        return f"url({comilla}{posixpath.relpath(versionado, carpeta)}{comilla})"
+
+    texto = re.sub(r"url\(\s*(['\"]?)([^'\")]+)\1\s*\)", reemplazar, contenido.decode('utf-8'))
+    return texto.encode('utf-8')
+
+def construir_estaticos(limpiar=False):
+    """
+    Genero static/dist y su manifest.json. Devuelvo un resumen con la cantidad de archivos y bytes.
+    No borro las versiones anteriores (las páginas cacheadas pueden seguir pidiéndolas) salvo con limpiar=True.
+    """
+    global _manifiesto_estaticos
+    origen = app.static_folder
+    destino = _dir_estaticos_dist()
+    excluidos = app.config['ESTATICOS_EXCLUIR']
+
+    rutas = []
+    for carpeta, subcarpetas, archivos in os.walk(origen):
+        relativa = os.path.relpath(carpeta, origen).replace(os.sep, '/')
+        relativa = '' if relativa == '.' else relativa + '/'
+        subcarpetas[:] = [sub for sub in subcarpetas if (relativa + sub) not in excluidos]
+        rutas.extend(relativa + archivo for archivo in archivos)
+    # Los CSS van al final porque sus url(...) tienen que apuntar a las imágenes ya versionadas.
+    rutas.sort(key=lambda ruta: (ruta.endswith('.css'), ruta))
+
+    manifiesto = {}
+    resumen = {'archivos': 0, 'bytes': 0, 'bytes_gzip': 0, 'bytes_brotli': 0, 'brotli': brotli is not None}
+    for ruta in rutas:
+        with open(os.path.join(origen, ruta), 'rb') as archivo:
+            contenido = archivo.read()
+        if ruta.endswith('.css'):
+            contenido = _reescribir_urls_css(contenido, ruta, manifiesto)
+
+        base, extension = posixpath.splitext(ruta)
+        versionado = f"{base}.{hashlib.sha256(contenido).hexdigest()[:12]}{extension}"
+        salida = os.path.join(destino, versionado)
+        os.makedirs(os.path.dirname(salida), exist_ok=True)
+        with open(salida, 'wb') as archivo:
+            archivo.write(contenido)
+        resumen['archivos'] += 1
+        resumen['bytes'] += len(contenido)
+
+        if extension.lower() in app.config['ESTATICOS_COMPRIMIBLES']:
+            # mtime=0 para que el .gz sea siempre el mismo para el mismo contenido.
+            variantes = [('.gz', 'bytes_gzip', gzip.compress(contenido, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variantes.append(('.br', 'bytes_brotli', brotli.compress(contenido, quality=11)))
+            for sufijo, clave, comprimido in variantes:
+                # Si comprimido no es más chico (archivos muy cortos), no vale la pena guardarlo.
+                if len(comprimido) < len(contenido):
+                    with open(salida + sufijo, 'wb') as archivo:
+                        archivo.write(comprimido)
+                    resumen[clave] += len(comprimido)
+        manifiesto[ruta] = versionado
+
+    ruta_manifiesto = os.path.join(destino, 'manifest.json')
+    with open(ruta_manifiesto + '.tmp', 'w', encoding='utf-8') as archivo:
+        json.dump(manifiesto, archivo, indent=2, sort_keys=True)
+    os.replace(ruta_manifiesto + '.tmp', ruta_manifiesto)
+
+    if limpiar:
+        vigentes = set(manifiesto.values()) | {'manifest.json'}
+        for carpeta, _, archivos in os.walk(destino):
+            for archivo in archivos:
+                relativa = os.path.relpath(os.path.join(carpeta, archivo), destino).replace(os.sep, '/')
+                if relativa.removesuffix('.gz').removesuffix('.br') not in vigentes:
+                    os.remove(os.path.join(carpeta, archivo))
+
+    _manifiesto_estaticos = manifiesto
+    return resumen
+
+# Ruta que sirve los estáticos versionados. Si el navegador acepta brotli o gzip y existe la
+# variante precomprimida, mando esa (sin comprimir nada en el momento). Como el nombre lleva el
+# hash, la respuesta se marca como inmutable y se cachea por un año.
+@app.route('/assets/<path:filename>')
+def estaticos_versionados(filename):
+    ruta = safe_join(_dir_estaticos_dist(), filename)
+    if ruta is None or not os.path.isfile(ruta):
+        abort(404)
+
+    codificacion = None
+    for nombre, sufijo in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[nombre] and os.path.isfile(ruta + sufijo):
+            ruta, codificacion = ruta + sufijo, nombre
+            break
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    respuesta = send_file(ruta, mimetype=mimetype, max_age=app.config['ESTATICOS_MAX_AGE'], conditional=True)
+    if codificacion:
+        respuesta.headers['Content-Encoding'] = codificacion
+    respuesta.vary.add('Accept-Encoding')
+    respuesta.cache_control.public = True
+    respuesta.cache_control.immutable = True
+    return respuesta
+
+# --- Búsqueda de Productos (SQLite FTS5) ---
+# Tengo una tabla virtual FTS5 con el nombre de cada producto (rowid = id del producto).
+# El tokenizer ignora mayúsculas y tildes ("arbol" encuentra "Árbol") y los índices de
+# prefijo hacen que buscar mientras se escribe ("manz") sea rápido. Los handlers de admin
+# la mantienen sincronizada dentro de su transacción, y 'flask rebuild-search' la regenera.
+_busqueda_disponible = None
+_busqueda_chequeada_en = 0.0
+
+def indice_busqueda_disponible(forzar=False):
+    """
+    Me fijo si la tabla FTS existe (en bases viejas puede faltar hasta correr init-db). Un 'sí' lo
+    guardo para siempre; un 'no' lo vuelvo a chequear cada BUSQUEDA_RECHEQUEO segundos, porque
+    'flask init-db' o 'flask rebuild-search' corren en otro proceso y no tienen cómo avisarle a los workers.
+    Con forzar=True chequeo igual (lo usan las escrituras, ver sincronizar_busqueda).
+    """
+    global _busqueda_disponible, _busqueda_chequeada_en
+    if _busqueda_disponible:
+        return True
+    ahora = time.monotonic()
+    if forzar or _busqueda_disponible is None or ahora - _busqueda_chequeada_en >= app.config['BUSQUEDA_RECHEQUEO']:
+        disponible = db.session.execute(
+            db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'producto_fts'")
+        ).first() is not None
+        if not disponible and _busqueda_disponible is None:
+            logging.warning("No existe el índice de búsqueda 'producto_fts'. Corré 'flask init-db' o 'flask rebuild-search'.")
+        elif disponible and _busqueda_disponible is False:
+            logging.info("El índice de búsqueda 'producto_fts' ya está disponible.")
+        _busqueda_disponible, _busqueda_chequeada_en = disponible, ahora
+    return _busqueda_disponible
+
+def crear_indice_busqueda(reconstruir=False):
+    """Creo la tabla FTS (si hace falta) y, si está vacía o me lo piden, la lleno desde 'producto'."""
+    global _busqueda_disponible
+    if reconstruir:
+        db.session.execute(db.text("DROP TABLE IF EXISTS producto_fts"))
+    db.session.execute(db.text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS producto_fts USING fts5("
+        "nombre, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4')"
+    ))
+    if db.session.execute(db.text("SELECT count(*) FROM producto_fts")).scalar() == 0:
+        db.session.execute(db.text("INSERT INTO producto_fts(rowid, nombre) SELECT id, nombre FROM producto"))
+    db.session.commit()
+    _busqueda_disponible = True
+
+def sincronizar_busqueda(ids):
+    """Vuelvo a indexar estos productos (o los saco, si ya no existen). No hago commit."""
+    ids = [int(producto_id) for producto_id in ids]
+    # Acá no me fío del 'no' guardado: lo chequeo dentro de esta misma transacción de escritura.
+    # Si la tabla todavía no existe, el CLI que la cree la va a llenar con lo que yo commitee; si ya
+    # existe, la actualizo. Así el índice no queda desfasado mientras los workers se enteran.
+    if not ids or not indice_busqueda_disponible(forzar=True):
+        return
+    parametros = {f'id{i}': producto_id for i, producto_id in enumerate(ids)}
+    lista = ', '.join(f':id{i}' for i in range(len(ids)))
+    db.session.execute(db.text(f"DELETE FROM producto_fts WHERE rowid IN ({lista})"), parametros)
+    db.session.execute(
+        db.text(f"INSERT INTO producto_fts(rowid, nombre) SELECT id, nombre FROM producto WHERE id IN ({lista})"),
+        parametros
+    )
+
+def _consulta_fts(texto):
+    """
+    Armo la consulta FTS a partir de lo que escribió el usuario. Cada palabra va entre comillas
+    (así los caracteres especiales de FTS no rompen nada) y con '*' para que matchee por prefijo.
+    """
+    palabras = re.findall(r'\w+', texto, flags=re.UNICODE)
+    return ' '.join(f'"{palabra}"*' for palabra in palabras)
+
 # --- 6. Rutas para Renderizar las Plantillas HTML ---
 
 @app.route('/')
@@ -207,8 +1726,14 @@ def index():
 
 @app.route('/productos')
 def productos():
-    all_products = Producto.query.all()
-    return render_template('productos.html', products=all_products, current_user=current_user)
+    variante = _variante_catalogo_html()
+
+    def construir():
+        all_products = Producto.query.all()
+        return render_template('productos.html', products=all_products, current_user=current_user)
+
+    cuerpo, etag = _catalogo_cacheado(f'html:{variante}', construir)
+    return _respuesta_catalogo(cuerpo, etag, 'text/html', publica=False)
 
 @app.route('/carrito')
 def carrito():
@@ -232,22 +1757,77 @@ def admin_page():
     users = Usuario.query.all()
     return render_template('admin.html', users=users, current_user=current_user)
 
+# --- Historial de pedidos del cliente ---
+# El historial se pagina con el mismo cursor (fecha_pedido, id) que el listado del admin,
+# así cada página cuesta dos consultas fijas sin importar cuántos pedidos tenga el cliente:
+# una para los pedidos de la página y otra para sus líneas (ver _lineas_de_pedidos).
+# Los pedidos archivados se suman solo si se piden (?archivo=1), con una consulta más por tabla.
+MIS_PEDIDOS_POR_PAGINA = 20
+MIS_PEDIDOS_LIMITE_MAXIMO = 100
+
+def _pagina_pedidos_usuario(user_id, cursor_clave=None, limite=MIS_PEDIDOS_POR_PAGINA, incluir_archivo=False):
+    """
+    Traigo una página del historial de un usuario, del más nuevo al más viejo.
+    Devuelvo (pedidos, next_cursor): los pedidos son dicts (con 'fecha_pedido' como datetime,
+    para que el template la formatee) y next_cursor es None si no hay más.
+    """
+    def construir_consulta(modelo):
+        consulta = (
+            select(*_columnas_pedido(modelo))
+            .where(modelo.user_id == user_id)
+            .order_by(modelo.fecha_pedido.desc(), modelo.id.desc())
+        )
+        if cursor_clave:
+            consulta = consulta.where(_condicion_cursor(modelo, cursor_clave))
+        return consulta
+
+    # Una fila de más para saber si hay otra página sin contar.
+    filas = leer_pedidos_con_archivo(construir_consulta, limite + 1, incluir_archivo)
+    hay_mas = len(filas) > limite
+    filas = filas[:limite]
+
+    lineas = _lineas_de_filas(filas)
+    pedidos = [{
+        'id': fila.id,
+        'fecha_pedido': fila.fecha_pedido,
+        'total': fila.total,
+        'user_id': fila.user_id,
+        'estado': fila.estado,
+        'archivado': fila.archivado,
+        'items': lineas[fila.id]
+    } for fila in filas]
+
+    next_cursor = _codificar_cursor(filas[-1].fecha_pedido, filas[-1].id) if hay_mas else None
+    return pedidos, next_cursor
+
+def _usuario_tiene_archivados(user_id):
+    return db.session.execute(select(exists().where(PedidoArchivado.user_id == user_id))).scalar()
+
+# Ruta para ver los pedidos del usuario logueado, de a una página por vez (?cursor= para las siguientes).
+# Con ?archivo=1 también muestra los pedidos archivados.
 @app.route('/mis_pedidos')
 @login_required
 def mis_pedidos():
-    pedidos_usuario = Pedido.query.filter_by(user_id=current_user.id).options(
-        selectinload(Pedido.items).selectinload(DetallePedido.producto_del_detalle)
-    ).order_by(Pedido.fecha_pedido.desc()).all()
+    cursor = request.args.get('cursor')
+    incluir_archivo = incluir_archivo_pedidos(request.args)
+    try:
+        cursor_clave = _decodificar_cursor(cursor) if cursor else None
+    except ValueError:
+        # Un cursor roto (por ejemplo, un link editado a mano) no es motivo para un error: vuelvo a la primera página.
+        return redirect(url_for('mis_pedidos', archivo=1 if incluir_archivo else None))
 
-    logging.debug("\n--- DEBUG: Datos de Pedidos (antes de renderizar) ---")
-    for pedido in pedidos_usuario:
-        logging.debug(f"Pedido ID: {pedido.id}, Total: {pedido.total}")
-        for item in pedido.items:
-            item_dict = item.to_dict()
-            logging.debug(f"  - Item Dict (para HTML): {item_dict}")
-    logging.debug("--------------------------------------------------\n")
+    pedidos_usuario, next_cursor = _pagina_pedidos_usuario(current_user.id, cursor_clave, incluir_archivo=incluir_archivo)
+    # Al llegar al final del historial reciente, ofrezco ver los archivados (si el cliente tiene alguno).
+    ofrecer_archivo = not incluir_archivo and not next_cursor and _usuario_tiene_archivados(current_user.id)
 
-    return render_template('mis_pedidos.html', pedidos=pedidos_usuario, current_user=current_user)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("--- DEBUG: Datos de Pedidos (antes de renderizar) ---")
+        for pedido in pedidos_usuario:
+            logging.debug("Pedido ID: %s, Total: %s, Items: %s", pedido['id'], pedido['total'], pedido['items'])
+
+    return render_template('mis_pedidos.html', pedidos=pedidos_usuario, next_cursor=next_cursor,
+                           es_primera_pagina=cursor_clave is None, incluir_archivo=incluir_archivo,
+                           ofrecer_archivo=ofrecer_archivo, current_user=current_user)
 
 # Ruta para cerrar la sesión del usuario.
 @app.route('/logout')
@@ -259,6 +1839,25 @@ def logout():
 
 # --- 7. Rutas de la API (Endpoints para Interacción JavaScript) ---
 
+# API con el historial de pedidos del usuario logueado, paginado con cursor.
+# Parámetros opcionales: limit, cursor, archivo (1 para incluir los archivados). Devuelve {pedidos, next_cursor}.
+@app.route('/api/mis_pedidos', methods=['GET'])
+@login_required
+def api_mis_pedidos():
+    try:
+        cursor = request.args.get('cursor')
+        cursor_clave = _decodificar_cursor(cursor) if cursor else None
+        limite = int(request.args.get('limit', MIS_PEDIDOS_POR_PAGINA))
+    except ValueError as ve:
+        return jsonify({'message': str(ve)}), 400
+
+    limite = max(1, min(limite, MIS_PEDIDOS_LIMITE_MAXIMO))
+    pedidos_usuario, next_cursor = _pagina_pedidos_usuario(current_user.id, cursor_clave, limite,
+                                                           incluir_archivo_pedidos(request.args))
+    for pedido in pedidos_usuario:
+        pedido['fecha_pedido'] = pedido['fecha_pedido'].isoformat()
+    return jsonify({'pedidos': pedidos_usuario, 'next_cursor': next_cursor}), 200
+
 @app.route('/api/contacto', methods=['POST'])
 def recibir_contacto():
     data = request.get_json()
@@ -266,26 +1865,45 @@ def recibir_contacto():
     if not data or not all(k in data for k in ['name', 'email', 'subject', 'message']):
         return jsonify({'message': 'Faltan datos obligatorios'}), 400
 
-    nuevo_contacto = Contacto(
-        nombre=data['name'],
-        email=data['email'],
-        iva=data.get('iva', 'No especificado'),
-        condicion_compra=data.get('condicion', 'No especificado'),
-        asunto=data['subject'],
-        mensaje=data['message']
-    )
+    fila_contacto = {
+        'nombre': data['name'],
+        'email': data['email'],
+        'iva': data.get('iva', 'No especificado'),
+        'condicion_compra': data.get('condicion', 'No especificado'),
+        'asunto': data['subject'],
+        'mensaje': data['message']
+    }
+
+    # Si el buffer está activo (y tiene lugar), confirmo ya y el hilo escritor lo guarda con el próximo lote.
+    if app.config['CONTACTO_BUFFER'] and buffer_contactos.encolar(fila_contacto):
+        return jsonify({'message': 'Mensaje de contacto recibido con éxito!'}), 202
 
+    usar_escritor()
     try:
-        db.session.add(nuevo_contacto)
+        db.session.add(Contacto(**fila_contacto))
         db.session.commit()
         return jsonify({'message': 'Mensaje de contacto recibido y guardado con éxito!'}), 201
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error al guardar el contacto: {str(e)}")
+        logging.error("Error al guardar el contacto: %s", e)
         return jsonify({'message': f'Error al guardar el contacto: {str(e)}'}), 500
 
+# API para ver el estado del buffer de contactos (solo para admins).
+@app.route('/api/admin/contacto_buffer', methods=['GET'])
+@admin_required
+def contact_buffer_status():
+    return jsonify(buffer_contactos.estado()), 200
+
+def _respuesta_hash_saturado(error):
+    """Respuesta rápida cuando el pool de hasheo está lleno: 503 con Retry-After."""
+    logging.warning("Pool de hasheo saturado (%s pendientes): %s", servicio_hash.profundidad_cola(), error)
+    respuesta = jsonify({'message': 'El servidor está ocupado, intentá de nuevo en unos segundos.'})
+    respuesta.headers['Retry-After'] = '1'
+    return respuesta, 503
+
 # API para registrar un nuevo usuario.
 @app.route('/api/registros', methods=['POST'])
+@admision('registro')
 def registrar_usuario():
     data = request.get_json()
 
@@ -296,8 +1914,12 @@ def registrar_usuario():
         return jsonify({'message': 'El correo electrónico ya está registrado'}), 409
 
     nuevo_usuario = Usuario(nombre=data['nombre'], email=data['email'], rol='cliente')
-    nuevo_usuario.set_password(data['password'])
+    try:
+        nuevo_usuario.set_password(data['password'])
+    except ColaHashLlenaError as ce:
+        return _respuesta_hash_saturado(ce)
 
+    usar_escritor() # Recién ahora: el chequeo del email y el hasheo no ocupan la conexión de escritura.
     try:
         db.session.add(nuevo_usuario)
         db.session.commit() 
@@ -305,19 +1927,63 @@ def registrar_usuario():
         return jsonify({'message': '¡Registro exitoso! Has iniciado sesión automáticamente.', 'redirect_to': '/carrito'}), 201
     except Exception as e:
         db.session.rollback() 
-        logging.error(f"Error al registrar el usuario: {str(e)}")
+        logging.error("Error al registrar el usuario: %s", e)
         return jsonify({'message': f'Error al registrar el usuario: {str(e)}'}), 500
 
 # API para obtener todos los productos (para la página de productos del frontend).
 @app.route('/api/productos', methods=['GET'])
 def obtener_productos_api():
-    productos = Producto.query.all() 
-    productos_list = [producto.to_dict() for producto in productos]
-    logging.debug(f"Enviando {len(productos_list)} productos vía API.")
-    return jsonify(productos_list), 200
+    def construir():
+        productos_list = leer_productos()
+        logging.debug("Enviando %s productos vía API.", len(productos_list))
+        return jsonify(productos_list).get_data()
+
+    cuerpo, etag = _catalogo_cacheado('json', construir)
+    return _respuesta_catalogo(cuerpo, etag, 'application/json')
+
+# API para buscar productos por nombre (typeahead). Parámetros: q, limit (por defecto 10) y offset.
+# Los resultados vienen ordenados por relevancia (bm25) y paginados.
+@app.route('/api/productos/buscar', methods=['GET'])
+def buscar_productos():
+    consulta = _consulta_fts(request.args.get('q', ''))
+    try:
+        limite = max(1, min(int(request.args.get('limit', 10)), 100))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return jsonify({'message': 'limit y offset deben ser números'}), 400
+    if not consulta:
+        return jsonify({'resultados': [], 'total': 0, 'limit': limite, 'offset': offset}), 200
+
+    if indice_busqueda_disponible():
+        filas = db.session.execute(db.text(
+            "SELECT p.id, p.nombre, p.precio, p.imagen, p.stock FROM producto_fts "
+            "JOIN producto AS p ON p.id = producto_fts.rowid "
+            "WHERE producto_fts MATCH :consulta ORDER BY bm25(producto_fts), p.id LIMIT :limite OFFSET :offset"
+        ), {'consulta': consulta, 'limite': limite, 'offset': offset}).all()
+        total = db.session.execute(
+            db.text("SELECT count(*) FROM producto_fts WHERE producto_fts MATCH :consulta"), {'consulta': consulta}
+        ).scalar()
+    else:
+        # Sin índice, busco con LIKE (más lento, pero la ruta sigue funcionando). Escapo los comodines
+        # para que un '%' o un '_' en la búsqueda se busquen tal cual y no matcheen cualquier cosa.
+        texto = request.args.get('q', '').strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        condicion = Producto.nombre.like(f"%{texto}%", escape='\\')
+        columnas = (Producto.id, Producto.nombre, Producto.precio, Producto.imagen, Producto.stock)
+        filas = db.session.execute(
+            select(*columnas).where(condicion).order_by(Producto.nombre).limit(limite).offset(offset)
+        ).all()
+        total = db.session.execute(select(func.count(Producto.id)).where(condicion)).scalar()
+
+    return jsonify({
+        'resultados': [dict(fila._mapping) for fila in filas],
+        'total': total,
+        'limit': limite,
+        'offset': offset
+    }), 200
 
 # API para iniciar sesión.
 @app.route('/api/login', methods=['POST'])
+@admision('login', clave_usuario=_email_login_admision)
 def iniciar_sesion():
     data = request.get_json()
 
@@ -326,8 +1992,19 @@ def iniciar_sesion():
 
     usuario = Usuario.query.filter_by(email=data['email']).first()
 
-    if usuario and usuario.check_password(data['password']):
+    try:
+        password_ok = usuario is not None and usuario.check_password(data['password'])
+        if password_ok and usuario.rehash_si_hace_falta(data['password']):
+            usar_escritor()
+            db.session.commit()
+            logging.info("Hash de contraseña actualizado para el usuario ID %s.", usuario.id)
+    except ColaHashLlenaError as ce:
+        return _respuesta_hash_saturado(ce)
+
+    if password_ok:
         login_user(usuario)
+        # Ya tengo los datos a mano, así que dejo la identidad cacheada para las próximas requests.
+        cache_identidades.guardar(IdentidadUsuario(usuario.id, usuario.nombre, usuario.email, usuario.rol))
         redirect_url = '/admin' if usuario.rol == 'admin' else '/productos'
         return jsonify({'message': 'Inicio de sesión exitoso', 'user': {'id': usuario.id, 'nombre': usuario.nombre, 'email': usuario.email, 'rol': usuario.rol}, 'redirect_to': redirect_url}), 200
     else:
@@ -339,8 +2016,38 @@ def check_login_status():
     is_logged_in = current_user.is_authenticated 
     return jsonify({'isLoggedIn': is_logged_in})
 
+# API con el estado del control de admisión: requests en curso por clase y rechazos acumulados (solo para admins).
+@app.route('/api/admin/admision', methods=['GET'])
+@admin_required
+def admission_status():
+    return jsonify(backend_admision.estado()), 200
+
+# API para ver el estado del pool de hasheo de contraseñas (solo para admins).
+@app.route('/api/admin/hash_status', methods=['GET'])
+@admin_required
+def hash_status():
+    return jsonify({
+        'metodo': servicio_hash.metodo,
+        'workers': app.config['PASSWORD_HASH_WORKERS'],
+        'pendientes': servicio_hash.profundidad_cola(),
+        'max_pendientes': app.config['PASSWORD_HASH_MAX_PENDIENTES']
+    }), 200
+
+# API con las métricas de rendimiento acumuladas por ruta (solo para admins). Con ?reiniciar=1 las pone en cero.
+# Son las de este worker nomás (ver MetricasRutas): devuelvo el pid para poder juntarlas por worker.
+@app.route('/api/admin/metrics', methods=['GET'])
+@admin_required
+def performance_metrics():
+    desde = metricas_rutas.desde()
+    resumen = metricas_rutas.resumen()
+    if request.args.get('reiniciar') == '1':
+        metricas_rutas.reiniciar()
+    return jsonify({'pid': os.getpid(), 'alcance': 'worker', 'desde': desde.isoformat(),
+                    'buckets_ms': BUCKETS_LATENCIA_MS, 'rutas': resumen}), 200
+
 @app.route('/api/admin/change_user_role', methods=['POST'])
 @admin_required 
+@escritura
 def change_user_role():
     data = request.get_json()
     user_id = data.get('user_id')
@@ -360,15 +2067,17 @@ def change_user_role():
     user.rol = new_role
     try:
         db.session.commit()
+        cache_identidades.invalidar(user.id)
         return jsonify({'message': f'Rol de usuario {user.email} actualizado a {new_role}'}), 200 # Devuelvo éxito.
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error al actualizar el rol: {str(e)}")
+        logging.error("Error al actualizar el rol: %s", e)
         return jsonify({'message': f'Error al actualizar el rol: {str(e)}'}), 500
 
 # API para ELIMINAR UN USUARIO (solo para admins).
 @app.route('/api/admin/delete_user/<int:user_id>', methods=['DELETE'])
 @admin_required
+@escritura
 def delete_user(user_id):
     user_to_delete = Usuario.query.get(user_id)
     if not user_to_delete:
@@ -377,21 +2086,33 @@ def delete_user(user_id):
     if user_to_delete.id == current_user.id:
         return jsonify({'message': 'No puedes eliminar tu propia cuenta de administrador'}), 403
 
+    lineas = sum(db.session.execute(
+        select(func.count(detalle.id)).join(pedido, detalle.pedido_id == pedido.id)
+        .where(pedido.user_id == user_id)
+    ).scalar() for pedido, detalle in ((Pedido, DetallePedido), (PedidoArchivado, DetallePedidoArchivado)))
+
+    # La identidad en caché la descarto recién después del commit (acá o al final del trabajo en
+    # segundo plano): si la invalido antes, otra request puede volver a cargarla de la base mientras
+    # el usuario todavía existe, y quedaría en la caché ya borrado.
+    if lineas > app.config['BORRADO_UMBRAL_SINCRONO']:
+        trabajo = lanzar_trabajo_borrado('usuario', user_id, lineas, _borrar_usuario_por_lotes)
+        return jsonify({'message': f'El usuario tiene {lineas} líneas de pedido; se eliminará en segundo plano.',
+                        'trabajo': trabajo}), 202
+
     try:
-        for pedido in user_to_delete.pedidos:
-            DetallePedido.query.filter_by(pedido_id=pedido.id).delete()
-        Pedido.query.filter_by(user_id=user_to_delete.id).delete()
-        db.session.delete(user_to_delete)
+        _borrar_usuario(user_id)
         db.session.commit()
+        cache_identidades.invalidar(user_id)
         return jsonify({'message': 'Usuario y sus datos asociados eliminados exitosamente'}), 200
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error al eliminar el usuario ID {user_id}: {str(e)}")
+        logging.error("Error al eliminar el usuario ID %s: %s", user_id, e)
         return jsonify({'message': f'Error al eliminar el usuario: {str(e)}'}), 500
 
 # API para AGREGAR UN NUEVO PRODUCTO (solo para admins).
 @app.route('/api/admin/products', methods=['POST'])
 @admin_required
+@escritura
 def add_product():
     nombre = request.form.get('nombre')
     precio = request.form.get('precio')
@@ -405,34 +2126,39 @@ def add_product():
 
     file = request.files['imagen']
     try:
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(app.root_path, 'static/img', filename))
-        imagen_path = f'img/{filename}'
-
         precio_float = float(precio)
         stock_int = int(stock) 
         if stock_int < 0:
             return jsonify({'message': 'El stock no puede ser negativo'}), 400
     except ValueError:
         return jsonify({'message': 'El precio y el stock deben ser números válidos'}), 400
+
+    try:
+        imagen_path = guardar_imagen_subida(file)
     except Exception as e:
-        logging.error(f"Error al guardar la imagen: {str(e)}")
+        logging.error("Error al guardar la imagen: %s", e)
         return jsonify({'message': 'Error al guardar la imagen'}), 500
 
     new_product = Producto(nombre=nombre, precio=precio_float, imagen=imagen_path, stock=stock_int)
     try:
         db.session.add(new_product) 
+        db.session.flush()
+        sincronizar_busqueda([new_product.id])
         db.session.commit()
-        logging.info(f"Producto '{nombre}' agregado exitosamente con stock {stock_int}.")
+        invalidar_catalogo()
+        encolar_procesamiento_imagen(new_product.id, imagen_path)
+        logging.info("Producto '%s' agregado exitosamente con stock %s.", nombre, stock_int)
         return jsonify({'message': 'Producto agregado exitosamente', 'product': new_product.to_dict()}), 201
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error al agregar el producto: {str(e)}")
+        borrar_imagenes_sin_uso({imagen_path})
+        logging.error("Error al agregar el producto: %s", e)
         return jsonify({'message': f'Error al agregar el producto: {str(e)}'}), 500
     
 # API para EDITAR UN PRODUCTO EXISTENTE (solo para admins).
 @app.route('/api/admin/products/<int:product_id>', methods=['PUT'])
 @admin_required
+@escritura
 def update_product(product_id):
     product_to_update = Producto.query.get(product_id)
     if not product_to_update:
@@ -442,137 +2168,1105 @@ def update_product(product_id):
     product_to_update.precio = float(request.form.get('precio'))
     product_to_update.stock = int(request.form.get('stock'))
 
+    imagen_nueva = None
+    # Los archivos de la imagen actual: si la reemplazo, los borro recién después del commit.
+    imagenes_viejas = archivos_imagen_producto(product_to_update.imagen, product_to_update.imagen_variantes)
     if 'imagen' in request.files and request.files['imagen'].filename != '':
         file = request.files['imagen']
         try:
-            filename = secure_filename(file.filename)
-            file.save(os.path.join(app.root_path, 'static/img', filename))
-            product_to_update.imagen = f'img/{filename}'
+            imagen_nueva = guardar_imagen_subida(file)
+            product_to_update.imagen = imagen_nueva
+            product_to_update.imagen_variantes = None
         except Exception as e:
-            logging.error(f"Error al actualizar la imagen: {str(e)}")
+            logging.error("Error al actualizar la imagen: %s", e)
             return jsonify({'message': 'Error al actualizar la imagen'}), 500
 
     try:
+        # El índice se arma con SQL directo desde la tabla: primero tiene que llegar el nombre nuevo.
+        db.session.flush()
+        sincronizar_busqueda([product_to_update.id])
         db.session.commit()
-        logging.info(f"Producto '{product_to_update.nombre}' actualizado exitosamente.")
+        invalidar_catalogo()
+        if imagen_nueva:
+            encolar_procesamiento_imagen(product_to_update.id, imagen_nueva)
+            borrar_imagenes_sin_uso(imagenes_viejas)
+        logging.info("Producto '%s' actualizado exitosamente.", product_to_update.nombre)
         return jsonify({'message': 'Producto actualizado exitosamente', 'product': product_to_update.to_dict()}), 200
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error al actualizar el producto: {str(e)}")
+        if imagen_nueva:
+            borrar_imagenes_sin_uso({imagen_nueva})
+        logging.error("Error al actualizar el producto: %s", e)
         return jsonify({'message': f'Error al actualizar el producto: {str(e)}'}), 500
 
 # API para ELIMINAR UN PRODUCTO (solo para admins).
 @app.route('/api/admin/products/<int:product_id>', methods=['DELETE'])
 @admin_required
+@escritura
 def delete_product(product_id):
     product_to_delete = Producto.query.get(product_id)
     if not product_to_delete:
         return jsonify({'message': 'Producto no encontrado'}), 404
 
+    lineas = sum(db.session.execute(
+        select(func.count(detalle.id)).where(detalle.producto_id == product_id)
+    ).scalar() for detalle in (DetallePedido, DetallePedidoArchivado))
+
+    if lineas > app.config['BORRADO_UMBRAL_SINCRONO']:
+        # Mientras se borra en segundo plano, dejo el producto sin stock para que nadie lo compre.
+        db.session.execute(update(Producto).where(Producto.id == product_id).values(stock=0))
+        db.session.commit()
+        invalidar_catalogo()
+        trabajo = lanzar_trabajo_borrado('producto', product_id, lineas, _borrar_producto_por_lotes)
+        return jsonify({'message': f'El producto aparece en {lineas} líneas de pedido; se eliminará en segundo plano.',
+                        'trabajo': trabajo}), 202
+
     try:
-        DetallePedido.query.filter_by(producto_id=product_id).delete()
-        db.session.delete(product_to_delete)
+        imagenes = _borrar_producto(product_id)
         db.session.commit()
-        logging.info(f"Producto ID {product_id} eliminado exitosamente.")
+        invalidar_catalogo()
+        borrar_imagenes_sin_uso(imagenes)
+        logging.info("Producto ID %s eliminado exitosamente.", product_id)
         return jsonify({'message': 'Producto y sus detalles de pedido asociados eliminados exitosamente'}), 200
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error al eliminar el producto ID {product_id}: {str(e)}")
+        logging.error("Error al eliminar el producto ID %s: %s", product_id, e)
         return jsonify({'message': f'Error al eliminar el producto: {str(e)}'}), 500
 
+# --- Importación y Exportación Masiva de Productos ---
+# Para las actualizaciones de temporada (miles de cambios de precio y stock) cargar producto
+# por producto es inviable. Acá leo CSV, NDJSON o JSON fila por fila y aplico los cambios
+# en lotes: por cada lote hago una consulta para ver qué productos ya existen, un UPDATE
+# masivo, un INSERT masivo y un commit. Las filas con errores no frenan la importación,
+# se devuelven en un reporte. La exportación también va de a lotes y en streaming.
+PRODUCTOS_LOTE_IMPORTACION = 500
+PRODUCTOS_LOTE_EXPORTACION = 1000
+CAMPOS_EXPORTACION_PRODUCTOS = ['id', 'nombre', 'precio', 'stock', 'imagen']
+PRODUCTO_IMAGEN_GENERICA = 'img/unnamed.png'
+
+def _filas_productos(stream_binario, formato):
+    """Convierto el archivo de entrada en un iterador de dicts, sin cargarlo entero (salvo JSON, que es un array)."""
+    texto = io.TextIOWrapper(stream_binario, encoding='utf-8-sig', newline='')
+    if formato == 'csv':
+        yield from csv.DictReader(texto)
+    elif formato == 'ndjson':
+        for linea in texto:
+            if linea.strip():
+                yield json.loads(linea)
+    elif formato == 'json':
+        yield from json.load(texto)
+    else:
+        raise ValueError(f'Formato no soportado: {formato}. Usá csv, ndjson o json.')
+
+def _validar_fila_producto(fila):
+    """Devuelvo los valores de la fila ya convertidos. Si algo no cierra, lanzo ValueError con el motivo."""
+    if not isinstance(fila, dict):
+        raise ValueError('La fila debe ser un objeto con campos.')
+    producto_id = fila.get('id')
+    producto_id = int(producto_id) if producto_id not in (None, '') else None
+    nombre = fila.get('nombre')
+    if nombre is not None and not isinstance(nombre, str):
+        raise ValueError('El nombre debe ser un texto.')
+    nombre = (nombre or '').strip() or None
+    if producto_id is None and nombre is None:
+        raise ValueError('Cada fila necesita un id o un nombre.')
+    valores = {}
+    if nombre is not None:
+        valores['nombre'] = nombre
+    if fila.get('precio') not in (None, ''):
+        valores['precio'] = float(fila['precio'])
+        if valores['precio'] < 0:
+            raise ValueError('El precio no puede ser negativo.')
+    if fila.get('stock') not in (None, ''):
+        valores['stock'] = int(fila['stock'])
+        if valores['stock'] < 0:
+            raise ValueError('El stock no puede ser negativo.')
+    if fila.get('imagen'):
+        if not isinstance(fila['imagen'], str):
+            raise ValueError('La imagen debe ser un texto.')
+        valores['imagen'] = fila['imagen']
+    return producto_id, valores
+
+def _aplicar_lote_productos(lote, reporte):
+    """Aplico un lote de (numero_fila, producto_id, valores) en una sola transacción."""
+    ids = [producto_id for _, producto_id, _ in lote if producto_id is not None]
+    nombres = [valores['nombre'] for _, producto_id, valores in lote if producto_id is None]
+    existentes_por_id = set(db.session.execute(select(Producto.id).where(Producto.id.in_(ids))).scalars()) if ids else set()
+    existentes_por_nombre = dict(
+        db.session.execute(select(Producto.nombre, Producto.id).where(Producto.nombre.in_(nombres))).all()
+    ) if nombres else {}
+
+    actualizaciones, altas = {}, {}
+    for numero_fila, producto_id, valores in lote:
+        if producto_id is None:
+            producto_id = existentes_por_nombre.get(valores['nombre'])
+        elif producto_id not in existentes_por_id:
+            reporte['errores'].append({'fila': numero_fila, 'error': f'No existe un producto con ID {producto_id}.'})
+            continue
+        if producto_id is not None:
+            # Si el mismo producto aparece dos veces en el lote, gana la última fila.
+            actualizaciones.setdefault(producto_id, {'id': producto_id}).update(valores)
+        elif 'precio' in valores or valores['nombre'] in altas:
+            # Los productos nuevos arrancan con la imagen genérica hasta que se les suba una.
+            # Si el mismo nombre nuevo aparece dos veces en el lote, es un solo producto y gana la última fila.
+            altas.setdefault(valores['nombre'], {'stock': 0, 'imagen': PRODUCTO_IMAGEN_GENERICA}).update(valores)
+        else:
+            reporte['errores'].append({'fila': numero_fila, 'error': 'Un producto nuevo necesita precio.'})
+
+    try:
+        tocados = list(actualizaciones)
+        if actualizaciones:
+            db.session.execute(update(Producto), list(actualizaciones.values()))
+        if altas:
+            tocados += db.session.execute(insert(Producto).returning(Producto.id), list(altas.values())).scalars().all()
+        sincronizar_busqueda(tocados)
+        db.session.commit()
+        reporte['actualizados'] += len(actualizaciones)
+        reporte['creados'] += len(altas)
+    except Exception as e:
+        db.session.rollback()
+        logging.error("Error al aplicar un lote de productos: %s", e)
+        for numero_fila, _, _ in lote:
+            reporte['errores'].append({'fila': numero_fila, 'error': f'El lote no se pudo guardar: {e}'})
+
+def importar_productos(filas):
+    """Recorro las filas, las valido y las aplico de a lotes. Devuelvo el reporte de la importación."""
+    reporte = {'procesadas': 0, 'creados': 0, 'actualizados': 0, 'errores': []}
+    lote = []
+    numero_fila = 0
+    try:
+        for numero_fila, fila in enumerate(filas, start=1):
+            reporte['procesadas'] += 1
+            try:
+                producto_id, valores = _validar_fila_producto(fila)
+            except (ValueError, TypeError) as e:
+                reporte['errores'].append({'fila': numero_fila, 'error': str(e)})
+                continue
+            lote.append((numero_fila, producto_id, valores))
+            if len(lote) >= PRODUCTOS_LOTE_IMPORTACION:
+                _aplicar_lote_productos(lote, reporte)
+                lote = []
+    except (ValueError, csv.Error) as e:
+        # El archivo en sí está mal formado: lo que ya se aplicó queda, y aviso dónde se cortó.
+        reporte['errores'].append({'fila': numero_fila + 1, 'error': f'Archivo inválido: {e}'})
+    if lote:
+        _aplicar_lote_productos(lote, reporte)
+    if reporte['creados'] or reporte['actualizados']:
+        invalidar_catalogo()
+    reporte['errores'].sort(key=lambda error: error['fila'])
+    return reporte
+
+def exportar_productos(formato):
+    """Genero el catálogo en CSV o NDJSON de a lotes ordenados por id, sin armar toda la tabla en memoria."""
+    if formato not in ('csv', 'ndjson'):
+        raise ValueError(f'Formato no soportado: {formato}. Usá csv o ndjson.')
+    columnas = [getattr(Producto, campo) for campo in CAMPOS_EXPORTACION_PRODUCTOS]
+    if formato == 'csv':
+        yield ','.join(CAMPOS_EXPORTACION_PRODUCTOS) + '\n'
+    ultimo_id = 0
+    while True:
+        filas = db.session.execute(
+            select(*columnas).where(Producto.id > ultimo_id).order_by(Producto.id).limit(PRODUCTOS_LOTE_EXPORTACION)
+        ).all()
+        if not filas:
+            break
+        buffer = io.StringIO()
+        if formato == 'csv':
+            csv.writer(buffer, lineterminator='\n').writerows(filas)
+        else:
+            for fila in filas:
+                buffer.write(json.dumps(dict(fila._mapping), ensure_ascii=False) + '\n')
+        yield buffer.getvalue()
+        ultimo_id = filas[-1].id
+
+# API para IMPORTAR productos en bloque (solo para admins).
+# Acepta el archivo como campo 'archivo' (multipart) o directamente en el cuerpo.
+# El formato sale de ?formato=, de la extensión del archivo o del Content-Type.
+@app.route('/api/admin/products/import', methods=['POST'])
+@admin_required
+@escritura
+def import_products():
+    if 'archivo' in request.files:
+        archivo = request.files['archivo']
+        stream = archivo.stream
+        extension = os.path.splitext(archivo.filename or '')[1].lstrip('.').lower()
+    else:
+        stream = request.stream
+        extension = ''
+    tipo = (request.mimetype or '').lower()
+    formato = request.args.get('formato') or extension or (
+        'csv' if 'csv' in tipo else 'ndjson' if 'ndjson' in tipo else 'json'
+    )
+    try:
+        reporte = importar_productos(_filas_productos(stream, formato))
+    except ValueError as ve:
+        return jsonify({'message': str(ve)}), 400
+    logging.info("Importación de productos: %s creados, %s actualizados, %s errores.",
+                 reporte['creados'], reporte['actualizados'], len(reporte['errores']))
+    status = 200 if not reporte['errores'] else 207
+    return jsonify({'message': 'Importación finalizada', **reporte}), status
+
+# API para EXPORTAR el catálogo (solo para admins), en streaming. ?formato=csv (por defecto) o ndjson.
+@app.route('/api/admin/products/export', methods=['GET'])
+@admin_required
+def export_products():
+    formato = request.args.get('formato', 'csv')
+    if formato not in ('csv', 'ndjson'):
+        return jsonify({'message': 'Formato no soportado. Usá csv o ndjson.'}), 400
+    mimetype = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+    respuesta = Response(stream_with_context(exportar_productos(formato)), mimetype=mimetype)
+    respuesta.headers['Content-Disposition'] = f'attachment; filename=productos.{formato}'
+    return respuesta
+
+# --- Agregados de Ventas ---
+# Cada vez que se crea, cambia de estado o se borra un pedido, sumo o resto su aporte en
+# las tablas de ventas diarias, dentro de la misma transacción. El aporte lo calculo con un
+# GROUP BY sobre las líneas afectadas y lo aplico con upserts (INSERT ... ON CONFLICT DO UPDATE).
+
+def _lineas_ventas(condicion, pedido=Pedido, detalle=DetallePedido):
+    """Unidades e ingresos por (día, producto, estado) de las líneas que cumplen la condición."""
+    dia = func.date(pedido.fecha_pedido)
+    return db.session.execute(
+        select(dia.label('fecha'), detalle.producto_id, pedido.estado,
+               func.sum(detalle.cantidad).label('unidades'),
+               func.sum(detalle.cantidad * detalle.precio_unitario).label('ingresos'))
+        .join(pedido, detalle.pedido_id == pedido.id)
+        .where(condicion)
+        .group_by(dia, detalle.producto_id, pedido.estado)
+    ).all()
+
+def _pedidos_ventas(condicion, pedido=Pedido, detalle=DetallePedido):
+    """Cantidad de pedidos e ingresos por (día, estado). Uso outer join para contar también pedidos sin líneas."""
+    dia = func.date(pedido.fecha_pedido)
+    return db.session.execute(
+        select(dia.label('fecha'), pedido.estado,
+               func.count(func.distinct(pedido.id)).label('pedidos'),
+               func.coalesce(func.sum(detalle.cantidad * detalle.precio_unitario), 0.0).label('ingresos'))
+        .select_from(pedido)
+        .outerjoin(detalle, detalle.pedido_id == pedido.id)
+        .where(condicion)
+        .group_by(dia, pedido.estado)
+    ).all()
+
+def _upsert_sumando(modelo, claves, valores, filas):
+    """Sumo 'valores' sobre las filas existentes de 'modelo' (o las creo si no existen)."""
+    if not filas:
+        return
+    sentencia = sqlite_insert(modelo)
+    sentencia = sentencia.on_conflict_do_update(
+        index_elements=claves,
+        set_={campo: getattr(modelo, campo) + getattr(sentencia.excluded, campo) for campo in valores}
+    )
+    db.session.execute(sentencia, filas)
+
+def ajustar_ventas(condicion, signo, contar_pedidos=True, archivados=False):
+    """
+    Sumo (signo=1) o resto (signo=-1) en los agregados el aporte de lo que cumple 'condicion'.
+    Con contar_pedidos=False solo muevo unidades e ingresos (por ejemplo, cuando se borran
+    las líneas de un producto pero los pedidos siguen existiendo). Con archivados=True la
+    condición es sobre las tablas del archivo (PedidoArchivado, DetallePedidoArchivado).
+    """
+    tablas = (PedidoArchivado, DetallePedidoArchivado) if archivados else (Pedido, DetallePedido)
+    lineas = _lineas_ventas(condicion, *tablas)
+    _upsert_sumando(VentaDiariaProducto, ['fecha', 'producto_id', 'estado'], ['unidades', 'ingresos'], [
+        {'fecha': date.fromisoformat(f.fecha), 'producto_id': f.producto_id, 'estado': f.estado,
+         'unidades': signo * f.unidades, 'ingresos': signo * f.ingresos}
+        for f in lineas
+    ])
+    pedidos = _pedidos_ventas(condicion, *tablas)
+    _upsert_sumando(VentaDiariaEstado, ['fecha', 'estado'], ['pedidos', 'ingresos'], [
+        {'fecha': date.fromisoformat(f.fecha), 'estado': f.estado,
+         'pedidos': signo * f.pedidos if contar_pedidos else 0, 'ingresos': signo * f.ingresos}
+        for f in pedidos
+    ])
+
+def _fuente_ventas():
+    """
+    Los pedidos con sus líneas (outer join: una fila por línea, o una sola con la línea en NULL si no tiene),
+    de las tablas calientes y del archivo juntas. Archivar un pedido no cambia su aporte a las ventas.
+    """
+    def filas(pedido, detalle):
+        return (
+            select(pedido.id.label('pedido_id'), func.date(pedido.fecha_pedido).label('fecha'), pedido.estado,
+                   detalle.producto_id, detalle.cantidad, detalle.precio_unitario)
+            .select_from(pedido)
+            .outerjoin(detalle, detalle.pedido_id == pedido.id)
+        )
+    return union_all(filas(Pedido, DetallePedido), filas(PedidoArchivado, DetallePedidoArchivado)).subquery()
+
+def reconstruir_ventas():
+    """Borro los agregados y los vuelvo a calcular desde cero con dos INSERT ... SELECT."""
+    db.session.execute(delete(VentaDiariaProducto))
+    db.session.execute(delete(VentaDiariaEstado))
+    fuente = _fuente_ventas()
+    db.session.execute(insert(VentaDiariaProducto).from_select(
+        ['fecha', 'producto_id', 'estado', 'unidades', 'ingresos'],
+        select(fuente.c.fecha, fuente.c.producto_id, fuente.c.estado,
+               func.sum(fuente.c.cantidad), func.sum(fuente.c.cantidad * fuente.c.precio_unitario))
+        .where(fuente.c.producto_id.is_not(None))
+        .group_by(fuente.c.fecha, fuente.c.producto_id, fuente.c.estado)
+    ))
+    db.session.execute(insert(VentaDiariaEstado).from_select(
+        ['fecha', 'estado', 'pedidos', 'ingresos'],
+        select(fuente.c.fecha, fuente.c.estado, func.count(func.distinct(fuente.c.pedido_id)),
+               func.coalesce(func.sum(fuente.c.cantidad * fuente.c.precio_unitario), 0.0))
+        .group_by(fuente.c.fecha, fuente.c.estado)
+    ))
+    db.session.commit()
+
+# --- Eventos de Pedidos (Server-Sent Events) ---
+# Cada cambio en un pedido deja una fila en EventoPedido dentro de la misma transacción que el
+# cambio, así que un evento existe si y solo si el cambio se confirmó. El feed del admin lee los
+# eventos con id mayor al último que mandó; como están en la base, sirve aunque la app corra en
+# varios procesos. Dentro del proceso, un Condition despierta a los feeds apenas hay un commit
+# con eventos, y el intervalo de revisión cubre los cambios hechos por otros procesos.
+TIPOS_EVENTO_PEDIDO = ('pedido_nuevo', 'pedido_estado', 'pedido_eliminado', 'pedido_archivado')
+_aviso_eventos_pedidos = threading.Condition()
+
+def registrar_eventos_pedidos(tipo, condicion):
+    """Registro un evento por cada pedido que cumple 'condicion', en la transacción actual. No hago commit."""
+    db.session.execute(
+        insert(EventoPedido).from_select(
+            ['tipo', 'pedido_id', 'estado'],
+            select(literal(tipo), Pedido.id, Pedido.estado).where(condicion).order_by(Pedido.id)
+        )
+    )
+    # Me quedo solo con los últimos EVENTOS_PEDIDOS_RETENCION (es un rango sobre la clave primaria, barato).
+    ultimo = select(func.max(EventoPedido.id)).scalar_subquery()
+    db.session.execute(delete(EventoPedido).where(EventoPedido.id <= ultimo - app.config['EVENTOS_PEDIDOS_RETENCION']))
+    db.session.info['eventos_pedidos'] = True
+
+@event.listens_for(SessionORM, "after_commit")
+def _avisar_eventos_pedidos(session):
+    if session.info.pop('eventos_pedidos', False):
+        with _aviso_eventos_pedidos:
+            _aviso_eventos_pedidos.notify_all()
+
+@event.listens_for(SessionORM, "after_rollback")
+def _descartar_aviso_eventos(session):
+    session.info.pop('eventos_pedidos', None)
+
+def ultimo_evento_pedidos():
+    return db.session.execute(select(func.coalesce(func.max(EventoPedido.id), 0))).scalar()
+
+def leer_eventos_pedidos(desde_id, limite=500):
+    """
+    Devuelvo una lista de (id, tipo, datos) con los eventos posteriores a 'desde_id'.
+    Los altas traen el pedido completo (mismo formato que /api/admin/pedidos), leído en una sola tanda;
+    si el pedido ya no existe lo salteo, porque detrás viene su evento de baja.
+    """
+    filas = db.session.execute(
+        select(EventoPedido.id, EventoPedido.tipo, EventoPedido.pedido_id, EventoPedido.estado)
+        .where(EventoPedido.id > desde_id).order_by(EventoPedido.id).limit(limite)
+    ).all()
+    ids_nuevos = [fila.pedido_id for fila in filas if fila.tipo == 'pedido_nuevo']
+    pedidos = {}
+    if ids_nuevos:
+        filas_pedidos = db.session.execute(
+            select(*COLUMNAS_PEDIDO_ADMIN).outerjoin(Usuario, Usuario.id == Pedido.user_id).where(Pedido.id.in_(ids_nuevos))
+        ).all()
+        pedidos = {pedido['id']: pedido for pedido in pedidos_admin_a_dicts(filas_pedidos)}
+
+    eventos = []
+    for fila in filas:
+        if fila.tipo == 'pedido_nuevo':
+            if fila.pedido_id not in pedidos:
+                continue
+            datos = pedidos[fila.pedido_id]
+        else:
+            datos = {'id': fila.pedido_id, 'estado': fila.estado}
+        eventos.append((fila.id, fila.tipo, datos))
+    # Devuelvo también el id de la última fila leída, para avanzar aunque haya salteado alguna.
+    return eventos, (filas[-1].id if filas else desde_id)
+
+def _formato_sse(evento_id, tipo, datos):
+    return f"id: {evento_id}\nevent: {tipo}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+# Feed SSE de novedades de pedidos (solo para admins). Se arranca desde ?desde=<id> (el
+# 'ultimo_evento' que devuelve /api/admin/pedidos) o desde el header Last-Event-ID que manda el
+# navegador al reconectarse. Si ese id ya se descartó por la retención, mando un evento 'reinicio'
+# para que el panel recargue la lista completa.
+@app.route('/api/admin/pedidos/eventos', methods=['GET'])
+@admin_required
+def order_events():
+    desde = request.headers.get('Last-Event-ID') or request.args.get('desde')
+    try:
+        desde_id = int(desde) if desde else None
+    except ValueError:
+        return jsonify({'message': 'El id de evento debe ser un número'}), 400
+
+    primero = db.session.execute(select(func.min(EventoPedido.id))).scalar()
+    if desde_id is None:
+        desde_id = ultimo_evento_pedidos()
+    perdio_eventos = primero is not None and desde_id < primero - 1
+    # Cierro la transacción de lectura antes de empezar a mandar: la conexión puede durar minutos.
+    db.session.close()
+
+    def generar():
+        ultimo_id = desde_id
+        yield f"retry: {int(app.config['EVENTOS_PEDIDOS_INTERVALO'] * 1000)}\n\n"
+        if perdio_eventos:
+            ultimo_id = ultimo_evento_pedidos()
+            db.session.close()
+            yield _formato_sse(ultimo_id, 'reinicio', {})
+
+        fin = time.monotonic() + app.config['EVENTOS_PEDIDOS_DURACION_MAXIMA']
+        ultimo_envio = time.monotonic()
+        while time.monotonic() < fin and not _estado_servidor['drenando']:
+            eventos, ultimo_id = leer_eventos_pedidos(ultimo_id)
+            db.session.close()
+            if eventos:
+                yield ''.join(_formato_sse(*evento) for evento in eventos)
+                ultimo_envio = time.monotonic()
+            elif time.monotonic() - ultimo_envio >= app.config['EVENTOS_PEDIDOS_LATIDO']:
+                # Un comentario SSE mantiene viva la conexión (y detecta si el cliente se fue).
+                yield ": latido\n\n"
+                ultimo_envio = time.monotonic()
+            with _aviso_eventos_pedidos:
+                _aviso_eventos_pedidos.wait(timeout=app.config['EVENTOS_PEDIDOS_INTERVALO'])
+
+    respuesta = Response(stream_with_context(generar()), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    respuesta.headers['X-Accel-Buffering'] = 'no' # Para que un proxy (nginx) no junte los eventos.
+    return respuesta
+
+# --- Borrados en Cascada por Conjuntos y Trabajos en Segundo Plano ---
+# Antes, borrar un usuario recorría sus pedidos uno por uno (cargándolos todos) y borrar
+# un producto eliminaba todas sus líneas en la misma request. Con historiales grandes eso
+# dejaba el lock de escritura de SQLite tomado un buen rato. Ahora uso pocas sentencias
+# DELETE por conjunto y dejo que el 'ondelete=CASCADE' de DetallePedido borre las líneas.
+# Si el volumen supera BORRADO_UMBRAL_SINCRONO, el borrado va a un hilo aparte que trabaja
+# de a lotes (una transacción corta por lote), y el admin puede consultar el progreso.
+# El estado de cada trabajo vive en la tabla trabajo_borrado, así lo ve cualquier worker.
+_executor_borrados = ThreadPoolExecutor(max_workers=1, thread_name_prefix='borrados')
+atexit.register(_executor_borrados.shutdown, wait=True)
+ESTADOS_TRABAJO_ABIERTOS = ('pendiente', 'en_curso')
+
+def _borrar_usuario(user_id):
+    """Borro los pedidos del usuario, calientes y archivados (las líneas caen por cascada), y después el usuario. No hago commit."""
+    ajustar_ventas(Pedido.user_id == user_id, -1)
+    registrar_eventos_pedidos('pedido_eliminado', Pedido.user_id == user_id)
+    db.session.execute(delete(Pedido).where(Pedido.user_id == user_id))
+    ajustar_ventas(PedidoArchivado.user_id == user_id, -1, archivados=True)
+    db.session.execute(delete(PedidoArchivado).where(PedidoArchivado.user_id == user_id))
+    db.session.execute(delete(Usuario).where(Usuario.id == user_id))
+
+def _borrar_producto(product_id):
+    """
+    Borro las líneas de pedido del producto (también las archivadas) y después el producto. No hago commit.
+    Devuelvo los archivos de su imagen, para borrarlos después del commit con borrar_imagenes_sin_uso.
+    """
+    imagen = db.session.execute(select(Producto.imagen, Producto.imagen_variantes).where(Producto.id == product_id)).first()
+    ajustar_ventas(DetallePedido.producto_id == product_id, -1, contar_pedidos=False)
+    db.session.execute(delete(DetallePedido).where(DetallePedido.producto_id == product_id))
+    ajustar_ventas(DetallePedidoArchivado.producto_id == product_id, -1, contar_pedidos=False, archivados=True)
+    db.session.execute(delete(DetallePedidoArchivado).where(DetallePedidoArchivado.producto_id == product_id))
+    db.session.execute(delete(Producto).where(Producto.id == product_id))
+    sincronizar_busqueda([product_id])
+    return archivos_imagen_producto(*imagen) if imagen else set()
+
+def _borrar_usuario_por_lotes(trabajo_id, user_id):
+    # Primero los pedidos calientes y después los archivados, con los mismos lotes.
+    for pedido, detalle in ((Pedido, DetallePedido), (PedidoArchivado, DetallePedidoArchivado)):
+        archivados = pedido is PedidoArchivado
+        while True:
+            ids = db.session.execute(
+                select(pedido.id).where(pedido.user_id == user_id).limit(app.config['BORRADO_LOTE'])
+            ).scalars().all()
+            if not ids:
+                break
+            lineas = db.session.execute(select(func.count(detalle.id)).where(detalle.pedido_id.in_(ids))).scalar()
+            ajustar_ventas(pedido.id.in_(ids), -1, archivados=archivados)
+            if not archivados:
+                registrar_eventos_pedidos('pedido_eliminado', Pedido.id.in_(ids))
+            db.session.execute(delete(pedido).where(pedido.id.in_(ids)))
+            _sumar_progreso(trabajo_id, lineas) # En la misma transacción que el lote.
+            db.session.commit()
+            time.sleep(app.config['BORRADO_PAUSA'])
+    # El último paso vuelve a pasar por _borrar_usuario por si entró algún pedido mientras borraba.
+    _borrar_usuario(user_id)
+    db.session.commit()
+    cache_identidades.invalidar(user_id)
+
+def _borrar_producto_por_lotes(trabajo_id, product_id):
+    for detalle in (DetallePedido, DetallePedidoArchivado):
+        while True:
+            ids = db.session.execute(
+                select(detalle.id).where(detalle.producto_id == product_id).limit(app.config['BORRADO_LOTE'])
+            ).scalars().all()
+            if not ids:
+                break
+            ajustar_ventas(detalle.id.in_(ids), -1, contar_pedidos=False, archivados=detalle is DetallePedidoArchivado)
+            db.session.execute(delete(detalle).where(detalle.id.in_(ids)))
+            _sumar_progreso(trabajo_id, len(ids))
+            db.session.commit()
+            time.sleep(app.config['BORRADO_PAUSA'])
+    imagenes = _borrar_producto(product_id)
+    db.session.commit()
+    invalidar_catalogo()
+    borrar_imagenes_sin_uso(imagenes)
+
+def _sumar_progreso(trabajo_id, cantidad):
+    """Sumo líneas procesadas al trabajo. No hago commit: va con el lote que las borró."""
+    db.session.execute(update(TrabajoBorrado).where(TrabajoBorrado.id == trabajo_id)
+                       .values(procesados=TrabajoBorrado.procesados + cantidad))
+
+def _actualizar_trabajo(trabajo_id, **cambios):
+    db.session.execute(update(TrabajoBorrado).where(TrabajoBorrado.id == trabajo_id).values(**cambios))
+    db.session.commit()
+
+def _ejecutar_trabajo_borrado(trabajo_id, funcion, objeto_id):
+    with app.app_context():
+        _actualizar_trabajo(trabajo_id, estado='en_curso')
+        try:
+            funcion(trabajo_id, objeto_id)
+            _actualizar_trabajo(trabajo_id, estado='terminado', finalizado=datetime.now(UTC))
+            logging.info("Trabajo de borrado %s terminado.", trabajo_id)
+        except Exception as e:
+            db.session.rollback()
+            _actualizar_trabajo(trabajo_id, estado='error', error=str(e), finalizado=datetime.now(UTC))
+            logging.error("Trabajo de borrado %s falló: %s", trabajo_id, e)
+
+def lanzar_trabajo_borrado(tipo, objeto_id, total, funcion):
+    """
+    Registro el trabajo en la base (con commit, así cualquier worker lo puede consultar), lo mando
+    al hilo de borrados y devuelvo su estado inicial. De paso limpio los trabajos terminados viejos.
+    """
+    ahora = datetime.now(UTC)
+    db.session.execute(delete(TrabajoBorrado).where(
+        TrabajoBorrado.finalizado < ahora - app.config['BORRADO_TRABAJOS_RETENCION']))
+    trabajo = TrabajoBorrado(id=uuid.uuid4().hex, tipo=tipo, objeto_id=objeto_id, estado='pendiente',
+                             total=total, procesados=0, creado=ahora)
+    db.session.add(trabajo)
+    db.session.commit()
+    _executor_borrados.submit(_ejecutar_trabajo_borrado, trabajo.id, funcion, objeto_id)
+    logging.info("Borrado de %s ID %s enviado a segundo plano (%s líneas).", tipo, objeto_id, total)
+    return trabajo.to_dict()
+
+def marcar_trabajos_interrumpidos():
+    """
+    Al arrancar el servidor no hay ningún hilo de borrados andando, así que los trabajos que figuran
+    abiertos quedaron cortados (el proceso se reinició). Los marco para que el admin lo vea: lo que se
+    borró, borrado está (cada lote es su propia transacción), y volver a pedir el borrado sigue desde ahí.
+    """
+    resultado = db.session.execute(
+        update(TrabajoBorrado).where(TrabajoBorrado.estado.in_(ESTADOS_TRABAJO_ABIERTOS))
+        .values(estado='interrumpido', error='El servidor se reinició antes de terminar; volvé a pedir el borrado.',
+                finalizado=datetime.now(UTC))
+    )
+    db.session.commit()
+    if resultado.rowcount:
+        logging.warning("%s trabajos de borrado quedaron interrumpidos por un reinicio.", resultado.rowcount)
+
+# API para consultar el progreso de un borrado en segundo plano (solo para admins).
+@app.route('/api/admin/trabajos/<trabajo_id>', methods=['GET'])
+@admin_required
+def delete_job_status(trabajo_id):
+    trabajo = db.session.get(TrabajoBorrado, trabajo_id)
+    if not trabajo:
+        return jsonify({'message': 'Trabajo no encontrado'}), 404
+    return jsonify(trabajo.to_dict()), 200
+
+# --- Archivo de Pedidos (Tablas Frías) ---
+# El día a día solo mira pedidos recientes o sin despachar, pero pedido y detalle_pedido crecían
+# para siempre, y con ellas los índices que recorren los listados, el historial y los borrados.
+# 'flask archive-orders' mueve los pedidos 'Enviado' más viejos que ARCHIVO_PEDIDOS_DIAS (con sus
+# líneas) a pedido_archivado y detalle_pedido_archivado, en la misma base: así cada lote se mueve
+# en una sola transacción (nunca queda un pedido a medias o en las dos tablas). Los agregados de
+# ventas no cambian, porque el pedido sigue existiendo; los listados lo leen con ?archivo=1.
+ESTADO_ARCHIVABLE = 'Enviado'
+
+def primer_id_libre(modelo, archivado):
+    """
+    El id para una fila nueva de 'modelo' (Pedido o DetallePedido), por encima también de los del
+    archivo. Si dejo que SQLite lo elija, usa el máximo que quede en la tabla caliente más uno, y
+    después de borrar el pedido más nuevo ese id puede ser uno que ya está en el archivo.
+    Hay que llamarla con el lock de escritura tomado, así ninguna otra escritura toma el mismo id.
+    """
+    return db.session.execute(select(func.max(
+        func.coalesce(select(func.max(modelo.id)).scalar_subquery(), 0),
+        func.coalesce(select(func.max(archivado.id)).scalar_subquery(), 0)
+    ))).scalar() + 1
+
+def _candidatos_archivo(limite_fecha, desde_clave, lote):
+    """Ids del próximo lote de pedidos archivables, en orden (fecha_pedido, id) a partir de desde_clave."""
+    consulta = (
+        select(Pedido.id, Pedido.fecha_pedido)
+        .where(Pedido.estado == ESTADO_ARCHIVABLE, Pedido.fecha_pedido < limite_fecha)
+        .order_by(Pedido.fecha_pedido, Pedido.id)
+        .limit(lote)
+    )
+    if desde_clave:
+        fecha_desde, id_desde = desde_clave
+        consulta = consulta.where(or_(
+            Pedido.fecha_pedido > fecha_desde,
+            and_(Pedido.fecha_pedido == fecha_desde, Pedido.id > id_desde)
+        ))
+    return db.session.execute(consulta).all()
+
+def _mover_al_archivo(ids):
+    """Copio los pedidos y sus líneas al archivo y los borro de las tablas calientes. No hago commit."""
+    db.session.execute(insert(PedidoArchivado).from_select(
+        ['id', 'fecha_pedido', 'total', 'user_id', 'estado'],
+        select(Pedido.id, Pedido.fecha_pedido, Pedido.total, Pedido.user_id, Pedido.estado)
+        .where(Pedido.id.in_(ids), Pedido.estado == ESTADO_ARCHIVABLE)
+    ))
+    db.session.execute(insert(DetallePedidoArchivado).from_select(
+        ['id', 'cantidad', 'precio_unitario', 'pedido_id', 'producto_id'],
+        select(DetallePedido.id, DetallePedido.cantidad, DetallePedido.precio_unitario,
+               DetallePedido.pedido_id, DetallePedido.producto_id)
+        .join(PedidoArchivado, PedidoArchivado.id == DetallePedido.pedido_id)
+        .where(DetallePedido.pedido_id.in_(ids))
+    ))
+    # Borro solo los que efectivamente copié (si alguno cambió de estado entretanto, se queda donde está).
+    # Las líneas caen por el 'ondelete=CASCADE' de DetallePedido. Antes de borrarlos dejo el evento,
+    # así los paneles de admin abiertos los sacan de la lista (si no, quedan botones que dan 404).
+    copiados = Pedido.id.in_(select(PedidoArchivado.id).where(PedidoArchivado.id.in_(ids)))
+    registrar_eventos_pedidos('pedido_archivado', copiados)
+    db.session.execute(delete(Pedido).where(copiados))
+
+def archivar_pedidos(dias=None, lote=None, pausa=None):
+    """
+    Muevo al archivo los pedidos 'Enviado' con más de 'dias' días, de a lotes (una transacción corta
+    por lote, con una pausa entre lotes para no acaparar el lock de escritura). Devuelvo cuántos moví.
+    """
+    dias = app.config['ARCHIVO_PEDIDOS_DIAS'] if dias is None else dias
+    lote = lote or app.config['ARCHIVO_PEDIDOS_LOTE']
+    pausa = app.config['ARCHIVO_PEDIDOS_PAUSA'] if pausa is None else pausa
+    limite_fecha = datetime.now(UTC) - timedelta(days=dias)
+
+    movidos = 0
+    desde_clave = None
+    while True:
+        candidatos = _candidatos_archivo(limite_fecha, desde_clave, lote)
+        if not candidatos:
+            break
+        _mover_al_archivo([fila.id for fila in candidatos])
+        db.session.commit()
+        movidos += len(candidatos)
+        desde_clave = (candidatos[-1].fecha_pedido, candidatos[-1].id)
+        logging.info("Archivo de pedidos: %s pedidos movidos hasta ahora (último del %s).", movidos, desde_clave[0].date())
+        if len(candidatos) < lote:
+            break
+        time.sleep(pausa)
+    return movidos
+
+# --- Reserva de Stock para los Pedidos ---
+# Antes traía cada producto del carrito con una consulta aparte, chequeaba el stock en
+# Python y después lo restaba. Eso eran N consultas y, peor, dos compras simultáneas
+# podían pasar el chequeo a la vez y vender de más. Ahora traigo todo con un solo IN
+# y descuento con un UPDATE condicional (stock >= cantidad) que la base hace de forma atómica.
+
+class StockInsuficienteError(ValueError):
+    """Se lanza cuando una o más líneas del carrito no tienen stock. Guarda el detalle de todas."""
+    def __init__(self, faltantes):
+        self.faltantes = faltantes
+        detalle = '; '.join(
+            f"'{f['nombre']}' (Disponible: {f['disponible']}, Solicitado: {f['solicitado']})" for f in faltantes
+        )
+        super().__init__(f"Stock insuficiente para: {detalle}.")
+
+def _normalizar_items_carrito(cart_items):
+    """
+    Valido los ítems del carrito y junto las cantidades por producto (por si el mismo
+    producto viene repetido). Devuelvo un dict {producto_id: cantidad} en el orden del carrito.
+    """
+    cantidades = {}
+    for item in cart_items:
+        try:
+            producto_id = int(item['id'])
+            cantidad = int(item['cantidad'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('Cada ítem del carrito debe tener un id y una cantidad numéricos.')
+        if cantidad <= 0:
+            raise ValueError(f"Cantidad inválida ({cantidad}) para el producto con ID {producto_id}.")
+        cantidades[producto_id] = cantidades.get(producto_id, 0) + cantidad
+    return cantidades
+
+def _leer_productos(ids):
+    """Traigo id, nombre, precio y stock de todos los productos pedidos con una sola consulta."""
+    filas = db.session.execute(
+        select(Producto.id, Producto.nombre, Producto.precio, Producto.stock).where(Producto.id.in_(ids))
+    ).all()
+    return {fila.id: fila for fila in filas}
+
+def _faltantes(cantidades, productos):
+    return [
+        {'producto_id': producto_id, 'nombre': productos[producto_id].nombre,
+         'disponible': productos[producto_id].stock, 'solicitado': cantidad}
+        for producto_id, cantidad in cantidades.items()
+        if productos[producto_id].stock < cantidad
+    ]
+
+COTIZACION_MAX_LINEAS = 500
+
+def cotizar_carrito(cantidades):
+    """
+    Armo la cotización de un carrito ({producto_id: cantidad}) con los precios y el stock de este
+    momento, con una sola consulta por clave primaria. El total es el mismo que se cobraría en
+    crear_pedido; 'valido' indica si la compra pasaría tal como está.
+    """
+    productos = _leer_productos(list(cantidades))
+    lineas = []
+    total = 0.0
+    for producto_id, cantidad in cantidades.items():
+        producto = productos.get(producto_id)
+        if producto is None:
+            continue
+        subtotal = producto.precio * cantidad
+        total += subtotal
+        lineas.append({
+            'producto_id': producto_id,
+            'nombre': producto.nombre,
+            'cantidad': cantidad,
+            'precio_unitario': producto.precio,
+            'subtotal': subtotal,
+            'stock': producto.stock,
+            'disponible': producto.stock >= cantidad
+        })
+    no_encontrados = [producto_id for producto_id in cantidades if producto_id not in productos]
+    encontrados = {producto_id: cantidad for producto_id, cantidad in cantidades.items() if producto_id in productos}
+    faltantes = _faltantes(encontrados, productos)
+    return {
+        'items': lineas,
+        'total': total,
+        'faltantes': faltantes,
+        'no_encontrados': no_encontrados,
+        'valido': not faltantes and not no_encontrados,
+        'version_catalogo': obtener_version_catalogo()
+    }
+
+def reservar_stock(cantidades):
+    """
+    Descuento el stock de todas las líneas del carrito dentro de la transacción actual.
+    Devuelvo las filas de los productos (con el precio vigente) para armar los detalles.
+    Si falta algún producto lanzo ValueError; si falta stock, StockInsuficienteError con todas las líneas cortas.
+    """
+    productos = _leer_productos(list(cantidades))
+    no_encontrados = [producto_id for producto_id in cantidades if producto_id not in productos]
+    if no_encontrados:
+        raise ValueError(f"Productos no encontrados en la base de datos: {', '.join(map(str, no_encontrados))}.")
+
+    faltantes = _faltantes(cantidades, productos)
+    if faltantes:
+        raise StockInsuficienteError(faltantes)
+
+    # Un solo UPDATE para todas las líneas. El WHERE vuelve a chequear el stock dentro
+    # del lock de escritura, así que si otra compra se llevó unidades en el medio, esa fila no se toca.
+    cantidad_por_id = case(cantidades, value=Producto.id)
+    resultado = db.session.execute(
+        update(Producto)
+        .where(Producto.id.in_(list(cantidades)), Producto.stock >= cantidad_por_id)
+        .values(stock=Producto.stock - cantidad_por_id)
+        .execution_options(synchronize_session=False)
+    )
+    if resultado.rowcount != len(cantidades):
+        # Otra compra ganó la carrera. Deshago lo que se haya descontado y vuelvo a leer para informar.
+        db.session.rollback()
+        faltantes = _faltantes(cantidades, _leer_productos(list(cantidades)))
+        if faltantes:
+            raise StockInsuficienteError(faltantes)
+        raise ValueError('El stock cambió mientras se procesaba el pedido. Intentá de nuevo.')
+    return productos
+
+# --- Claves de Idempotencia para los Pedidos ---
+# Si carrito.js reintenta una compra (por ejemplo, porque la primera tardó y el usuario volvió a
+# hacer clic), manda el mismo header Idempotency-Key. La clave se registra como la primera
+# escritura de la transacción del pedido y la respuesta se guarda en esa misma transacción, así que:
+#  - un reintento posterior encuentra la clave y recibe la respuesta guardada, sin tocar stock ni pedidos;
+#  - un duplicado concurrente espera el lock de escritura de SQLite detrás del original, no puede
+#    insertar la clave (ya existe) y devuelve la misma respuesta, en vez de crear otro pedido.
+# Si la compra falla (sin stock, datos inválidos), el rollback se lleva la clave y se puede reintentar.
+IDEMPOTENCIA_LARGO_MAXIMO = 100
+
+def _huella_pedido(cantidades, total):
+    """Hash del contenido del pedido, para detectar una clave reusada con otro carrito."""
+    contenido = json.dumps({'items': sorted(cantidades.items()), 'total': total}, separators=(',', ':'))
+    return hashlib.sha256(contenido.encode()).hexdigest()
+
+def _respuesta_idempotente(user_id, clave, huella):
+    """Si la clave ya tiene una respuesta guardada, la devuelvo (o un 422 si era de otro carrito). Si no, None."""
+    fila = db.session.execute(
+        select(ClaveIdempotencia.huella, ClaveIdempotencia.codigo, ClaveIdempotencia.respuesta)
+        .where(ClaveIdempotencia.user_id == user_id, ClaveIdempotencia.clave == clave,
+               ClaveIdempotencia.creada >= datetime.now(UTC) - app.config['IDEMPOTENCIA_TTL'])
+    ).first()
+    if fila is None:
+        return None
+    if fila.huella != huella:
+        return jsonify({'message': 'Esta clave de idempotencia ya se usó con otro pedido.'}), 422
+    respuesta = Response(fila.respuesta, status=fila.codigo, mimetype='application/json')
+    respuesta.headers['Idempotent-Replayed'] = 'true'
+    return respuesta
+
+def reclamar_clave_idempotencia(user_id, clave, huella):
+    """
+    Registro la clave en la transacción actual. Devuelvo False si ya existía (otra request con la
+    misma clave se confirmó antes). También descarto las claves vencidas y, cada tanto, las que
+    superen el máximo. No hago commit.
+    """
+    ahora = datetime.now(UTC)
+    # Si esta misma clave estaba vencida, se va con las demás y se puede volver a usar.
+    db.session.execute(delete(ClaveIdempotencia).where(ClaveIdempotencia.creada < ahora - app.config['IDEMPOTENCIA_TTL']))
+    resultado = db.session.execute(
+        sqlite_insert(ClaveIdempotencia)
+        .values(user_id=user_id, clave=clave, huella=huella, creada=ahora)
+        .on_conflict_do_nothing()
+    )
+    if random.random() < 0.01:
+        sobrantes = db.session.execute(select(func.count()).select_from(ClaveIdempotencia)).scalar() - app.config['IDEMPOTENCIA_MAX_CLAVES']
+        if sobrantes > 0:
+            mas_viejas = select(ClaveIdempotencia.user_id, ClaveIdempotencia.clave).order_by(ClaveIdempotencia.creada).limit(sobrantes)
+            db.session.execute(delete(ClaveIdempotencia).where(
+                tuple_(ClaveIdempotencia.user_id, ClaveIdempotencia.clave).in_(mas_viejas)
+            ))
+    return resultado.rowcount == 1
+
+def completar_clave_idempotencia(user_id, clave, codigo, cuerpo):
+    """Guardo la respuesta de la compra junto con la clave, en la misma transacción del pedido."""
+    db.session.execute(
+        update(ClaveIdempotencia)
+        .where(ClaveIdempotencia.user_id == user_id, ClaveIdempotencia.clave == clave)
+        .values(codigo=codigo, respuesta=json.dumps(cuerpo, ensure_ascii=False))
+    )
+
 # API para crear un nuevo pedido.
 @app.route('/api/pedidos', methods=['POST'])
 @login_required
+@admision('pedidos')
+@escritura
 def crear_pedido():
     data = request.get_json()
     cart_items = data.get('items')
     total_pedido = data.get('total')
 
-    logging.debug(f"crear_pedido: Recibiendo solicitud para usuario ID: {current_user.id}")
-    logging.debug(f"crear_pedido: Items del carrito: {cart_items}")
-    logging.debug(f"crear_pedido: Total del pedido: {total_pedido}")
+    logging.debug("crear_pedido: Recibiendo solicitud para usuario ID: %s", current_user.id)
+    logging.debug("crear_pedido: Items del carrito: %s", cart_items)
+    logging.debug("crear_pedido: Total del pedido: %s", total_pedido)
 
     if not cart_items or not isinstance(cart_items, list) or not total_pedido:
         logging.warning("crear_pedido: Datos del carrito inválidos o faltantes")
         return jsonify({'message': 'Datos del carrito inválidos o faltantes'}), 400
 
-    if not cart_items:
-        logging.warning("crear_pedido: El carrito está vacío, no se puede crear un pedido")
-        return jsonify({'message': 'El carrito está vacío, no se puede crear un pedido'}), 400
+    # Clave de idempotencia opcional (header Idempotency-Key), para que un reintento no cree otro pedido.
+    clave_idempotencia = request.headers.get('Idempotency-Key')
+    if clave_idempotencia is not None and not 0 < len(clave_idempotencia) <= IDEMPOTENCIA_LARGO_MAXIMO:
+        return jsonify({'message': f'La clave de idempotencia debe tener entre 1 y {IDEMPOTENCIA_LARGO_MAXIMO} caracteres'}), 400
 
     try:
-        productos_a_actualizar = []
-        for item in cart_items:
-            producto = db.session.get(Producto, item['id'])
-            if not producto:
-                logging.error(f"crear_pedido: Producto con ID {item['id']} no encontrado.")
-                raise ValueError(f"Producto con ID {item['id']} no encontrado en la base de datos para la creación del detalle del pedido.")
-
-            requested_quantity = int(item['cantidad'])
-            if requested_quantity <= 0:
-                logging.warning(f"crear_pedido: Cantidad inválida ({requested_quantity}) para el producto {producto.nombre}.")
-                raise ValueError(f"Cantidad inválida ({requested_quantity}) para el producto {producto.nombre}.")
-
-            if producto.stock < requested_quantity:
-                logging.warning(f"crear_pedido: Stock insuficiente para '{producto.nombre}'. Disponible: {producto.stock}, Solicitado: {requested_quantity}.")
-                return jsonify({'message': f"Stock insuficiente para '{producto.nombre}'. Disponible: {producto.stock}, Solicitado: {requested_quantity}."}), 400
-
-            productos_a_actualizar.append({'producto': producto, 'cantidad': requested_quantity})
-
-        nuevo_pedido = Pedido(user_id=current_user.id, total=total_pedido, fecha_pedido=datetime.now(UTC))
+        cantidades = _normalizar_items_carrito(cart_items)
+        if clave_idempotencia:
+            huella = _huella_pedido(cantidades, total_pedido)
+            repetida = _respuesta_idempotente(current_user.id, clave_idempotencia, huella)
+            if repetida is not None:
+                logging.info("crear_pedido: reintento con clave ya usada, devuelvo la respuesta guardada.")
+                return repetida
+            if not reclamar_clave_idempotencia(current_user.id, clave_idempotencia, huella):
+                # Otra request con la misma clave se confirmó mientras esperaba el lock: devuelvo su respuesta.
+                db.session.rollback()
+                repetida = _respuesta_idempotente(current_user.id, clave_idempotencia, huella)
+                if repetida is not None:
+                    return repetida
+                respuesta = jsonify({'message': 'Ya hay una compra en curso con esta clave, intentá de nuevo en unos segundos.'})
+                respuesta.headers['Retry-After'] = '1'
+                return respuesta, 409
+        productos = reservar_stock(cantidades)
+
+        # Los ids los elijo yo, por encima de los archivados (ver primer_id_libre). reservar_stock ya
+        # escribió, así que tengo el lock de escritura y nadie más puede tomar estos mismos ids.
+        nuevo_pedido = Pedido(id=primer_id_libre(Pedido, PedidoArchivado), user_id=current_user.id,
+                              total=total_pedido, fecha_pedido=datetime.now(UTC))
         db.session.add(nuevo_pedido)
         db.session.flush()
 
-        for entry in productos_a_actualizar:
-            producto = entry['producto']
-            cantidad = entry['cantidad']
-
-            producto.stock -= cantidad 
-            db.session.add(producto)
-
-            detalle = DetallePedido(
-                pedido_id=nuevo_pedido.id,
-                producto_id=producto.id,
-                cantidad=cantidad,
-                precio_unitario=producto.precio
-            )
-            db.session.add(detalle)
+        # Inserto todos los detalles del pedido con un solo INSERT de varias filas.
+        primera_linea = primer_id_libre(DetallePedido, DetallePedidoArchivado)
+        db.session.execute(insert(DetallePedido), [
+            {
+                'id': primera_linea + orden,
+                'pedido_id': nuevo_pedido.id,
+                'producto_id': producto_id,
+                'cantidad': cantidad,
+                'precio_unitario': productos[producto_id].precio
+            }
+            for orden, (producto_id, cantidad) in enumerate(cantidades.items())
+        ])
+        ajustar_ventas(Pedido.id == nuevo_pedido.id, 1)
+        registrar_eventos_pedidos('pedido_nuevo', Pedido.id == nuevo_pedido.id)
+        cuerpo = {'message': 'Pedido realizado con éxito!', 'pedido_id': nuevo_pedido.id}
+        if clave_idempotencia:
+            completar_clave_idempotencia(current_user.id, clave_idempotencia, 201, cuerpo)
 
         db.session.commit()
-        logging.info(f"Pedido {nuevo_pedido.id} creado con éxito para usuario {current_user.id}.")
-        return jsonify({'message': 'Pedido realizado con éxito!', 'pedido_id': nuevo_pedido.id}), 201
+        # El catálogo muestra el stock, así que después de una compra también cambia.
+        invalidar_catalogo()
+        logging.info("Pedido %s creado con éxito para usuario %s.", nuevo_pedido.id, current_user.id)
+        return jsonify(cuerpo), 201
 
+    except StockInsuficienteError as se:
+        db.session.rollback()
+        logging.warning("crear_pedido: %s", se)
+        return jsonify({'message': str(se), 'faltantes': se.faltantes}), 400
     except ValueError as ve:
         db.session.rollback()
-        logging.error(f"crear_pedido: ValueError: {str(ve)}")
+        logging.error("crear_pedido: ValueError: %s", ve)
         return jsonify({'message': str(ve)}), 400
     except Exception as e:
         db.session.rollback()
-        logging.critical(f"crear_pedido: Error inesperado al procesar pedido: {str(e)}", exc_info=True)
+        logging.critical("crear_pedido: Error inesperado al procesar pedido: %s", e, exc_info=True)
         return jsonify({'message': f'Error al procesar el pedido: {str(e)}'}), 500
 
-# API para obtener todos los pedidos (solo para admins).
+# API para cotizar el carrito: recibe {items: [{id, cantidad}]} y devuelve, por línea, el precio
+# y el stock actuales, más el total calculado por el servidor. No hace falta estar logueado.
+# Como precio y stock solo cambian con la versión del catálogo (que sube con cada compra o cambio
+# de un admin), el mismo carrito se cotiza desde la caché hasta que la versión cambie.
+@app.route('/api/carrito/cotizar', methods=['POST'])
+def cotizar_carrito_api():
+    data = request.get_json(silent=True) or {}
+    cart_items = data.get('items')
+    if not isinstance(cart_items, list):
+        return jsonify({'message': 'Datos del carrito inválidos o faltantes'}), 400
+    if len(cart_items) > COTIZACION_MAX_LINEAS:
+        return jsonify({'message': f'El carrito no puede tener más de {COTIZACION_MAX_LINEAS} líneas'}), 400
+    try:
+        cantidades = _normalizar_items_carrito(cart_items)
+    except ValueError as ve:
+        return jsonify({'message': str(ve)}), 400
+
+    # Ordeno por id para que el mismo carrito (en cualquier orden) comparta la entrada de la caché.
+    cantidades = dict(sorted(cantidades.items()))
+    clave = json.dumps(list(cantidades.items()), separators=(',', ':'))
+    cuerpo, _ = _catalogo_cacheado(clave, lambda: jsonify(cotizar_carrito(cantidades)).get_data(), _cotizaciones_cache)
+    return Response(cuerpo, mimetype='application/json')
+
+# --- Paginación por cursor (keyset) para el listado de pedidos del admin ---
+# En vez de traer todos los pedidos de una, los pido de a páginas ordenadas por
+# (fecha_pedido, id) descendente. El cursor es la última clave que vio el cliente,
+# así la consulta siguiente arranca justo ahí sin usar OFFSET (que se pone lento con muchas filas).
+ADMIN_PEDIDOS_LIMITE_DEFAULT = 50
+ADMIN_PEDIDOS_LIMITE_MAXIMO = 500
+ADMIN_PEDIDOS_CHUNK_STREAM = 500
+
+def _codificar_cursor(fecha_pedido, pedido_id):
+    """Armo un cursor opaco (base64) con la clave del último pedido enviado."""
+    crudo = f"{fecha_pedido.isoformat()}|{pedido_id}"
+    return base64.urlsafe_b64encode(crudo.encode()).decode()
+
+def _decodificar_cursor(cursor):
+    """Hago el camino inverso. Si el cursor está roto, lanzo ValueError."""
+    try:
+        fecha_str, id_str = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(fecha_str), int(id_str)
+    except Exception:
+        raise ValueError('Cursor inválido')
+
+def _parsear_fecha_filtro(valor):
+    """Acepto fechas ISO ('2025-06-01' o '2025-06-01T10:00:00'). Si viene vacía, devuelvo None."""
+    if not valor:
+        return None
+    try:
+        return datetime.fromisoformat(valor)
+    except ValueError:
+        raise ValueError(f'Fecha inválida: {valor}')
+
+def _filtros_pedidos_admin(args):
+    """Leo los filtros del query string (estado, desde, hasta, user_id) y los valido."""
+    user_id = args.get('user_id')
+    if user_id is not None:
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            raise ValueError('user_id debe ser un número')
+    return {
+        'estado': args.get('estado') or None,
+        'desde': _parsear_fecha_filtro(args.get('desde')),
+        'hasta': _parsear_fecha_filtro(args.get('hasta')),
+        'user_id': user_id,
+        'archivo': incluir_archivo_pedidos(args),
+    }
+
+def _consulta_pedidos_admin(filtros, cursor_clave=None, limite=ADMIN_PEDIDOS_LIMITE_DEFAULT):
+    """
+    Armo la consulta de una página de pedidos aplicando los filtros y el cursor.
+    Devuelvo filas con las columnas de COLUMNAS_PEDIDO_ADMIN (el comprador viene por JOIN);
+    los ítems los agrega pedidos_admin_a_dicts con una sola consulta más por página.
+    Con el filtro 'archivo' también leo los pedidos archivados (ver leer_pedidos_con_archivo).
+    """
+    def construir_consulta(modelo):
+        consulta = select(*_columnas_pedido(modelo), Usuario.nombre, Usuario.email).outerjoin(Usuario, Usuario.id == modelo.user_id)
+        if filtros['estado']:
+            consulta = consulta.where(modelo.estado == filtros['estado'])
+        if filtros['user_id'] is not None:
+            consulta = consulta.where(modelo.user_id == filtros['user_id'])
+        if filtros['desde']:
+            consulta = consulta.where(modelo.fecha_pedido >= filtros['desde'])
+        if filtros['hasta']:
+            consulta = consulta.where(modelo.fecha_pedido <= filtros['hasta'])
+        if cursor_clave:
+            consulta = consulta.where(_condicion_cursor(modelo, cursor_clave))
+        return consulta.order_by(modelo.fecha_pedido.desc(), modelo.id.desc())
+
+    return leer_pedidos_con_archivo(construir_consulta, limite, filtros['archivo'])
+
+# API para obtener los pedidos paginados (solo para admins).
+# Parámetros opcionales: limit, cursor, estado, desde, hasta, user_id, archivo (1 para incluir los archivados).
 @app.route('/api/admin/pedidos', methods=['GET'])
 @admin_required
 def get_all_orders():
-    all_orders = Pedido.query.options(
-        selectinload(Pedido.items).selectinload(DetallePedido.producto_del_detalle),
-        selectinload(Pedido.comprador)
-    ).order_by(Pedido.fecha_pedido.desc()).all()
+    try:
+        filtros = _filtros_pedidos_admin(request.args)
+        cursor = request.args.get('cursor')
+        cursor_clave = _decodificar_cursor(cursor) if cursor else None
+        limite = int(request.args.get('limit', ADMIN_PEDIDOS_LIMITE_DEFAULT))
+    except ValueError as ve:
+        return jsonify({'message': str(ve)}), 400
 
-    orders_list = []
-    for order in all_orders:
-        order_dict = order.to_dict()
-        order_dict['comprador_nombre'] = order.comprador.nombre if order.comprador else 'Usuario Desconocido'
-        order_dict['comprador_email'] = order.comprador.email if order.comprador else 'Email Desconocido'
-        orders_list.append(order_dict)
+    limite = max(1, min(limite, ADMIN_PEDIDOS_LIMITE_MAXIMO))
+    # Leo el último evento antes que la página: el panel se suscribe al feed desde acá y no se pierde
+    # nada de lo que pase entre esta consulta y la conexión al feed.
+    ultimo_evento = ultimo_evento_pedidos()
+    # Pido una fila de más para saber si hay otra página sin tener que contar.
+    pedidos_pagina = _consulta_pedidos_admin(filtros, cursor_clave, limite + 1)
+    hay_mas = len(pedidos_pagina) > limite
+    pedidos_pagina = pedidos_pagina[:limite]
+
+    orders_list = pedidos_admin_a_dicts(pedidos_pagina)
+    next_cursor = None
+    if hay_mas:
+        ultimo = pedidos_pagina[-1]
+        next_cursor = _codificar_cursor(ultimo.fecha_pedido, ultimo.id)
+
+    logging.debug("Enviando %s pedidos al admin.", len(orders_list))
+    return jsonify({'pedidos': orders_list, 'next_cursor': next_cursor, 'ultimo_evento': ultimo_evento}), 200
+
+# API para exportar los pedidos como NDJSON (un pedido por línea), en streaming.
+# Recorro la tabla de a chunks con el mismo cursor, así la memoria no crece con el historial.
+@app.route('/api/admin/pedidos/stream', methods=['GET'])
+@admin_required
+def stream_all_orders():
+    try:
+        filtros = _filtros_pedidos_admin(request.args)
+    except ValueError as ve:
+        return jsonify({'message': str(ve)}), 400
 
-    logging.debug(f"Enviando {len(orders_list)} pedidos al admin.")
-    return jsonify(orders_list), 200
+    def generar():
+        cursor_clave = None
+        while True:
+            chunk = _consulta_pedidos_admin(filtros, cursor_clave, ADMIN_PEDIDOS_CHUNK_STREAM)
+            if not chunk:
+                break
+            lineas = [json.dumps(pedido, ensure_ascii=False) for pedido in pedidos_admin_a_dicts(chunk)]
+            yield '\n'.join(lineas) + '\n'
+            cursor_clave = (chunk[-1].fecha_pedido, chunk[-1].id)
+            if len(chunk) < ADMIN_PEDIDOS_CHUNK_STREAM:
+                break
+
+    return Response(stream_with_context(generar()), mimetype='application/x-ndjson')
 
 # API para actualizar el estado de un pedido (solo para admins).
 @app.route('/api/admin/pedidos/<int:pedido_id>/estado', methods=['PUT'])
 @admin_required
+@escritura
 def update_order_status(pedido_id):
     pedido = Pedido.query.get(pedido_id)
     if not pedido:
@@ -585,33 +3279,130 @@ def update_order_status(pedido_id):
     if not new_status or new_status not in allowed_statuses:
         return jsonify({'message': 'Estado inválido'}), 400
 
-    pedido.estado = new_status
     try:
+        if pedido.estado != new_status:
+            # Muevo el aporte del pedido del estado viejo al nuevo en los agregados de ventas.
+            ajustar_ventas(Pedido.id == pedido.id, -1)
+            pedido.estado = new_status
+            db.session.flush()
+            ajustar_ventas(Pedido.id == pedido.id, 1)
+            registrar_eventos_pedidos('pedido_estado', Pedido.id == pedido.id)
         db.session.commit()
         return jsonify({'message': f'Estado del pedido #{pedido.id} actualizado a "{new_status}"'}), 200
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error al actualizar estado del pedido: {str(e)}")
+        logging.error("Error al actualizar estado del pedido: %s", e)
         return jsonify({'message': 'Error interno del servidor'}), 500
 
 # API para ELIMINAR UN PEDIDO (solo para admins).
 @app.route('/api/admin/pedidos/<int:pedido_id>', methods=['DELETE'])
 @admin_required
+@escritura
 def delete_order(pedido_id):
     pedido = Pedido.query.get(pedido_id)
     if not pedido:
         return jsonify({'message': 'Pedido no encontrado'}), 404
 
     try:
+        ajustar_ventas(Pedido.id == pedido.id, -1)
+        registrar_eventos_pedidos('pedido_eliminado', Pedido.id == pedido.id)
         db.session.delete(pedido)
         db.session.commit()
         return jsonify({'message': f'Pedido #{pedido.id} eliminado exitosamente'}), 200
     except Exception as e:
         db.session.rollback()
-        logging.error(f"Error al eliminar el pedido: {str(e)}")
+        logging.error("Error al eliminar el pedido: %s", e)
         return jsonify({'message': 'Error interno del servidor'}), 500
 
+# API de estadísticas de ventas (solo para admins). Se responde solo con los agregados diarios.
+# Parámetros: desde y hasta (fechas ISO, por defecto los últimos 30 días), estado (opcional)
+# y limite (cuántos productos devolver en el ranking, por defecto 20).
+@app.route('/api/admin/analytics', methods=['GET'])
+@admin_required
+def sales_analytics():
+    try:
+        hasta = date.fromisoformat(request.args['hasta']) if request.args.get('hasta') else datetime.now(UTC).date()
+        desde = date.fromisoformat(request.args['desde']) if request.args.get('desde') else hasta - timedelta(days=29)
+        limite = int(request.args.get('limite', 20))
+    except ValueError:
+        return jsonify({'message': 'Parámetros inválidos: las fechas van en formato AAAA-MM-DD y el límite es un número'}), 400
+    if desde > hasta:
+        return jsonify({'message': 'La fecha "desde" no puede ser posterior a "hasta"'}), 400
+    estado = request.args.get('estado')
+    dias = (hasta - desde).days + 1
+
+    filtro_estado = [VentaDiariaEstado.fecha.between(desde, hasta)]
+    filtro_producto = [VentaDiariaProducto.fecha.between(desde, hasta)]
+    if estado:
+        filtro_estado.append(VentaDiariaEstado.estado == estado)
+        filtro_producto.append(VentaDiariaProducto.estado == estado)
+
+    por_estado = db.session.execute(
+        select(VentaDiariaEstado.estado, func.sum(VentaDiariaEstado.pedidos), func.sum(VentaDiariaEstado.ingresos))
+        .where(*filtro_estado).group_by(VentaDiariaEstado.estado)
+    ).all()
+    por_dia = db.session.execute(
+        select(VentaDiariaEstado.fecha, func.sum(VentaDiariaEstado.pedidos), func.sum(VentaDiariaEstado.ingresos))
+        .where(*filtro_estado).group_by(VentaDiariaEstado.fecha).order_by(VentaDiariaEstado.fecha)
+    ).all()
+    unidades = func.sum(VentaDiariaProducto.unidades).label('unidades')
+    por_producto = db.session.execute(
+        select(VentaDiariaProducto.producto_id, Producto.nombre, Producto.stock, unidades,
+               func.sum(VentaDiariaProducto.ingresos))
+        .outerjoin(Producto, Producto.id == VentaDiariaProducto.producto_id)
+        .where(*filtro_producto)
+        .group_by(VentaDiariaProducto.producto_id)
+        .order_by(unidades.desc())
+        .limit(limite)
+    ).all()
+
+    productos_list = []
+    for producto_id, nombre, stock, unidades_vendidas, ingresos in por_producto:
+        velocidad = unidades_vendidas / dias
+        productos_list.append({
+            'producto_id': producto_id,
+            'nombre': nombre or 'Producto Desconocido',
+            'unidades': unidades_vendidas,
+            'ingresos': ingresos,
+            'stock': stock,
+            'velocidad_diaria': round(velocidad, 3),
+            # Cuántos días alcanza el stock actual al ritmo de venta del período.
+            'dias_de_stock': round(stock / velocidad, 1) if stock is not None and velocidad > 0 else None
+        })
+
+    return jsonify({
+        'desde': desde.isoformat(),
+        'hasta': hasta.isoformat(),
+        'totales': {
+            'pedidos': sum(fila[1] for fila in por_estado),
+            'ingresos': sum(fila[2] for fila in por_estado),
+            'unidades': db.session.execute(select(func.coalesce(func.sum(VentaDiariaProducto.unidades), 0))
+                                           .where(*filtro_producto)).scalar()
+        },
+        'por_estado': [{'estado': e, 'pedidos': p, 'ingresos': i} for e, p, i in por_estado],
+        'por_dia': [{'fecha': f.isoformat(), 'pedidos': p, 'ingresos': i} for f, p, i in por_dia],
+        'productos': productos_list
+    }), 200
+
 # --- 8. Comandos CLI para Inicializar la Base de Datos ---
+def actualizar_esquema():
+    """
+    db.create_all() crea las tablas que faltan pero no agrega columnas nuevas a tablas
+    que ya existen. Acá agrego las columnas (opcionales) que se sumaron después, para
+    que una base vieja siga andando con solo volver a correr 'flask init-db'.
+    """
+    with db.engine.begin() as conexion:
+        inspector = db.inspect(conexion) # Sobre la misma conexión: el motor de escritura tiene una sola.
+        for tabla in db.metadata.sorted_tables:
+            if not inspector.has_table(tabla.name):
+                continue
+            existentes = {columna['name'] for columna in inspector.get_columns(tabla.name)}
+            for columna in tabla.columns:
+                if columna.name not in existentes and columna.nullable:
+                    tipo = columna.type.compile(dialect=db.engine.dialect)
+                    conexion.exec_driver_sql(f'ALTER TABLE "{tabla.name}" ADD COLUMN "{columna.name}" {tipo}')
+                    logging.info("Columna '%s.%s' agregada.", tabla.name, columna.name)
+
 def init_db_command_function():
     """
     Este comando me sirve para crear todas las tablas de la base de datos
@@ -620,6 +3411,7 @@ def init_db_command_function():
     """
     with app.app_context():
         db.create_all()
+        actualizar_esquema()
         logging.info("Base de datos y tablas creadas (o ya existentes).")
 
         if not Producto.query.first():
@@ -637,15 +3429,18 @@ def init_db_command_function():
         else:
             logging.info("Productos ya existen en la base de datos.")
 
+        # Creo el índice de búsqueda (si está vacío, lo lleno con los productos que haya).
+        crear_indice_busqueda()
+
         admin_email = 'admin@frutales.com'
         if not Usuario.query.filter_by(email=admin_email).first():
             admin_user = Usuario(nombre='Admin Frutales', email=admin_email, rol='admin')
             admin_user.set_password('admin123')
             db.session.add(admin_user)
             db.session.commit()
-            logging.info(f"Usuario administrador '{admin_email}' creado con contraseña 'admin123'.")
+            logging.info("Usuario administrador '%s' creado con contraseña 'admin123'.", admin_email)
         else:
-            logging.info(f"Usuario administrador '{admin_email}' ya existe.")
+            logging.info("Usuario administrador '%s' ya existe.", admin_email)
 
         client_email = 'cliente@frutales.com'
         if not Usuario.query.filter_by(email=client_email).first():
@@ -653,14 +3448,227 @@ def init_db_command_function():
             client_user.set_password('cliente123')
             db.session.add(client_user)
             db.session.commit()
-            logging.info(f"Usuario cliente '{client_email}' creado con contraseña 'cliente123'.")
+            logging.info("Usuario cliente '%s' creado con contraseña 'cliente123'.", client_email)
         else:
-            logging.info(f"Usuario cliente '{client_email}' ya existe.")
+            logging.info("Usuario cliente '%s' ya existe.", client_email)
 
 app.cli.add_command(app.cli.command("init-db")(init_db_command_function))
 
+def optimize_db_command_function():
+    """
+    Este comando es para bases que ya existían antes de agregar los índices: como
+    db.create_all() no toca tablas existentes, acá creo los índices que falten,
+    paso la base a modo WAL y actualizo las estadísticas del planificador de consultas.
+    """
+    with app.app_context():
+        with db.engine.begin() as conexion:
+            for tabla in db.metadata.sorted_tables:
+                for indice in tabla.indexes:
+                    indice.create(conexion, checkfirst=True)
+                    logging.info("Índice '%s' verificado en la tabla '%s'.", indice.name, tabla.name)
+        with db.engine.connect() as conexion:
+            modo = conexion.exec_driver_sql("PRAGMA journal_mode;").scalar()
+            conexion.exec_driver_sql("ANALYZE;")
+            conexion.exec_driver_sql("PRAGMA optimize;")
+        logging.info("Base de datos optimizada (journal_mode=%s).", modo)
+
+app.cli.add_command(app.cli.command("optimize-db")(optimize_db_command_function))
+
+def process_images_command_function():
+    """Genero las variantes de imagen de los productos que todavía no las tienen (por ejemplo, los de ejemplo)."""
+    with app.app_context():
+        pendientes = db.session.execute(
+            select(Producto.id, Producto.imagen).where(Producto.imagen_variantes.is_(None), Producto.imagen.isnot(None))
+        ).all()
+        # Cada producto se procesa con su propia sesión: libero la conexión de escritura (es una sola).
+        db.session.close()
+        for producto_id, imagen in pendientes:
+            if imagen.startswith('http'):
+                continue
+            _procesar_imagen_producto(producto_id, imagen)
+        logging.info("Imágenes procesadas: %s productos.", len(pendientes))
+
+app.cli.add_command(app.cli.command("process-images")(process_images_command_function))
+
+def rebuild_sales_command_function():
+    """Recalculo desde cero los agregados de ventas a partir de los pedidos."""
+    with app.app_context():
+        reconstruir_ventas()
+        logging.info("Agregados de ventas reconstruidos.")
+
+app.cli.add_command(app.cli.command("rebuild-sales")(rebuild_sales_command_function))
+
+def rebuild_search_command_function():
+    """Regenero desde cero el índice de búsqueda de productos."""
+    with app.app_context():
+        crear_indice_busqueda(reconstruir=True)
+        logging.info("Índice de búsqueda de productos reconstruido.")
+
+app.cli.add_command(app.cli.command("rebuild-search")(rebuild_search_command_function))
+
+@click.argument('archivo', type=click.Path(exists=True, dir_okay=False))
+@click.option('--formato', type=click.Choice(['csv', 'ndjson', 'json']), help='Si no lo indico, lo deduzco de la extensión.')
+def import_products_command_function(archivo, formato):
+    """Importo productos desde un CSV/NDJSON/JSON (alta o actualización por id o nombre)."""
+    formato = formato or os.path.splitext(archivo)[1].lstrip('.').lower()
+    with app.app_context(), open(archivo, 'rb') as entrada:
+        reporte = importar_productos(_filas_productos(entrada, formato))
+    click.echo(f"Procesadas: {reporte['procesadas']}, creados: {reporte['creados']}, "
+               f"actualizados: {reporte['actualizados']}, errores: {len(reporte['errores'])}")
+    for error in reporte['errores']:
+        click.echo(f"  Fila {error['fila']}: {error['error']}", err=True)
+
+app.cli.add_command(app.cli.command("import-products")(import_products_command_function))
+
+@click.option('--formato', type=click.Choice(['csv', 'ndjson']), default='csv')
+@click.option('--salida', type=click.Path(dir_okay=False), help='Archivo de salida (si no, va a la consola).')
+def export_products_command_function(formato, salida):
+    """Exporto el catálogo completo en CSV o NDJSON."""
+    with app.app_context():
+        destino = open(salida, 'w', encoding='utf-8', newline='') if salida else sys.stdout
+        try:
+            for bloque in exportar_productos(formato):
+                destino.write(bloque)
+        finally:
+            if salida:
+                destino.close()
+
+app.cli.add_command(app.cli.command("export-products")(export_products_command_function))
+
+@click.option('--limpiar', is_flag=True, help='Borra las versiones anteriores que ya no están en el manifest.')
+def build_assets_command_function(limpiar):
+    """Versiono y precomprimo los archivos estáticos (css, js e imágenes) en static/dist."""
+    with app.app_context():
+        resumen = construir_estaticos(limpiar=limpiar)
+    click.echo(f"Archivos: {resumen['archivos']} ({resumen['bytes']} bytes), gzip: {resumen['bytes_gzip']} bytes, "
+               f"brotli: {resumen['bytes_brotli'] if resumen['brotli'] else 'no instalado'}")
+
+app.cli.add_command(app.cli.command("build-assets")(build_assets_command_function))
+
+@click.option('--dias', type=int, default=None, help='Antigüedad mínima en días (por defecto, ARCHIVO_PEDIDOS_DIAS).')
+@click.option('--lote', type=int, default=None, help='Pedidos por transacción (por defecto, ARCHIVO_PEDIDOS_LOTE).')
+def archive_orders_command_function(dias, lote):
+    """Mueve los pedidos 'Enviado' viejos a las tablas del archivo, de a lotes."""
+    with app.app_context():
+        movidos = archivar_pedidos(dias, lote)
+    click.echo(f"Pedidos archivados: {movidos}")
+
+app.cli.add_command(app.cli.command("archive-orders")(archive_orders_command_function))
+
+# --- Modo Producción: Inicialización, Workers y Salud ---
+# En producción la app corre en gunicorn (ver gunicorn.conf.py) con varios procesos worker.
+# gunicorn importa este módulo (con APP_PERFIL=produccion) y llama a preparar_app() una sola vez en
+# el proceso maestro (preload_app), así la inicialización pesada (imports, templates compilados,
+# chequeos de la base) se hace antes del fork y los workers arrancan ya listos, compartiendo esa memoria.
+#
+# Ojo: esto NO es una fábrica de aplicaciones (create_app con db.init_app / login_manager.init_app).
+# app, db, login_manager, las rutas (@app.route) y los motores de la base siguen armándose al importar
+# el módulo, y hay una sola app por proceso. Pasarlo a una fábrica implica mover todas las rutas a un
+# Blueprint (y renombrar los endpoints de cada url_for) y cambiar cada app.config de los helpers y
+# los hilos de fondo por current_app; lo dejé así para no partir app.py. Lo que sí hay:
+#  - los perfiles (PERFILES_CONFIGURACION) se eligen con APP_PERFIL antes de importar;
+#  - preparar_app() valida el perfil y hace la inicialización única antes del fork.
+# Después del fork, cada worker llama a reiniciar_tras_fork() para tener sus propios hilos,
+# pools y conexiones. Al apagarse, cada worker deja de figurar como listo en /readyz, termina
+# las requests en curso y vacía sus colas antes de salir.
+_estado_servidor = {'drenando': False, 'perfil': None}
+
+def preparar_app(perfil=None):
+    """
+    Hago la inicialización que conviene hacer una sola vez y devuelvo la app (la del módulo) lista para servir.
+    Si el módulo se importó con APP_PERFIL, ese perfil ya está aplicado y no acepto otro. Si no,
+    aplico acá el pedido (por defecto 'desarrollo'), salvo que cambie la configuración con la que
+    ya se armaron los motores de la base: para eso hay que elegirlo con APP_PERFIL antes de importar.
+    """
+    if PERFIL_ACTIVO is not None:
+        perfil = perfil or PERFIL_ACTIVO
+        if perfil != PERFIL_ACTIVO:
+            raise RuntimeError(f"La aplicación se importó con el perfil '{PERFIL_ACTIVO}', no '{perfil}'. "
+                               f"Definí APP_PERFIL={perfil} antes de importarla.")
+    else:
+        perfil = perfil or 'desarrollo'
+        claves_base = [clave for clave in PERFILES_CONFIGURACION.get(perfil, {})
+                       if clave.startswith(('SQLALCHEMY_', 'LECTURA_', 'ESCRITURA_')) and clave not in os.environ]
+        if claves_base:
+            raise RuntimeError(f"El perfil '{perfil}' cambia {', '.join(claves_base)}: definí APP_PERFIL={perfil} "
+                               f"antes de importar la aplicación.")
+        aplicar_perfil(app.config, perfil)
+        logging.getLogger().setLevel(app.config['LOG_LEVEL'])
+    _estado_servidor['perfil'] = perfil
+    servicio_hash.metodo # Si el algoritmo de hasheo configurado no existe, prefiero fallar al arrancar.
+
+    if perfil == 'produccion' and app.config['SECRET_KEY'] == CLAVE_SECRETA_RESPALDO:
+        raise RuntimeError("En producción hay que definir la variable de entorno SECRET_KEY.")
+
+    inicio = time.perf_counter()
+    with app.app_context():
+        db.session.execute(select(1)) # Si la base no está accesible, prefiero enterarme acá y no en la primera request.
+        indice_busqueda_disponible()
+        if db.inspect(db.session.connection()).has_table(TrabajoBorrado.__tablename__): # Bases sin 'flask init-db' nuevo.
+            marcar_trabajos_interrumpidos()
+        db.session.remove()
+        # No dejo conexiones abiertas: si después hay un fork, cada worker tiene que abrir las suyas.
+        for motor in db.engines.values():
+            motor.dispose()
+    obtener_manifiesto_estaticos()
+    for nombre in app.jinja_env.list_templates():
+        app.jinja_env.get_template(nombre)
+    logging.info("Aplicación inicializada con el perfil '%s' en %.0f ms.", perfil, (time.perf_counter() - inicio) * 1000)
+    return app
+
+def reiniciar_tras_fork():
+    """Lo llama cada worker apenas nace (hook post_fork de gunicorn): nada de hilos, pools ni conexiones heredadas."""
+    global _log_listener, _executor_imagenes, _executor_borrados
+    # El hilo que escribe los logs no existe en el hijo: armo la cadena de nuevo.
+    _log_listener = None
+    configurar_logging(app.config)
+    servicio_hash.reiniciar_tras_fork()
+    buffer_contactos.reiniciar_tras_fork()
+    metricas_rutas.reiniciar() # Lo que haya medido el padre no es de este worker.
+    _executor_imagenes = ThreadPoolExecutor(max_workers=app.config['IMAGENES_WORKERS'], thread_name_prefix='imagenes')
+    atexit.register(_executor_imagenes.shutdown, wait=True)
+    _executor_borrados = ThreadPoolExecutor(max_workers=1, thread_name_prefix='borrados')
+    atexit.register(_executor_borrados.shutdown, wait=True)
+    with app.app_context():
+        # close=False: las conexiones del padre son suyas, acá solo las olvido (las del escritor y las de lectura).
+        for motor in db.engines.values():
+            motor.dispose(close=False)
+    _estado_servidor['drenando'] = False
+
+def marcar_drenando():
+    """El worker recibió la orden de apagarse: /readyz empieza a responder 503 y los feeds SSE se cierran."""
+    if _estado_servidor['drenando']:
+        return # El maestro puede mandar SIGTERM más de una vez.
+    _estado_servidor['drenando'] = True
+    logging.info("Worker %s drenando: termino las requests en curso y salgo.", os.getpid())
+
+def cerrar_recursos():
+    """Al salir un worker: guardo los contactos que quedaron en el buffer y espero los trabajos de fondo."""
+    buffer_contactos.detener()
+    _executor_imagenes.shutdown(wait=True)
+    _executor_borrados.shutdown(wait=True)
+
+# Liveness: el proceso está vivo y atiende. No toca la base para que sea instantáneo.
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({'estado': 'ok', 'pid': os.getpid()}), 200
+
+# Readiness: el worker puede recibir tráfico (no se está apagando y la base responde).
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    if _estado_servidor['drenando']:
+        return jsonify({'estado': 'drenando', 'pid': os.getpid()}), 503
+    try:
+        db.session.execute(select(1))
+    except Exception as e:
+        logging.error("readyz: la base de datos no responde: %s", e)
+        return jsonify({'estado': 'sin_base_de_datos', 'pid': os.getpid()}), 503
+    return jsonify({'estado': 'listo', 'pid': os.getpid(), 'perfil': _estado_servidor['perfil']}), 200
+
 # --- 9. Ejecución de la Aplicación Flask ---
 if __name__ == '__main__':
+    # Servidor de desarrollo (un solo proceso, con recarga automática). Para producción: gunicorn -c gunicorn.conf.py
+    preparar_app()
     with app.app_context():
         logging.info("La aplicación se iniciará. Asegúrate de haber ejecutado 'flask init-db' al menos una vez.")
-    app.run(debug=True)
+    app.run(debug=app.config['DEBUG'])
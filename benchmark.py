@@ -0,0 +1,461 @@
+# Este script es mi banco de pruebas de rendimiento para app.py.
+# Genera un conjunto de datos sintético del tamaño que yo le pida (productos, usuarios,
+# pedidos y detalles), y después reproduce una mezcla de tráfico realista contra todas
+# las rutas de la aplicación: navegación del catálogo, logins, compras, listados del admin, etc.
+# Al final reporta, por endpoint, latencias p50/p95/p99, throughput, cantidad de consultas SQL
+# y pico de memoria, en JSON, para poder comparar una corrida contra otra entre commits.
+#
+# Uso típico:
+#   python benchmark.py --productos 2000 --usuarios 100000 --pedidos 500000 --salida bench.json
+#   python benchmark.py --reusar-db --requests 5000 --hilos 4 --comparar bench.json
+import argparse # Para leer los parámetros de la línea de comandos.
+import io # Para armar en memoria la imagen que subo al crear productos.
+import json # Para la salida en formato legible por máquinas.
+import os # Para rutas y variables de entorno.
+import random # Para generar los datos y elegir los escenarios.
+import subprocess # Para anotar en el reporte el commit que se está midiendo.
+import sys # Para el código de salida cuando hay regresiones.
+import tempfile # Para la base de datos de prueba por defecto.
+import threading # Para simular varios clientes a la vez.
+import time # Para medir tiempos.
+import tracemalloc # Para medir el pico de memoria de cada request.
+from datetime import datetime, timedelta, UTC # Para repartir las fechas de los pedidos sintéticos.
+
+PASSWORD_BENCH = 'bench123'
+ESTADOS = ['Pendiente', 'Aceptado', 'Enviado']
+
+
+def parsear_argumentos():
+    parser = argparse.ArgumentParser(description='Benchmark de carga y latencia para Frutales del Norte.')
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'frutales_bench.db'),
+                        help='Archivo SQLite donde se genera el dataset (nunca uso la base real).')
+    parser.add_argument('--reusar-db', action='store_true', help='No regenero el dataset si el archivo ya existe.')
+    parser.add_argument('--productos', type=int, default=500)
+    parser.add_argument('--usuarios', type=int, default=2000)
+    parser.add_argument('--pedidos', type=int, default=20000)
+    parser.add_argument('--items-por-pedido', type=int, default=3, help='Máximo de líneas por pedido (mínimo 1).')
+    parser.add_argument('--requests', type=int, default=2000, help='Cantidad total de requests a reproducir.')
+    parser.add_argument('--hilos', type=int, default=1,
+                        help='Clientes concurrentes. Con 1, el pico de memoria por request es exacto.')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--contacto-buffer', action=argparse.BooleanOptionalAction, default=True,
+                        help='Mido el formulario de contacto con el buffer de escritura (con --no-contacto-buffer, el guardado directo).')
+    parser.add_argument('--salida', help='Archivo donde guardo el reporte JSON (si no, lo imprimo).')
+    parser.add_argument('--comparar', help='Reporte JSON anterior contra el cual comparar el p95 de cada endpoint.')
+    parser.add_argument('--tolerancia', type=float, default=0.2,
+                        help='Aumento relativo del p95 a partir del cual lo considero regresión (0.2 = 20%%).')
+    return parser.parse_args()
+
+
+# --- Generación del Dataset Sintético ---
+def insertar_en_chunks(db, tabla, filas, chunk=10000):
+    """Inserto muchas filas con INSERTs de varias filas, confirmando cada tanto para no inflar la transacción."""
+    for inicio in range(0, len(filas), chunk):
+        db.session.execute(db.insert(tabla), filas[inicio:inicio + chunk])
+        db.session.commit()
+
+
+def generar_dataset(appmod, args):
+    """
+    Primero corro el mismo seeding que 'flask init-db' (tablas, productos de ejemplo, admin y cliente)
+    y después agrego los datos sintéticos a granel. Todos los usuarios sintéticos comparten el mismo
+    hash de contraseña, así no tardo horas hasheando 100k contraseñas.
+    """
+    app, db = appmod.app, appmod.db
+    appmod.init_db_command_function()
+    rnd = random.Random(args.semilla)
+
+    with app.app_context():
+        productos = [
+            {'nombre': f'Árbol de prueba {i}', 'precio': float(rnd.randint(5000, 50000)),
+             'imagen': 'img/manzana.jpg', 'stock': 10 ** 9}
+            for i in range(args.productos)
+        ]
+        insertar_en_chunks(db, appmod.Producto.__table__, productos)
+        ids_productos = db.session.execute(db.select(appmod.Producto.id, appmod.Producto.precio)).all()
+
+        hash_comun = appmod.servicio_hash.hashear(PASSWORD_BENCH)
+        usuarios = [
+            {'nombre': f'Cliente Bench {i}', 'email': f'bench{i}@frutales.com', 'password': hash_comun, 'rol': 'cliente'}
+            for i in range(args.usuarios)
+        ]
+        insertar_en_chunks(db, appmod.Usuario.__table__, usuarios)
+        ids_usuarios = db.session.execute(db.select(appmod.Usuario.id)).scalars().all()
+
+        ahora = datetime.now(UTC)
+        siguiente_pedido = (db.session.execute(db.select(db.func.max(appmod.Pedido.id))).scalar() or 0) + 1
+        for inicio in range(0, args.pedidos, 10000):
+            pedidos, detalles = [], []
+            for pedido_id in range(siguiente_pedido + inicio, siguiente_pedido + min(inicio + 10000, args.pedidos)):
+                lineas = rnd.sample(ids_productos, k=min(len(ids_productos), rnd.randint(1, max(1, args.items_por_pedido))))
+                total = 0.0
+                for producto_id, precio in lineas:
+                    cantidad = rnd.randint(1, 5)
+                    total += precio * cantidad
+                    detalles.append({'pedido_id': pedido_id, 'producto_id': producto_id,
+                                     'cantidad': cantidad, 'precio_unitario': precio})
+                pedidos.append({'id': pedido_id, 'user_id': rnd.choice(ids_usuarios), 'total': total,
+                                'estado': rnd.choice(ESTADOS),
+                                'fecha_pedido': ahora - timedelta(seconds=rnd.randint(0, 2 * 365 * 86400))})
+            insertar_en_chunks(db, appmod.Pedido.__table__, pedidos)
+            insertar_en_chunks(db, appmod.DetallePedido.__table__, detalles)
+        # Los inserts masivos no pasan por los handlers, así que armo los agregados y el índice de búsqueda al final.
+        appmod.reconstruir_ventas()
+        appmod.crear_indice_busqueda(reconstruir=True)
+
+        return {
+            'productos': db.session.execute(db.select(db.func.count(appmod.Producto.id))).scalar(),
+            'usuarios': db.session.execute(db.select(db.func.count(appmod.Usuario.id))).scalar(),
+            'pedidos': db.session.execute(db.select(db.func.count(appmod.Pedido.id))).scalar(),
+            'detalles': db.session.execute(db.select(db.func.count(appmod.DetallePedido.id))).scalar(),
+        }
+
+
+# --- Escenarios de Tráfico ---
+# Cada escenario recibe el contexto del hilo y devuelve la respuesta de la request que se mide.
+# Los pesos imitan el tráfico real: mucho catálogo, bastante login y compras, poco admin.
+class ContextoHilo:
+    """Los clientes HTTP y los datos que cada hilo necesita para armar sus requests."""
+    def __init__(self, appmod, rnd, max_usuario_bench):
+        self.appmod = appmod
+        self.rnd = rnd
+        self.max_usuario_bench = max_usuario_bench
+        self.anonimo = appmod.app.test_client()
+        self.cliente = self.loguear('cliente@frutales.com', 'cliente123')
+        self.admin = self.loguear('admin@frutales.com', 'admin123')
+        self.pedidos_propios = []
+        with appmod.app.app_context():
+            self.ids_productos = appmod.db.session.execute(appmod.db.select(appmod.Producto.id)).scalars().all()
+        self.trabajo_id = self.lanzar_trabajo_borrado()
+
+    def loguear(self, email, password):
+        cliente = self.appmod.app.test_client()
+        cliente.post('/api/login', json={'email': email, 'password': password})
+        return cliente
+
+    def lanzar_trabajo_borrado(self):
+        """Creo un producto, lo compro una vez y lo borro: con ventas, el borrado va a segundo plano (ver main)."""
+        alta = self.admin.post('/api/admin/products', content_type='multipart/form-data',
+                               data={'nombre': 'Bench trabajo', 'precio': '1', 'stock': '10',
+                                     'imagen': (_imagen_chica(), 'bench.jpg')})
+        producto_id = alta.get_json()['product']['id']
+        self.cliente.post('/api/pedidos', json={'items': [{'id': producto_id, 'cantidad': 1}], 'total': 1})
+        return self.admin.delete(f'/api/admin/products/{producto_id}').get_json()['trabajo']['id']
+
+    def email_bench(self):
+        if self.max_usuario_bench <= 0:
+            return 'cliente@frutales.com', 'cliente123'
+        return f'bench{self.rnd.randrange(self.max_usuario_bench)}@frutales.com', PASSWORD_BENCH
+
+
+def _imagen_chica():
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), (120, 180, 60)).save(buffer, 'JPEG')
+    buffer.seek(0)
+    return buffer
+
+
+def items_al_azar(ctx):
+    return [{'id': pid, 'cantidad': ctx.rnd.randint(1, 3)}
+            for pid in ctx.rnd.sample(ctx.ids_productos, k=min(3, len(ctx.ids_productos)))]
+
+
+def esc_comprar(ctx):
+    items = items_al_azar(ctx)
+    respuesta = ctx.cliente.post('/api/pedidos', json={'items': items, 'total': 1})
+    if respuesta.status_code == 201:
+        ctx.pedidos_propios.append(respuesta.get_json()['pedido_id'])
+    return respuesta
+
+
+def esc_login(ctx):
+    email, password = ctx.email_bench()
+    return ctx.appmod.app.test_client().post('/api/login', json={'email': email, 'password': password})
+
+
+def esc_registro(ctx):
+    email = f'registro-{time.time_ns()}-{ctx.rnd.random()}@frutales.com'
+    return ctx.appmod.app.test_client().post('/api/registros', json={'nombre': 'Nuevo', 'email': email, 'password': 'x1'})
+
+
+def esc_borrar_usuario(ctx):
+    # Creo un usuario descartable para poder borrarlo sin romper el resto de la corrida.
+    email = f'descartable-{time.time_ns()}-{ctx.rnd.random()}@frutales.com'
+    nuevo = ctx.appmod.app.test_client()
+    nuevo.post('/api/registros', json={'nombre': 'Descartable', 'email': email, 'password': 'x1'})
+    user_id = nuevo.post('/api/login', json={'email': email, 'password': 'x1'}).get_json()['user']['id']
+    return ctx.admin.delete(f'/api/admin/delete_user/{user_id}')
+
+
+def esc_cambiar_rol(ctx):
+    return ctx.admin.post('/api/admin/change_user_role', json={'user_id': 2, 'new_role': 'cliente'})
+
+
+def esc_producto_crud(ctx):
+    # Alta, edición y baja de un producto: mido la baja, que es la que más trabajo hace en la base.
+    alta = ctx.admin.post('/api/admin/products', content_type='multipart/form-data',
+                          data={'nombre': 'Bench', 'precio': '1', 'stock': '1', 'imagen': (_imagen_chica(), 'bench.jpg')})
+    producto_id = alta.get_json()['product']['id']
+    ctx.admin.put(f'/api/admin/products/{producto_id}', data={'nombre': 'Bench 2', 'precio': '2', 'stock': '2'})
+    return ctx.admin.delete(f'/api/admin/products/{producto_id}')
+
+
+def esc_estado_pedido(ctx):
+    if not ctx.pedidos_propios:
+        return esc_comprar(ctx)
+    pedido_id = ctx.rnd.choice(ctx.pedidos_propios)
+    return ctx.admin.put(f'/api/admin/pedidos/{pedido_id}/estado', json={'estado': ctx.rnd.choice(ESTADOS)})
+
+
+def esc_borrar_pedido(ctx):
+    if not ctx.pedidos_propios:
+        return esc_comprar(ctx)
+    return ctx.admin.delete(f'/api/admin/pedidos/{ctx.pedidos_propios.pop()}')
+
+
+def esc_contacto(ctx):
+    return ctx.anonimo.post('/api/contacto', json={
+        'name': 'Bench', 'email': 'bench@frutales.com', 'subject': 'Consulta', 'message': 'Hola'})
+
+
+def esc_exportar(ctx):
+    respuesta = ctx.admin.get('/api/admin/products/export', query_string={'formato': ctx.rnd.choice(['csv', 'ndjson'])})
+    respuesta.get_data() # Sale en streaming: mido hasta el último byte.
+    return respuesta
+
+
+def esc_importar(ctx):
+    # Una actualización de temporada chica: precios nuevos para 50 productos, en CSV.
+    lineas = ['id,precio'] + [f'{pid},{ctx.rnd.randint(5000, 50000)}'
+                              for pid in ctx.rnd.sample(ctx.ids_productos, k=min(50, len(ctx.ids_productos)))]
+    return ctx.admin.post('/api/admin/products/import', query_string={'formato': 'csv'},
+                          data='\n'.join(lineas).encode(), content_type='text/csv')
+
+
+def esc_eventos_pedidos(ctx):
+    # El feed no termina nunca: mido hasta el primer lote y corto. Con desde=0 siempre hay algo que
+    # mandar: los eventos de las compras del benchmark o, si ya se descartaron, un 'reinicio'.
+    respuesta = ctx.admin.get('/api/admin/pedidos/eventos', query_string={'desde': 0}, buffered=False)
+    trozos = iter(respuesta.response)
+    next(trozos) # El 'retry:' inicial.
+    next(trozos)
+    return respuesta
+
+
+ESCENARIOS = [
+    # (nombre, peso, función)
+    ('GET /productos', 20, lambda ctx: ctx.anonimo.get('/productos')),
+    ('GET /api/productos', 20, lambda ctx: ctx.anonimo.get('/api/productos')),
+    ('GET /api/productos/buscar', 6, lambda ctx: ctx.anonimo.get('/api/productos/buscar', query_string={
+        'q': ctx.rnd.choice(['arb', 'árbol de', 'prueba 1', 'manz', 'pera'])})),
+    ('GET /', 6, lambda ctx: ctx.anonimo.get('/')),
+    ('GET /carrito', 3, lambda ctx: ctx.cliente.get('/carrito')),
+    ('GET /contactos', 1, lambda ctx: ctx.anonimo.get('/contactos')),
+    ('GET /login', 2, lambda ctx: ctx.anonimo.get('/login')),
+    ('GET /registro', 1, lambda ctx: ctx.anonimo.get('/registro')),
+    ('GET /mis_pedidos', 5, lambda ctx: ctx.cliente.get('/mis_pedidos')),
+    ('GET /api/check_login_status', 5, lambda ctx: ctx.cliente.get('/api/check_login_status')),
+    ('POST /api/login', 8, esc_login),
+    ('POST /api/registros', 1, esc_registro),
+    ('GET /logout', 1, lambda ctx: ctx.appmod.app.test_client().get('/logout')),
+    # De las dos de contacto corre una sola, según --contacto-buffer (ver correr_trafico).
+    ('POST /api/contacto', 2, esc_contacto),
+    ('POST /api/contacto (buffer)', 2, esc_contacto),
+    ('POST /api/pedidos', 8, esc_comprar),
+    ('POST /api/carrito/cotizar', 6, lambda ctx: ctx.anonimo.post('/api/carrito/cotizar', json={'items': items_al_azar(ctx)})),
+    ('GET /api/mis_pedidos', 4, lambda ctx: ctx.cliente.get('/api/mis_pedidos')),
+    ('GET /admin', 1, lambda ctx: ctx.admin.get('/admin')),
+    ('GET /api/admin/pedidos', 4, lambda ctx: ctx.admin.get('/api/admin/pedidos')),
+    ('GET /api/admin/pedidos?estado', 1, lambda ctx: ctx.admin.get('/api/admin/pedidos', query_string={
+        'estado': ctx.rnd.choice(ESTADOS), 'limit': 100})),
+    ('GET /api/admin/pedidos/stream', 1, lambda ctx: ctx.admin.get('/api/admin/pedidos/stream', query_string={
+        'desde': (datetime.now(UTC) - timedelta(days=7)).date().isoformat()})),
+    ('PUT /api/admin/pedidos/<id>/estado', 2, esc_estado_pedido),
+    ('DELETE /api/admin/pedidos/<id>', 1, esc_borrar_pedido),
+    ('POST /api/admin/change_user_role', 1, esc_cambiar_rol),
+    ('DELETE /api/admin/delete_user/<id>', 1, esc_borrar_usuario),
+    ('DELETE /api/admin/products/<id>', 1, esc_producto_crud),
+    ('GET /api/admin/analytics', 2, lambda ctx: ctx.admin.get('/api/admin/analytics', query_string={
+        'desde': (datetime.now(UTC) - timedelta(days=365)).date().isoformat()})),
+    ('GET /api/admin/hash_status', 1, lambda ctx: ctx.admin.get('/api/admin/hash_status')),
+    ('GET /api/admin/pedidos/eventos', 1, esc_eventos_pedidos),
+    ('GET /api/admin/metrics', 1, lambda ctx: ctx.admin.get('/api/admin/metrics')),
+    ('GET /api/admin/trabajos/<id>', 2, lambda ctx: ctx.admin.get(f'/api/admin/trabajos/{ctx.trabajo_id}')),
+    ('GET /api/admin/products/export', 1, esc_exportar),
+    ('POST /api/admin/products/import', 1, esc_importar),
+]
+
+
+# --- Medición ---
+class Medidor:
+    """Junta las muestras de cada endpoint. Cuenta las consultas SQL por hilo con eventos de SQLAlchemy."""
+    def __init__(self, appmod, medir_memoria):
+        self.muestras = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.medir_memoria = medir_memoria
+        # Escucho en todos los motores: los GET leen por el pool de solo lectura y las escrituras van
+        # por el motor principal, y las dos cosas tienen que sumar.
+        with appmod.app.app_context():
+            for motor in appmod.db.engines.values():
+                appmod.event.listen(motor, 'before_cursor_execute', self._contar_consulta)
+
+    def _contar_consulta(self, *args):
+        self.local.consultas = getattr(self.local, 'consultas', 0) + 1
+
+    def medir(self, nombre, funcion, ctx):
+        self.local.consultas = 0
+        if self.medir_memoria:
+            tracemalloc.reset_peak()
+            memoria_base = tracemalloc.get_traced_memory()[0]
+        inicio = time.perf_counter()
+        try:
+            respuesta = funcion(ctx)
+            error = respuesta.status_code >= 500
+            respuesta.close()
+        except Exception:
+            error = True
+        duracion = time.perf_counter() - inicio
+        pico = tracemalloc.get_traced_memory()[1] - memoria_base if self.medir_memoria else None
+        with self.lock:
+            self.muestras.setdefault(nombre, []).append((duracion, self.local.consultas, pico, error))
+
+
+def percentil(valores_ordenados, p):
+    if not valores_ordenados:
+        return 0.0
+    indice = min(len(valores_ordenados) - 1, int(round(p / 100 * (len(valores_ordenados) - 1))))
+    return valores_ordenados[indice]
+
+
+def resumir(muestras, duracion_total):
+    endpoints = {}
+    for nombre, filas in sorted(muestras.items()):
+        tiempos = sorted(f[0] for f in filas)
+        consultas = [f[1] for f in filas]
+        picos = [f[2] for f in filas if f[2] is not None]
+        endpoints[nombre] = {
+            'requests': len(filas),
+            'errores': sum(1 for f in filas if f[3]),
+            'p50_ms': round(percentil(tiempos, 50) * 1000, 3),
+            'p95_ms': round(percentil(tiempos, 95) * 1000, 3),
+            'p99_ms': round(percentil(tiempos, 99) * 1000, 3),
+            'media_ms': round(sum(tiempos) / len(tiempos) * 1000, 3),
+            'throughput_rps': round(len(filas) / duracion_total, 2),
+            'consultas_media': round(sum(consultas) / len(consultas), 2),
+            'consultas_max': max(consultas),
+            'memoria_pico_kb': round(max(picos) / 1024, 1) if picos else None,
+        }
+    return endpoints
+
+
+def correr_trafico(appmod, args, max_usuario_bench):
+    medidor = Medidor(appmod, medir_memoria=args.hilos == 1)
+    if medidor.medir_memoria:
+        tracemalloc.start()
+    excluido = 'POST /api/contacto' if args.contacto_buffer else 'POST /api/contacto (buffer)'
+    escenarios = [e for e in ESCENARIOS if e[0] != excluido]
+    nombres = [e[0] for e in escenarios]
+    pesos = [e[1] for e in escenarios]
+    funciones = {e[0]: e[2] for e in escenarios}
+    por_hilo = [args.requests // args.hilos + (1 if i < args.requests % args.hilos else 0) for i in range(args.hilos)]
+
+    def trabajar(indice, cantidad):
+        rnd = random.Random(args.semilla + indice)
+        ctx = ContextoHilo(appmod, rnd, max_usuario_bench)
+        # Primero paso una vez por cada escenario, así todas las rutas quedan medidas aunque tengan poco peso.
+        plan = nombres + rnd.choices(nombres, weights=pesos, k=max(0, cantidad - len(nombres)))
+        for nombre in plan:
+            medidor.medir(nombre, funciones[nombre], ctx)
+
+    hilos = [threading.Thread(target=trabajar, args=(i, n)) for i, n in enumerate(por_hilo)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+    if medidor.medir_memoria:
+        tracemalloc.stop()
+
+    total = sum(len(v) for v in medidor.muestras.values())
+    return resumir(medidor.muestras, duracion), {
+        'requests': total, 'duracion_s': round(duracion, 3), 'throughput_rps': round(total / duracion, 2)}
+
+
+def comparar(reporte, anterior, tolerancia):
+    """Imprimo la variación de p95 por endpoint y devuelvo la lista de regresiones."""
+    regresiones = []
+    print(f"{'endpoint':45} {'p95 antes':>10} {'p95 ahora':>10} {'cambio':>8}")
+    for nombre, datos in reporte['endpoints'].items():
+        previo = anterior.get('endpoints', {}).get(nombre)
+        if not previo or not previo['p95_ms']:
+            continue
+        cambio = (datos['p95_ms'] - previo['p95_ms']) / previo['p95_ms']
+        marca = ' <-- regresión' if cambio > tolerancia else ''
+        print(f"{nombre:45} {previo['p95_ms']:>10.2f} {datos['p95_ms']:>10.2f} {cambio:>+8.1%}{marca}")
+        if marca:
+            regresiones.append(nombre)
+    return regresiones
+
+
+def main():
+    args = parsear_argumentos()
+    # Configuro el entorno antes de importar la app, porque app.py lee la configuración al importarse.
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.abspath(args.db)
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    reusar = args.reusar_db and os.path.exists(args.db)
+    if not reusar and os.path.exists(args.db):
+        os.remove(args.db)
+
+    import app as appmod
+    appmod.app.config['TESTING'] = True
+    # Todas las requests salen de la misma IP y los mismos usuarios: con el control de admisión
+    # activo el benchmark mediría los 429, no las rutas.
+    appmod.app.config['ADMISION_HABILITADA'] = False
+    appmod.app.config['CONTACTO_BUFFER'] = args.contacto_buffer
+    # Con umbral 0, borrar un producto con ventas va a un trabajo en segundo plano, y así hay uno
+    # para consultar. Los escenarios de borrado usan usuarios y productos sin líneas: siguen síncronos.
+    appmod.app.config['BORRADO_UMBRAL_SINCRONO'] = 0
+    # Las imágenes que suben los escenarios de admin van a una carpeta temporal, no a static/ del repo.
+    appmod.app.static_folder = tempfile.mkdtemp(prefix='frutales_bench_static_')
+
+    inicio = time.perf_counter()
+    if reusar:
+        dataset = {'reusado': True}
+    else:
+        dataset = generar_dataset(appmod, args)
+    dataset['generacion_s'] = round(time.perf_counter() - inicio, 3)
+
+    endpoints, total = correr_trafico(appmod, args, 0 if reusar else args.usuarios)
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+
+    reporte = {
+        'commit': commit,
+        'fecha': datetime.now(UTC).isoformat(),
+        'parametros': {k: v for k, v in vars(args).items() if k not in ('salida', 'comparar')},
+        'dataset': dataset,
+        'total': total,
+        'endpoints': endpoints,
+    }
+    texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto)
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as archivo:
+            regresiones = comparar(reporte, json.load(archivo), args.tolerancia)
+        if regresiones:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+# Configuración de gunicorn para correr la aplicación en producción:
+#
+#     gunicorn -c gunicorn.conf.py
+#
+# Levanta un proceso maestro que carga la app una sola vez (preload_app) y después hace fork de
+# varios workers, uno por núcleo por defecto. Cada worker atiende varias requests a la vez con hilos.
+# Al recibir SIGTERM, cada worker deja de aceptar conexiones, termina lo que tiene en curso
+# (hasta graceful_timeout segundos) y vacía sus colas antes de salir.
+import multiprocessing
+import os
+import signal
+
+# El perfil se aplica al importar app.py (antes de armar los motores de la base), así que lo
+# elijo acá, antes de que gunicorn lo importe. Si APP_PERFIL ya viene definida, la respeto.
+os.environ.setdefault('APP_PERFIL', 'produccion')
+# La inicialización de producción (ver preparar_app en app.py).
+wsgi_app = "app:preparar_app()"
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', str(multiprocessing.cpu_count())))
+# Hilos por worker: además de repartir la carga, el feed SSE del admin ocupa uno mientras está abierto.
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# La app se importa e inicializa en el maestro, antes del fork: los workers arrancan ya listos
+# y comparten esa memoria (y los contadores de caché en memoria compartida).
+preload_app = True
+
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', '30'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+keepalive = 5
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # Cada worker necesita sus propios hilos, pools y conexiones a la base.
+    import app
+    app.reiniciar_tras_fork()
+
+
+def post_worker_init(worker):
+    # gunicorn ya instaló su manejador de SIGTERM (apagado ordenado). Lo envuelvo para avisarle
+    # antes a la app, así /readyz responde 503 y los feeds SSE se cierran mientras el worker drena.
+    import app
+    anterior = signal.getsignal(signal.SIGTERM)
+
+    def al_recibir_sigterm(signum, frame):
+        app.marcar_drenando()
+        if callable(anterior):
+            anterior(signum, frame)
+
+    signal.signal(signal.SIGTERM, al_recibir_sigterm)
+
+
+def worker_exit(server, worker):
+    import app
+    app.cerrar_recursos()
@@ -232,61 +232,133 @@ document.addEventListener('DOMContentLoaded', function() {
 
 
     // --- LÓGICA PARA GESTIÓN DE TODOS LOS PEDIDOS DE CLIENTES ---
-    // Esta función carga y muestra todos los pedidos realizados por los clientes.
-    async function loadAllOrders() {
-        allOrdersListDiv.innerHTML = '<p>Cargando pedidos de clientes...</p>';
+    // Los pedidos vienen paginados: cada respuesta trae una página y un 'next_cursor'
+    // que uso para pedir la siguiente cuando el admin toca "Cargar más pedidos".
+    let ordersNextCursor = null;
+    const loadMoreOrdersBtn = document.createElement('button');
+    loadMoreOrdersBtn.type = 'button';
+    loadMoreOrdersBtn.textContent = 'Cargar más pedidos';
+    loadMoreOrdersBtn.style.display = 'none';
+    allOrdersListDiv.after(loadMoreOrdersBtn);
+
+    // Armo el HTML de un pedido y lo agrego al contenedor (al final, o al principio si es uno recién llegado).
+    function renderOrder(order, alPrincipio = false) {
+        const orderDiv = document.createElement('div');
+        orderDiv.className = 'pedido-item';
+        orderDiv.dataset.pedidoId = order.id;
+
+        // Armo el HTML para cada pedido, incluyendo los datos del comprador y el estado editable.
+        orderDiv.innerHTML = `
+            <div class="pedido-header">
+                <h3>Pedido #ID: ${order.id} (Cliente: ${order.comprador_nombre || 'Desconocido'})</h3>
+                <span>Email: ${order.comprador_email || 'Desconocido'}</span>
+                <span>Fecha: ${new Date(order.fecha_pedido).toLocaleString('es-AR', { dateStyle: 'short', timeStyle: 'short' })}</span>
+                <span>Total: $${order.total.toFixed(2)}</span>
+            </div>
+            <div class="pedido-items">
+                <h4>Productos:</h4>
+                <ul>
+                    ${order.items.map(item => `
+                        <li>
+                            <span>${item.cantidad} x ${item.nombre_producto || 'Producto Desconocido'}</span>
+                            <span>$${(item.precio_unitario * item.cantidad).toFixed(2)}</span>
+                        </li>
+                    `).join('')}
+                </ul>
+            </div>
+            <div class="pedido-actions" style="display: flex; align-items: center; gap: 15px; margin-top: 15px; padding-top: 15px; border-top: 1px solid #ddd;">
+                <strong>Estado:</strong>
+                ${order.archivado ? `
+                <span>${order.estado} (archivado, solo lectura)</span>
+                ` : `
+                <select class="order-status-select" data-pedido-id="${order.id}">
+                    <option value="Pendiente" ${order.estado === 'Pendiente' ? 'selected' : ''}>Pendiente</option>
+                    <option value="Aceptado" ${order.estado === 'Aceptado' ? 'selected' : ''}>Aceptado</option>
+                    <option value="Enviado" ${order.estado === 'Enviado' ? 'selected' : ''}>Enviado</option>
+                </select>
+                <button class="save-status-btn" data-pedido-id="${order.id}">Guardar Estado</button>
+                <button class="delete-btn-common delete-order-btn" data-pedido-id="${order.id}">Eliminar Pedido</button>
+                `}
+            </div>
+        `;
+        if (alPrincipio) {
+            allOrdersListDiv.prepend(orderDiv);
+        } else {
+            allOrdersListDiv.appendChild(orderDiv); // Agrego el pedido al contenedor principal de pedidos.
+        }
+    }
+
+    // --- NOVEDADES DE PEDIDOS EN VIVO (Server-Sent Events) ---
+    // En vez de volver a pedir la lista entera, me suscribo al feed de novedades desde el último
+    // evento que conocía la primera página. El navegador se reconecta solo y retoma desde el último
+    // evento recibido (manda el header Last-Event-ID).
+    let orderEvents = null;
+
+    function connectOrderEvents(ultimoEvento) {
+        if (!window.EventSource) return; // Navegadores muy viejos: queda la carga manual.
+        if (orderEvents) orderEvents.close();
+        orderEvents = new EventSource(`/api/admin/pedidos/eventos?desde=${ultimoEvento}`);
+
+        orderEvents.addEventListener('pedido_nuevo', (event) => {
+            const order = JSON.parse(event.data);
+            if (allOrdersListDiv.querySelector(`.pedido-item[data-pedido-id="${order.id}"]`)) return;
+            if (!allOrdersListDiv.querySelector('.pedido-item')) allOrdersListDiv.innerHTML = ''; // Saco el "No hay pedidos".
+            renderOrder(order, true);
+        });
+
+        orderEvents.addEventListener('pedido_estado', (event) => {
+            const cambio = JSON.parse(event.data);
+            const selectElement = allOrdersListDiv.querySelector(`.order-status-select[data-pedido-id="${cambio.id}"]`);
+            if (selectElement) selectElement.value = cambio.estado;
+        });
+
+        // Un pedido archivado ya no se puede editar ni borrar desde acá: lo saco igual que uno eliminado.
+        const quitarPedido = (event) => {
+            const cambio = JSON.parse(event.data);
+            const orderDiv = allOrdersListDiv.querySelector(`.pedido-item[data-pedido-id="${cambio.id}"]`);
+            if (orderDiv) orderDiv.remove();
+        };
+        orderEvents.addEventListener('pedido_eliminado', quitarPedido);
+        orderEvents.addEventListener('pedido_archivado', quitarPedido);
+
+        // El servidor ya no tiene los eventos que me faltan: recargo la lista completa.
+        orderEvents.addEventListener('reinicio', () => loadAllOrders(false));
+    }
+
+    // Esta función carga una página de pedidos. Si 'append' es false, arranco de cero.
+    async function loadAllOrders(append = false) {
+        if (!append) {
+            ordersNextCursor = null;
+            allOrdersListDiv.innerHTML = '<p>Cargando pedidos de clientes...</p>';
+        }
         adminOrdersMessageDiv.style.display = 'none';
 
         try {
-            const response = await fetch('/api/admin/pedidos'); // Pido todos los pedidos a la API de admin.
+            const params = new URLSearchParams();
+            if (append && ordersNextCursor) params.set('cursor', ordersNextCursor);
+            // Si la página se abrió con ?archivo=1, también muestro los pedidos archivados (sin acciones:
+            // la API de estado y la de borrado solo trabajan con los pedidos que no están archivados).
+            const archivo = new URLSearchParams(window.location.search).get('archivo');
+            if (archivo) params.set('archivo', archivo);
+            const response = await fetch(`/api/admin/pedidos?${params.toString()}`); // Pido una página de pedidos a la API de admin.
             if (!response.ok) throw new Error('La respuesta de la red no fue correcta.'); // Si no es 200 OK, error.
-            
-            const orders = await response.json(); // Convierto la respuesta a JSON.
-            
-            allOrdersListDiv.innerHTML = ''; // Limpio el contenedor antes de añadir los pedidos.
 
-            if (orders.length === 0) {
-                allOrdersListDiv.innerHTML = '<p>No hay pedidos registrados.</p>'; // Si no hay pedidos, aviso.
-                return;
+            const page = await response.json(); // Convierto la respuesta a JSON.
+            const orders = page.pedidos;
+            ordersNextCursor = page.next_cursor;
+
+            if (!append) {
+                allOrdersListDiv.innerHTML = ''; // Limpio el contenedor antes de añadir los pedidos.
+                if (orders.length === 0) {
+                    allOrdersListDiv.innerHTML = '<p>No hay pedidos registrados.</p>'; // Si no hay pedidos, aviso.
+                }
             }
 
             // Recorro cada pedido y creo su estructura HTML.
-            orders.forEach(order => {
-                const orderDiv = document.createElement('div');
-                orderDiv.className = 'pedido-item';
-                
-                // Armo el HTML para cada pedido, incluyendo los datos del comprador y el estado editable.
-                orderDiv.innerHTML = `
-                    <div class="pedido-header">
-                        <h3>Pedido #ID: ${order.id} (Cliente: ${order.comprador_nombre || 'Desconocido'})</h3>
-                        <span>Email: ${order.comprador_email || 'Desconocido'}</span>
-                        <span>Fecha: ${new Date(order.fecha_pedido).toLocaleString('es-AR', { dateStyle: 'short', timeStyle: 'short' })}</span>
-                        <span>Total: $${order.total.toFixed(2)}</span>
-                    </div>
-                    <div class="pedido-items">
-                        <h4>Productos:</h4>
-                        <ul>
-                            ${order.items.map(item => `
-                                <li>
-                                    <span>${item.cantidad} x ${item.nombre_producto || 'Producto Desconocido'}</span>
-                                    <span>$${(item.precio_unitario * item.cantidad).toFixed(2)}</span>
-                                </li>
-                            `).join('')}
-                        </ul>
-                    </div>
-                    <div class="pedido-actions" style="display: flex; align-items: center; gap: 15px; margin-top: 15px; padding-top: 15px; border-top: 1px solid #ddd;">
-                        <strong>Estado:</strong>
-                        <select class="order-status-select" data-pedido-id="${order.id}">
-                            <option value="Pendiente" ${order.estado === 'Pendiente' ? 'selected' : ''}>Pendiente</option>
-                            <option value="Aceptado" ${order.estado === 'Aceptado' ? 'selected' : ''}>Aceptado</option>
-                            <option value="Enviado" ${order.estado === 'Enviado' ? 'selected' : ''}>Enviado</option>
-                        </select>
-                        <button class="save-status-btn" data-pedido-id="${order.id}">Guardar Estado</button>
-                        <button class="delete-btn-common delete-order-btn" data-pedido-id="${order.id}">Eliminar Pedido</button>
-                    </div>
-                `;
-                allOrdersListDiv.appendChild(orderDiv); // Agrego el pedido al contenedor principal de pedidos.
-            });
+            orders.forEach(order => renderOrder(order));
+            // Con la primera página me suscribo a las novedades desde ese momento.
+            if (!append) connectOrderEvents(page.ultimo_evento);
+            loadMoreOrdersBtn.style.display = ordersNextCursor ? 'block' : 'none';
 
         } catch (error) {
             // Si hay un error al cargar los pedidos...
@@ -297,6 +369,8 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    loadMoreOrdersBtn.addEventListener('click', () => loadAllOrders(true));
+
     // Escucho los clics en el contenedor de todos los pedidos (para actualizar estado o eliminar).
     allOrdersListDiv.addEventListener('click', async function(event) {
         adminOrdersMessageDiv.style.display = 'none';
@@ -31,6 +31,39 @@ document.addEventListener("DOMContentLoaded", function () {
         localStorage.setItem("carrito", JSON.stringify(carrito));
     }
 
+    // --- Clave de Idempotencia de la Compra ---
+    // Cada intento de compra de un mismo carrito lleva la misma clave (header Idempotency-Key), así
+    // si el primer intento tardó y el usuario vuelve a hacer clic, el servidor devuelve el mismo
+    // pedido en vez de crear otro. La clave se guarda junto con la firma del carrito que se mandó:
+    // si lo que voy a mandar es distinto (también cuando lo cambió productos.js u otra pestaña, que
+    // no pasan por acá), uso una clave nueva, porque el servidor rechaza con 422 una clave reusada
+    // con otro contenido. La clave no sale del contenido mismo: otra compra igual más tarde es otro pedido.
+    function firmaCompra(total) {
+        const lineas = carrito.map(p => [p.id, p.cantidad]).sort((a, b) => a[0] - b[0]);
+        return JSON.stringify({ lineas, total });
+    }
+
+    function obtenerClaveCompra(total) {
+        const firma = firmaCompra(total);
+        let guardada = null;
+        try {
+            guardada = JSON.parse(localStorage.getItem("claveCompra"));
+        } catch (error) {
+            guardada = null; // Formato viejo (la clave sola): arranco con una nueva.
+        }
+        if (guardada && guardada.firma === firma) return guardada.clave;
+
+        const clave = (window.crypto && crypto.randomUUID)
+            ? crypto.randomUUID()
+            : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+        localStorage.setItem("claveCompra", JSON.stringify({ clave, firma }));
+        return clave;
+    }
+
+    function descartarClaveCompra() {
+        localStorage.removeItem("claveCompra");
+    }
+
     function calcularTotalCarrito() {
         let total = 0;
         for (let producto of carrito) {
@@ -39,6 +72,62 @@ document.addEventListener("DOMContentLoaded", function () {
         return total;
     }
 
+    // --- Cotización del Carrito ---
+    // Los precios y el stock guardados en localStorage son los que había cuando se agregó cada
+    // producto. Le pido al servidor la cotización actual de todo el carrito (una sola llamada) y
+    // actualizo precios y avisos, así el usuario se entera antes de comprar y no cuando falla la compra.
+    let cotizacion = null;
+    let temporizadorCotizacion = null;
+
+    async function cotizarCarrito() {
+        if (carrito.length === 0) {
+            cotizacion = null;
+            return null;
+        }
+        try {
+            const response = await fetch('/api/carrito/cotizar', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ items: carrito.map(p => ({ id: p.id, cantidad: p.cantidad })) })
+            });
+            if (!response.ok) return null;
+            cotizacion = await response.json();
+        } catch (error) {
+            console.error('No se pudo cotizar el carrito:', error);
+            return null; // Sin cotización sigo mostrando lo guardado; la compra igual se valida en el servidor.
+        }
+
+        const lineas = new Map(cotizacion.items.map(linea => [linea.producto_id, linea]));
+        carrito.forEach(producto => {
+            const linea = lineas.get(parseInt(producto.id));
+            producto.noDisponible = !linea;
+            if (linea) {
+                producto.precio = linea.precio_unitario;
+                producto.nombre = linea.nombre;
+                producto.stock = linea.stock;
+            }
+        });
+        guardarCarritoEnStorage();
+        mostrarCarrito();
+        return cotizacion;
+    }
+
+    // Al cambiar cantidades espero un momento antes de cotizar, para no llamar al servidor en cada tecla.
+    function programarCotizacion() {
+        clearTimeout(temporizadorCotizacion);
+        temporizadorCotizacion = setTimeout(cotizarCarrito, 300);
+    }
+
+    function avisoProducto(producto) {
+        if (producto.noDisponible) {
+            return '<p class="aviso-carrito">Este producto ya no está disponible.</p>';
+        }
+        if (producto.stock !== undefined && producto.stock < producto.cantidad) {
+            return `<p class="aviso-carrito">Stock insuficiente: solo hay ${producto.stock} disponibles.</p>`;
+        }
+        return '';
+    }
+
     function mostrarCarrito() {
         contenedorCarrito.innerHTML = "";
 
@@ -72,6 +161,7 @@ document.addEventListener("DOMContentLoaded", function () {
                 <div class="carrito-detalles">
                     <p>${producto.nombre}</p>
                     <p>Precio unitario: $${producto.precio.toFixed(2)}</p>
+                    ${avisoProducto(producto)}
                 </div>
                 <input type="number" min="1" value="${producto.cantidad}" class="cantidad-input" data-indice="${indice}" />
                 <p>Subtotal: $${(producto.precio * producto.cantidad).toFixed(2)}</p>
@@ -86,6 +176,7 @@ document.addEventListener("DOMContentLoaded", function () {
     // Esta función elimina un producto del carrito utilizando su índice.
     function eliminarProductoDelCarrito(indice) {
         carrito.splice(indice, 1);
+        descartarClaveCompra();
         guardarCarritoEnStorage();
         mostrarCarrito();
     }
@@ -95,13 +186,16 @@ document.addEventListener("DOMContentLoaded", function () {
             nuevaCantidad = 1;
         }
         carrito[indice].cantidad = nuevaCantidad;
+        descartarClaveCompra();
         guardarCarritoEnStorage();
         mostrarCarrito();
+        programarCotizacion();
     }
 
     // Esta función vacía completamente el carrito.
     function vaciarCarrito() {
         carrito = [];
+        descartarClaveCompra();
         guardarCarritoEnStorage();
         mostrarCarrito();
     }
@@ -158,13 +252,20 @@ document.addEventListener("DOMContentLoaded", function () {
             return;
         }
 
-        const total = calcularTotalCarrito();
+        // Cotizo justo antes de comprar: si algo cambió, el usuario lo ve y decide antes de mandar el pedido.
+        const cotizacionActual = await cotizarCarrito();
+        if (cotizacionActual && !cotizacionActual.valido) {
+            alert('Algunos productos de tu carrito cambiaron (stock o disponibilidad). Revisá los avisos antes de comprar.');
+            return;
+        }
+        const total = cotizacionActual ? cotizacionActual.total : calcularTotalCarrito();
 
         try {
             const response = await fetch('/api/pedidos', {
                 method: 'POST',
                 headers: {
-                    'Content-Type': 'application/json'
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': obtenerClaveCompra(total)
                 },
                 body: JSON.stringify({ items: carrito, total: total })
             });
@@ -183,6 +284,8 @@ document.addEventListener("DOMContentLoaded", function () {
                 vaciarCarrito();
                 window.location.href = '/mis_pedidos';
             } else {
+                // 422: la clave quedó atada a otro contenido del carrito; el próximo intento usa una nueva.
+                if (response.status === 422) descartarClaveCompra();
                 alert(result.message || `Error del servidor: ${response.status}.`);
             }
         } catch (error) {
@@ -211,6 +314,7 @@ document.addEventListener("DOMContentLoaded", function () {
     });
 
     // --- Carga Inicial ---
-    // Cuando la página se carga por primera vez, muestro el carrito.
+    // Cuando la página se carga por primera vez, muestro el carrito y lo cotizo con los datos actuales.
     mostrarCarrito();
+    cotizarCarrito();
 });
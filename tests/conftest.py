@@ -0,0 +1,72 @@
+# Configuración común de las pruebas. La app lee la configuración al importarse, así que
+# antes de importarla la apunto a un archivo SQLite temporal (nunca a la base real) y hago
+# que el hasheo de contraseñas corra en el mismo proceso, sin pool.
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+_carpeta = tempfile.mkdtemp(prefix='frutales_tests_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_carpeta, 'tests.db')
+os.environ['PASSWORD_HASH_WORKERS'] = '0'
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as appmod # noqa: E402 (tiene que ir después de configurar el entorno)
+
+
+@pytest.fixture(scope='session')
+def aplicacion():
+    appmod.app.config['TESTING'] = True
+    # Todas las requests salen de la misma IP: sin esto las pruebas medirían los 429.
+    appmod.app.config['ADMISION_HABILITADA'] = False
+    appmod.init_db_command_function()
+    return appmod.app
+
+
+@pytest.fixture
+def sesiones(aplicacion):
+    """Devuelvo N clientes con la misma sesión iniciada (me logueo una vez y copio la cookie)."""
+    def crear(email, password, cantidad):
+        primero = aplicacion.test_client()
+        respuesta = primero.post('/api/login', json={'email': email, 'password': password})
+        assert respuesta.status_code == 200, respuesta.get_json()
+        cookie = primero.get_cookie('session')
+        clientes = [primero]
+        for _ in range(cantidad - 1):
+            cliente = aplicacion.test_client()
+            cliente.set_cookie(cookie.key, cookie.value, domain=cookie.domain, path=cookie.path)
+            clientes.append(cliente)
+        return clientes
+    return crear
+
+
+@pytest.fixture
+def crear_producto(aplicacion):
+    """Doy de alta un producto con el stock pedido y devuelvo su id."""
+    def crear(stock, precio=1000.0):
+        with aplicacion.app_context():
+            producto = appmod.Producto(nombre=f'Producto de prueba {os.urandom(4).hex()}', precio=precio,
+                                       imagen='img/manzana.jpg', stock=stock)
+            appmod.db.session.add(producto)
+            appmod.db.session.commit()
+            return producto.id
+    return crear
+
+
+@pytest.fixture
+def en_paralelo():
+    """Corro funcion(argumento) en un hilo por argumento, todos arrancando a la vez. Devuelvo los resultados en orden."""
+    def correr_todos(funcion, argumentos):
+        largada = threading.Barrier(len(argumentos))
+
+        def correr(argumento):
+            largada.wait()
+            return funcion(argumento)
+
+        with ThreadPoolExecutor(max_workers=len(argumentos)) as pool:
+            return list(pool.map(correr, argumentos))
+    return correr_todos
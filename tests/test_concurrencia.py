@@ -0,0 +1,206 @@
+# Pruebas de los caminos donde varias requests compiten por lo mismo: el stock de un producto,
+# una misma clave de idempotencia y los ids de pedidos frente al archivo. Corren contra un
+# archivo SQLite real (ver conftest.py) y con hilos de verdad, no con mocks. Dentro de un proceso
+# las escrituras pasan de a una por la conexión de escritura; la carrera entre la lectura del stock
+# y el UPDATE aparece entre workers, así que esa prueba levanta procesos aparte.
+import multiprocessing
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, UTC
+
+from sqlalchemy import func, select, update
+
+import app as appmod
+
+CLIENTE = ('cliente@frutales.com', 'cliente123')
+
+
+def _comprar(items, clave=None):
+    """Armo la función que cada hilo corre con su cliente: un POST /api/pedidos con estos items."""
+    headers = {'Idempotency-Key': clave} if clave else {}
+
+    def comprar(cliente):
+        respuesta = cliente.post('/api/pedidos', json={'items': items, 'total': 1}, headers=headers)
+        return respuesta.status_code, respuesta.get_json()
+    return comprar
+
+
+def _stock(aplicacion, producto_id):
+    with aplicacion.app_context():
+        return appmod.db.session.get(appmod.Producto, producto_id).stock
+
+
+def _unidades_vendidas(aplicacion, producto_id):
+    with aplicacion.app_context():
+        return appmod.db.session.execute(
+            select(func.coalesce(func.sum(appmod.DetallePedido.cantidad), 0))
+            .where(appmod.DetallePedido.producto_id == producto_id)
+        ).scalar()
+
+
+# --- Reserva de Stock ---
+
+def test_compras_en_paralelo_no_venden_de_mas(aplicacion, sesiones, crear_producto, en_paralelo):
+    producto_id = crear_producto(stock=5)
+    clientes = sesiones(*CLIENTE, 20)
+
+    resultados = en_paralelo(_comprar([{'id': producto_id, 'cantidad': 1}]), clientes)
+
+    codigos = [codigo for codigo, _ in resultados]
+    assert codigos.count(201) == 5
+    assert codigos.count(400) == 15
+    assert _stock(aplicacion, producto_id) == 0
+    assert _unidades_vendidas(aplicacion, producto_id) == 5
+
+
+def test_reserva_de_varias_lineas_es_todo_o_nada(aplicacion, sesiones, crear_producto, en_paralelo):
+    # Sobra stock del primero y alcanza para 3 del segundo: las compras que fallan no pueden
+    # dejar descontado el primero.
+    abundante = crear_producto(stock=100)
+    escaso = crear_producto(stock=3)
+    clientes = sesiones(*CLIENTE, 12)
+
+    resultados = en_paralelo(
+        _comprar([{'id': abundante, 'cantidad': 2}, {'id': escaso, 'cantidad': 1}]), clientes)
+
+    assert [codigo for codigo, _ in resultados].count(201) == 3
+    assert _stock(aplicacion, escaso) == 0
+    assert _stock(aplicacion, abundante) == 100 - 2 * 3
+    assert _unidades_vendidas(aplicacion, abundante) == 6
+
+
+def _worker_de_compras(producto_id, hilos, largada, resultados):
+    """
+    Hago de otro worker de gunicorn: otro proceso, con sus propias conexiones a la misma base.
+    Ahí sí la lectura del stock y el UPDATE de otra compra se pueden intercalar.
+    """
+    aplicacion = appmod.app
+    aplicacion.config.update(TESTING=True, ADMISION_HABILITADA=False)
+    primero = aplicacion.test_client()
+    primero.post('/api/login', json={'email': CLIENTE[0], 'password': CLIENTE[1]})
+    cookie = primero.get_cookie('session')
+    clientes = [primero]
+    for _ in range(hilos - 1):
+        cliente = aplicacion.test_client()
+        cliente.set_cookie(cookie.key, cookie.value, domain=cookie.domain, path=cookie.path)
+        clientes.append(cliente)
+    largada.wait()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        codigos = [codigo for codigo, _ in pool.map(_comprar([{'id': producto_id, 'cantidad': 1}]), clientes)]
+    resultados.put(codigos)
+
+
+def test_compras_desde_varios_procesos_no_venden_de_mas(aplicacion, crear_producto):
+    producto_id = crear_producto(stock=7)
+    contexto = multiprocessing.get_context('spawn')
+    largada, resultados = contexto.Barrier(4), contexto.Queue()
+    procesos = [contexto.Process(target=_worker_de_compras, args=(producto_id, 5, largada, resultados))
+                for _ in range(4)]
+    for proceso in procesos:
+        proceso.start()
+    codigos = [codigo for _ in procesos for codigo in resultados.get(timeout=120)]
+    for proceso in procesos:
+        proceso.join()
+
+    assert codigos.count(201) == 7
+    assert codigos.count(400) == 13
+    assert _stock(aplicacion, producto_id) == 0
+    assert _unidades_vendidas(aplicacion, producto_id) == 7
+
+
+# --- Idempotencia de las Compras ---
+
+def test_reintentos_simultaneos_con_la_misma_clave_crean_un_solo_pedido(aplicacion, sesiones, crear_producto,
+                                                                       en_paralelo):
+    producto_id = crear_producto(stock=10)
+    clientes = sesiones(*CLIENTE, 8)
+    clave = uuid.uuid4().hex
+
+    resultados = en_paralelo(_comprar([{'id': producto_id, 'cantidad': 2}], clave), clientes)
+
+    # Dentro de un proceso los reintentos esperan la conexión de escritura y reciben la respuesta
+    # guardada; desde otro proceso pueden recibir 409 ("compra en curso"). Nunca otro pedido.
+    assert {codigo for codigo, _ in resultados} <= {201, 409}
+    pedidos = {cuerpo['pedido_id'] for codigo, cuerpo in resultados if codigo == 201}
+    assert len(pedidos) == 1
+    assert _stock(aplicacion, producto_id) == 8
+    assert _unidades_vendidas(aplicacion, producto_id) == 2
+
+    # Un reintento posterior devuelve el mismo pedido, sin volver a descontar.
+    codigo, cuerpo = _comprar([{'id': producto_id, 'cantidad': 2}], clave)(clientes[0])
+    assert (codigo, cuerpo['pedido_id']) == (201, pedidos.pop())
+    assert _stock(aplicacion, producto_id) == 8
+
+
+def test_la_misma_clave_con_otro_carrito_da_422(aplicacion, sesiones, crear_producto):
+    producto_id = crear_producto(stock=10)
+    cliente, = sesiones(*CLIENTE, 1)
+    clave = uuid.uuid4().hex
+
+    assert _comprar([{'id': producto_id, 'cantidad': 1}], clave)(cliente)[0] == 201
+    assert _comprar([{'id': producto_id, 'cantidad': 3}], clave)(cliente)[0] == 422
+    assert _stock(aplicacion, producto_id) == 9
+
+
+# --- Ids de Pedidos frente al Archivo ---
+
+def _envejecer_pedidos(aplicacion, ids):
+    """Dejo estos pedidos como enviados hace un año, para que archive-orders los mueva."""
+    with aplicacion.app_context():
+        appmod.db.session.execute(
+            update(appmod.Pedido).where(appmod.Pedido.id.in_(ids))
+            .values(estado=appmod.ESTADO_ARCHIVABLE, fecha_pedido=datetime.now(UTC) - timedelta(days=365))
+        )
+        appmod.db.session.commit()
+
+
+def _ids(aplicacion, modelo):
+    with aplicacion.app_context():
+        return set(appmod.db.session.execute(select(modelo.id)).scalars())
+
+
+def test_pedido_nuevo_no_reusa_el_id_del_ultimo_archivado(aplicacion, sesiones, crear_producto):
+    producto_id = crear_producto(stock=10)
+    cliente, = sesiones(*CLIENTE, 1)
+    codigo, cuerpo = _comprar([{'id': producto_id, 'cantidad': 1}])(cliente)
+    assert codigo == 201
+    ultimo = cuerpo['pedido_id']
+
+    # Archivo justo el pedido más nuevo: en la tabla caliente el máximo queda por debajo de su id.
+    _envejecer_pedidos(aplicacion, [ultimo])
+    with aplicacion.app_context():
+        assert appmod.archivar_pedidos(dias=30, pausa=0) >= 1
+
+    codigo, cuerpo = _comprar([{'id': producto_id, 'cantidad': 1}])(cliente)
+    assert codigo == 201
+    assert cuerpo['pedido_id'] == ultimo + 1
+
+
+def test_compras_mientras_se_archiva_no_chocan_ids(aplicacion, sesiones, crear_producto, en_paralelo):
+    producto_id = crear_producto(stock=100)
+    clientes = sesiones(*CLIENTE, 10)
+    viejos = [_comprar([{'id': producto_id, 'cantidad': 1}])(clientes[0])[1]['pedido_id'] for _ in range(6)]
+    _envejecer_pedidos(aplicacion, viejos)
+
+    archivados = []
+
+    def archivar():
+        with aplicacion.app_context():
+            archivados.append(appmod.archivar_pedidos(dias=30, lote=2, pausa=0.01))
+
+    # El archivo corre en su propio hilo, de a lotes chicos, mientras llegan las compras.
+    hilo_archivo = threading.Thread(target=archivar)
+    hilo_archivo.start()
+    resultados = en_paralelo(_comprar([{'id': producto_id, 'cantidad': 1}]), clientes)
+    hilo_archivo.join()
+
+    assert archivados and archivados[0] >= len(viejos)
+    nuevos = [cuerpo['pedido_id'] for codigo, cuerpo in resultados if codigo == 201]
+    assert len(nuevos) == len(clientes) and len(set(nuevos)) == len(nuevos)
+
+    calientes, archivo = _ids(aplicacion, appmod.Pedido), _ids(aplicacion, appmod.PedidoArchivado)
+    assert set(viejos) <= archivo
+    assert set(nuevos) <= calientes
+    assert not calientes & archivo
+    assert not _ids(aplicacion, appmod.DetallePedido) & _ids(aplicacion, appmod.DetallePedidoArchivado)